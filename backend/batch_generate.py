@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Offline bulk dialogue generation for NPC rosters
+Streams profile/prompt items from JSONL through the provider layer and
+appends results to a JSONL file that doubles as the resume checkpoint
+
+Input lines use the same shape as data.json, with an optional id:
+    {"id": "rynn-1", "profile": {...}, "player_input": "Why do you protect this forest?"}
+
+Usage:
+    python batch_generate.py roster.jsonl results.jsonl --provider gemini --concurrency 8 --rate 5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from prompt_builder import build_prompt
+from providers import DEFAULT_SYSTEM_PROMPT, get_provider
+
+class RateLimiter:
+    """Token bucket limiting how many requests start per second"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def load_checkpoint(output_path: Path) -> Set[str]:
+    """Return ids already completed in the output file, repairing a torn last line"""
+    done: Set[str] = set()
+    if not output_path.exists():
+        return done
+
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        # A crash mid-write leaves a partial record; drop it so appends stay valid
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("status") == "ok":
+            done.add(record["id"])
+        else:
+            done.discard(record.get("id"))
+    return done
+
+def iter_items(input_path: Path) -> Iterator[Tuple[str, Optional[Dict], Optional[str]]]:
+    """Yield (id, item, error) from a JSONL file without loading it all; a bad line is an item error, not fatal"""
+    with open(input_path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                yield f"line-{line_no}", None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(item, dict):
+                yield f"line-{line_no}", None, f"Expected a JSON object, got {type(item).__name__}"
+                continue
+            yield str(item.get("id", f"line-{line_no}")), item, None
+
+class BatchRunner:
+    def __init__(self, provider, output_file, concurrency: int, rate: float,
+                 retries: int, max_tokens: int, temperature: float):
+        self.provider = provider
+        self.output_file = output_file
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stats = {"ok": 0, "failed": 0, "skipped": 0, "input_tokens": 0, "output_tokens": 0}
+
+    async def generate_one(self, item_id: str, item: Dict) -> Dict:
+        profile = item["profile"]
+        prompt = build_prompt(profile, item.get("player_input"), item.get("conversation_history"))
+        last_error = None
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                result = await self.provider.generate(
+                    prompt,
+                    system=DEFAULT_SYSTEM_PROMPT,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature
+                )
+                return {
+                    "id": item_id,
+                    "status": "ok",
+                    "character_name": profile.get("name"),
+                    "player_input": item.get("player_input"),
+                    "response": result.text,
+                    "provider": result.provider,
+                    "input_tokens": result.input_tokens,
+                    "output_tokens": result.output_tokens,
+                    "latency": round(time.monotonic() - started, 3)
+                }
+            except Exception as e:
+                last_error = f"{type(e).__name__}: {e}"
+                if attempt < self.retries:
+                    await asyncio.sleep(min(30, 2 ** attempt))
+        return {"id": item_id, "status": "error", "error": last_error}
+
+    def write(self, record: Dict):
+        self.output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.output_file.flush()
+        if record["status"] == "ok":
+            self.stats["ok"] += 1
+            self.stats["input_tokens"] += record["input_tokens"]
+            self.stats["output_tokens"] += record["output_tokens"]
+        else:
+            self.stats["failed"] += 1
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            item_id, item = job
+            try:
+                record = await self.generate_one(item_id, item)
+            except Exception as e:
+                record = {"id": item_id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+            self.write(record)
+
+    async def run(self, items: Iterator[Tuple[str, Optional[Dict], Optional[str]]], done: Set[str]):
+        # Bounded queue keeps memory flat no matter how large the roster is
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.concurrency)]
+        for item_id, item, error in items:
+            if item_id in done:
+                self.stats["skipped"] += 1
+                continue
+            if error:
+                self.write({"id": item_id, "status": "error", "error": error})
+                continue
+            await queue.put((item_id, item))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+def print_report(stats: Dict, elapsed: float):
+    processed = stats["ok"] + stats["failed"]
+    print("\n📊 Batch Summary")
+    print("=" * 50)
+    print(f"✅ Succeeded: {stats['ok']}")
+    print(f"❌ Failed: {stats['failed']}")
+    print(f"⏭️  Skipped (already done): {stats['skipped']}")
+    print(f"⏱️  Elapsed: {elapsed:.1f}s")
+    print(f"🚀 Throughput: {processed / elapsed if elapsed else 0:.2f} items/s")
+    print(f"🔤 Tokens: {stats['input_tokens']} in / {stats['output_tokens']} out"
+          f" ({stats['output_tokens'] / elapsed if elapsed else 0:.1f} out tokens/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-generate NPC dialogue from a JSONL roster")
+    parser.add_argument("input", type=Path, help="JSONL file of {id, profile, player_input} items")
+    parser.add_argument("output", type=Path, help="JSONL results file, also used as the resume checkpoint")
+    parser.add_argument("--provider", default=None, help="gemini, openai or fake (default: $DIALOGUE_PROVIDER or gemini)")
+    parser.add_argument("--model", default=None, help="Override the provider's model name")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum in-flight requests")
+    parser.add_argument("--rate", type=float, default=0, help="Maximum requests started per second (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per item on provider errors")
+    parser.add_argument("--max-tokens", type=int, default=300)
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and overwrite the output")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if not args.input.exists():
+        print(f"❌ Input file not found: {args.input}")
+        sys.exit(1)
+
+    provider_kwargs = {"model_name": args.model} if args.model else {}
+    provider = get_provider(args.provider, **provider_kwargs)
+
+    if args.restart and args.output.exists():
+        os.remove(args.output)
+    done = load_checkpoint(args.output)
+    if done:
+        print(f"♻️  Resuming: {len(done)} items already completed")
+
+    print(f"🎮 Generating with {provider.name} (concurrency={args.concurrency}, rate={args.rate or 'unlimited'})")
+    started = time.monotonic()
+    with open(args.output, "a", encoding="utf-8") as output_file:
+        runner = BatchRunner(provider, output_file, args.concurrency, args.rate,
+                             args.retries, args.max_tokens, args.temperature)
+        try:
+            asyncio.run(runner.run(iter_items(args.input), done))
+        except KeyboardInterrupt:
+            print("\n🛑 Interrupted; rerun the same command to resume")
+    print_report(runner.stats, time.monotonic() - started)
+    if runner.stats["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Incremental parsers for bulk uploads
+Turn a stream of byte chunks into JSON items without buffering the whole body,
+for both NDJSON and a top-level JSON array
+"""
+
+import codecs
+import json
+from typing import Any, AsyncIterator, Tuple
+
+class BulkParseError(ValueError):
+    pass
+
+# Upper bound on a single array element or NDJSON line, so malformed input can't grow the buffer forever
+MAX_ITEM_BYTES = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+async def iter_text(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode UTF-8 byte chunks, keeping multi-byte characters split across chunks intact"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def _parse_line(index: int, line: str) -> Tuple[int, Any, str]:
+    try:
+        return index, json.loads(line), None
+    except ValueError as e:
+        return index, None, f"Invalid JSON: {e}"
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Any, str]]:
+    """Yield (index, item, error) per non-empty line; a bad or over-long line is an item error, not fatal"""
+    # Parts of the line still waiting for its newline, so each chunk is scanned once
+    pending = []
+    pending_size = 0
+    skipping = False
+    index = 0
+    async for text in iter_text(chunks):
+        start = 0
+        while start < len(text):
+            end = text.find("\n", start)
+            if end == -1:
+                if not skipping:
+                    pending.append(text[start:])
+                    pending_size += len(text) - start
+                    if pending_size > MAX_ITEM_BYTES:
+                        # Report the line now and drop the rest of it as it arrives
+                        yield index, None, f"Line exceeds {MAX_ITEM_BYTES} bytes"
+                        index += 1
+                        pending, pending_size, skipping = [], 0, True
+                break
+            if skipping:
+                skipping = False
+            else:
+                pending.append(text[start:end])
+                line = "".join(pending)
+                if line.strip():
+                    yield _parse_line(index, line)
+                    index += 1
+            pending, pending_size = [], 0
+            start = end + 1
+    line = "".join(pending)
+    if not skipping and line.strip():
+        yield _parse_line(index, line)
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Any, str]]:
+    """Yield (index, item, None) for each element of a top-level JSON array"""
+    buffer = ""
+    position = 0
+    state = "start"  # start -> value -> separator -> ... -> done
+    index = 0
+    finished = False
+    stream = iter_text(chunks)
+
+    while True:
+        # Skip whitespace between tokens
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if state == "start":
+                if char != "[":
+                    raise BulkParseError("Expected a JSON array")
+                position += 1
+                state = "first"
+                continue
+            if char == "]" and state in ("first", "separator"):
+                state = "done"
+                position += 1
+                continue
+            if state == "separator":
+                if char != ",":
+                    raise BulkParseError(f"Expected ',' or ']' after item {index - 1}")
+                position += 1
+                state = "value"
+                continue
+            if state in ("first", "value"):
+                try:
+                    item, end = _decoder.raw_decode(buffer, position)
+                except ValueError:
+                    item, end = None, -1
+                # A scalar ending exactly at the buffer edge may continue in the next chunk
+                if end != -1 and (end < len(buffer) or finished or isinstance(item, (dict, list))):
+                    yield index, item, None
+                    index += 1
+                    position = end
+                    state = "separator"
+                    continue
+                if finished or len(buffer) - position > MAX_ITEM_BYTES:
+                    raise BulkParseError(f"Invalid JSON at item {index}")
+            if state == "done":
+                raise BulkParseError("Unexpected data after JSON array")
+
+        if finished:
+            if state != "done":
+                raise BulkParseError("Unexpected end of JSON array")
+            return
+
+        # Need more input: drop what has been consumed and read the next chunk
+        buffer = buffer[position:]
+        position = 0
+        try:
+            buffer += await stream.__anext__()
+        except StopAsyncIteration:
+            finished = True
+
+def detect_format(content_type: str, first_bytes: bytes) -> str:
+    """Pick ndjson or array from the Content-Type, falling back to sniffing"""
+    content_type = (content_type or "").lower()
+    if "ndjson" in content_type or "jsonlines" in content_type or "x-jsonl" in content_type:
+        return "ndjson"
+    return "array" if first_bytes.lstrip()[:1] == b"[" else "ndjson"
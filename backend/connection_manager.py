@@ -0,0 +1,208 @@
+"""
+WebSocket connection manager
+Every connection gets a bounded outbound queue drained by its own sender task,
+so a slow client never stalls the code producing frames. When the queue is full
+the connection either drops its oldest frame or is disconnected. Opt-in
+heartbeats and idle reaping close half-open sockets. Broadcasts go to every
+connection subscribed to a channel (a character id) and encode each frame
+once per codec instead of once per listener
+
+Configure with WS_QUEUE_SIZE, WS_QUEUE_POLICY=drop|disconnect,
+WS_HEARTBEAT_INTERVAL and WS_IDLE_TIMEOUT (seconds, 0 disables)
+"""
+
+import asyncio
+import itertools
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from serialization import send_payload
+
+QUEUE_POLICIES = ("drop", "disconnect")
+# Policy violation: the client does not read its frames fast enough
+SLOW_CONSUMER_CLOSE_CODE = 1008
+IDLE_CLOSE_CODE = 1001
+
+class ManagedConnection:
+    """One WebSocket with its outbound queue and sender task"""
+    __slots__ = ("id", "websocket", "codec", "key", "channels", "queue", "last_seen",
+                 "dropped", "closed", "sender")
+
+    def __init__(self, connection_id: int, websocket: WebSocket, codec, key: str,
+                 channels: Iterable[str], queue_size: int):
+        self.id = connection_id
+        self.websocket = websocket
+        self.codec = codec
+        self.key = key
+        self.channels = set(channels)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.last_seen = time.monotonic()
+        self.dropped = 0
+        self.closed = False
+        self.sender: Optional[asyncio.Task] = None
+
+class ConnectionManager:
+    """Tracks local WebSocket connections, their queues, heartbeats and channels"""
+
+    def __init__(self, queue_size: int = 64, policy: str = "drop",
+                 heartbeat_interval: float = 0.0, idle_timeout: float = 0.0):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}'. Choose from: {', '.join(QUEUE_POLICIES)}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.connections: Dict[int, ManagedConnection] = {}
+        self.channels: Dict[str, Set[ManagedConnection]] = {}
+        self._ids = itertools.count(1)
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Slow-consumer disconnects run in the background; holding them keeps them from being collected
+        self._disconnects: Set[asyncio.Task] = set()
+
+    def start(self):
+        if (self.heartbeat_interval > 0 or self.idle_timeout > 0) and self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        await asyncio.gather(*(self.disconnect(conn) for conn in list(self.connections.values())))
+
+    def register(self, websocket: WebSocket, codec, key: str, channels: Iterable[str] = ()) -> ManagedConnection:
+        """Track an accepted WebSocket and start its sender"""
+        conn = ManagedConnection(next(self._ids), websocket, codec, key, channels, self.queue_size)
+        self.connections[conn.id] = conn
+        for channel in conn.channels:
+            self.channels.setdefault(channel, set()).add(conn)
+        conn.sender = asyncio.create_task(self._send_loop(conn))
+        return conn
+
+    def subscribe(self, conn: ManagedConnection, channel: str):
+        """Add a channel to a live connection, e.g. when a multiplexed socket first talks to a character"""
+        if conn.closed or channel in conn.channels:
+            return
+        conn.channels.add(channel)
+        self.channels.setdefault(channel, set()).add(conn)
+
+    def unregister(self, conn: ManagedConnection):
+        """Forget a connection whose socket is gone"""
+        conn.closed = True
+        self.connections.pop(conn.id, None)
+        for channel in conn.channels:
+            listeners = self.channels.get(channel)
+            if listeners is not None:
+                listeners.discard(conn)
+                if not listeners:
+                    del self.channels[channel]
+        if conn.sender and conn.sender is not asyncio.current_task():
+            conn.sender.cancel()
+
+    async def disconnect(self, conn: ManagedConnection, code: int = 1000):
+        """Close a connection from the server side"""
+        if conn.closed:
+            return
+        self.unregister(conn)
+        try:
+            await conn.websocket.close(code=code)
+        except (RuntimeError, WebSocketDisconnect):
+            pass
+
+    def touch(self, conn: ManagedConnection):
+        """Record inbound traffic; any frame counts as a heartbeat reply"""
+        conn.last_seen = time.monotonic()
+
+    def send(self, conn: ManagedConnection, message: Any) -> bool:
+        """Queue one frame; False if the connection is closed or was closed for being slow"""
+        return self._enqueue(conn, conn.codec.encode(message))
+
+    async def flush(self, conn: ManagedConnection, timeout: float = 5.0):
+        """Wait until the connection's queue has been written out"""
+        try:
+            await asyncio.wait_for(conn.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def broadcast(self, channel: str, message: Any) -> Dict[str, int]:
+        """Queue a frame for every listener of a channel, encoding it once per codec"""
+        listeners = list(self.channels.get(channel, ()))
+        encoded: Dict[str, Any] = {}
+        queued = 0
+        for conn in listeners:
+            payload = encoded.get(conn.codec.name)
+            if payload is None:
+                payload = encoded[conn.codec.name] = conn.codec.encode(message)
+            if self._enqueue(conn, payload):
+                queued += 1
+        return {"listeners": len(listeners), "queued": queued, "rejected": len(listeners) - queued}
+
+    def _enqueue(self, conn: ManagedConnection, payload) -> bool:
+        if conn.closed:
+            return False
+        try:
+            conn.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            pass
+        conn.dropped += 1
+        if self.policy == "disconnect":
+            task = asyncio.create_task(self.disconnect(conn, SLOW_CONSUMER_CLOSE_CODE))
+            self._disconnects.add(task)
+            task.add_done_callback(self._disconnects.discard)
+            return False
+        # Keep the newest frames; a lagging client cares about the latest lines
+        conn.queue.get_nowait()
+        conn.queue.task_done()
+        conn.queue.put_nowait(payload)
+        return True
+
+    async def _send_loop(self, conn: ManagedConnection):
+        try:
+            while True:
+                payload = await conn.queue.get()
+                try:
+                    await send_payload(conn.websocket, payload)
+                finally:
+                    conn.queue.task_done()
+        except (RuntimeError, WebSocketDisconnect, OSError):
+            # The socket went away under us; the receive side finishes the cleanup
+            self.unregister(conn)
+
+    async def _heartbeat(self):
+        # Without pings, still wake up often enough to reap idle sockets on time
+        period = self.heartbeat_interval or self.idle_timeout / 2
+        while True:
+            await asyncio.sleep(period)
+            now = time.monotonic()
+            for conn in list(self.connections.values()):
+                if self.idle_timeout and now - conn.last_seen > self.idle_timeout:
+                    await self.disconnect(conn, IDLE_CLOSE_CODE)
+                elif self.heartbeat_interval:
+                    # Clients answer with {"type": "pong"}; any frame they send resets the idle clock
+                    self.send(conn, {"type": "ping", "ts": time.time()})
+
+    def memory_usage(self) -> Dict[str, Tuple[int, int]]:
+        # Queued payloads are already-encoded str/bytes, so getsizeof is exact; Queue has no public view
+        return {"sockets": (len(self.connections), sum(sys.getsizeof(payload) for conn in self.connections.values()
+                                                       for payload in conn.queue._queue))}
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connections": len(self.connections),
+            "channels": len(self.channels),
+            "queued_frames": sum(conn.queue.qsize() for conn in self.connections.values()),
+            "dropped_frames": sum(conn.dropped for conn in self.connections.values())
+        }
+
+def create_connection_manager() -> ConnectionManager:
+    """Build a manager from the WS_* environment variables"""
+    return ConnectionManager(
+        queue_size=int(os.getenv("WS_QUEUE_SIZE", "64")),
+        policy=os.getenv("WS_QUEUE_POLICY", "drop").lower(),
+        heartbeat_interval=float(os.getenv("WS_HEARTBEAT_INTERVAL", "0")),
+        idle_timeout=float(os.getenv("WS_IDLE_TIMEOUT", "0"))
+    )
@@ -1,21 +1,26 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # Load .env from project root or same directory
 load_dotenv()
 
-# Safely load API key
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY not found in environment variables.")
+client = None
 
-# Create client
-client = OpenAI(api_key=api_key)
+
+def get_client():
+    """Create the OpenAI client on first use so importing this module stays cheap"""
+    global client
+    if client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables.")
+        from openai import OpenAI
+        client = OpenAI(api_key=api_key)
+    return client
 
 
 def generate_dialogue(prompt: str):
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an NPC in a fantasy world responding to a player."},
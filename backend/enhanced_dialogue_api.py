@@ -1,13 +1,32 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, List, Optional
-import json
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
 import asyncio
+import itertools
+import secrets
+import time
+import tracemalloc
 from datetime import datetime
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
+from jobs import JobContext, TERMINAL_STATUSES, create_job_manager
+from bulk_import import BulkParseError, detect_format, iter_json_array, iter_ndjson
+from state_store import create_state_store
+from serialization import DefaultJSONResponse, InvalidFrame, dumps, negotiate_codec, receive_frame
+from providers import DEFAULT_SYSTEM_PROMPT, ProviderConfigError, estimate_tokens, get_provider
+from lifecycle import RECONNECT_CLOSE_CODE, DrainMiddleware, drain
+from connection_manager import ManagedConnection, create_connection_manager
+from turn_scheduler import Turn, TurnScheduler, create_turn_scheduler
+from stream_buffer import create_stream_buffers
+from metrics import REGISTRY, MetricsMiddleware, metrics_response, observe_generation, record_cache, record_error
+from tracing import TracingMiddleware, span, start_trace
+from loop_monitor import create_loop_monitor
+from memory import TracemallocSnapshots, create_memory_guard, rss_bytes, structure_stats, track_memory
+from profiler import ProfilerBusy, ProfilingMiddleware, create_continuous_profiler, profile_hz, sample_for
+from traffic_capture import TrafficCaptureMiddleware, create_traffic_capture
 try:
     from prompt_builder import build_prompt
 except ImportError:
@@ -43,7 +62,7 @@ IMPORTANT: Maintain consistency in your character's voice, personality, and spea
 
 load_dotenv()
 
-app = FastAPI()
+app = FastAPI(default_response_class=DefaultJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -53,17 +72,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Gemini AI
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise ValueError("Google API key not found. Set GOOGLE_API_KEY in .env file.")
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+# Stage timings as a Server-Timing header (and spans in TRACE_EXPORT_PATH)
+app.add_middleware(TracingMiddleware)
 
-# In-memory storage for conversations and character profiles
-conversations: Dict[str, List[Dict]] = {}
-character_profiles: Dict[str, Dict] = {}
-active_connections: Dict[str, WebSocket] = {}
+# Compress large payloads such as full character lists and long histories
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Per-route latency and status counts for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Records anonymized player traffic to CAPTURE_PATH for benchmarks/replay.py
+traffic_capture = create_traffic_capture()
+if traffic_capture:
+    app.add_middleware(TrafficCaptureMiddleware, capture=traffic_capture)
+
+# Profiles PROFILE_SAMPLE_RATE of requests into rotating files (PROFILE_* env)
+continuous_profiler = create_continuous_profiler()
+if continuous_profiler:
+    app.add_middleware(ProfilingMiddleware, profiler=continuous_profiler)
+
+# Outermost, so a draining worker turns new work away before anything else runs
+app.add_middleware(DrainMiddleware)
+
+# Gemini unless DIALOGUE_PROVIDER says otherwise; the SDK is imported and the
+# credentials checked on the first generation, so the app starts without them
+provider = get_provider()
+BRANCHING_SYSTEM_PROMPT = "You are an expert game dialogue writer. Create engaging, branching conversations that maintain character consistency."
+
+# Characters and conversations live in the state store (STATE_BACKEND) so several
+# workers can share them; sockets are always local to this process
+state = create_state_store()
+# Bounded per-socket send queues, heartbeats and per-character broadcast channels (WS_* env)
+manager = create_connection_manager()
+# Recent WebSocket replies per session, resumable after a reconnect (STREAM_BUFFER_* env)
+streams = create_stream_buffers()
+# Event-loop lag watchdog, off unless LOOP_MONITOR_THRESHOLD_MS is set
+loop_monitor = create_loop_monitor()
+# Per-structure memory in /metrics; above MEMORY_SOFT_LIMIT_MB the guard evicts
+track_memory(state.memory_usage)
+track_memory(streams.memory_usage)
+track_memory(manager.memory_usage)
+memory_guard = create_memory_guard()
+if memory_guard:
+    memory_guard.on_pressure("reply_buffers")(streams.evict_finished)
+    memory_guard.on_pressure("sessions")(state.evict_sessions)
+snapshots = TracemallocSnapshots(frames=int(os.getenv("TRACEMALLOC_FRAMES", "1")))
 
 class CharacterProfile(BaseModel):
     name: str
@@ -94,71 +147,204 @@ class BranchingDialogueRequest(BaseModel):
     session_id: str
     selected_option: Optional[str] = None
 
+class JobRequest(BaseModel):
+    kind: str
+    payload: Dict[str, Any] = {}
+
+class BroadcastRequest(BaseModel):
+    text: str
+
+class ReplicateRequest(BaseModel):
+    characters: Dict[str, Dict[str, Any]]
+
+# Identifies this process, so the gateway notices a restarted node and replicates the characters again
+BOOT_ID = secrets.token_hex(4)
+# Profiles validated per bulk-import insert
+BULK_BATCH_SIZE = 500
+MAX_PAGE_SIZE = 1000
+# build_prompt only looks at the last 5 turns
+PROMPT_HISTORY_TURNS = 5
+
+def add_characters(batch: List[Dict]) -> List[str]:
+    """Store a batch of validated profiles in one write"""
+    return state.add_characters(batch)
+
+def add_character(character_data: Dict) -> str:
+    """Store a validated character profile and return its id"""
+    return state.add_characters([character_data])[0]
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors())
+
 @app.post("/api/character/create")
 async def create_character(profile: CharacterProfile):
     """Create a new character profile"""
-    character_id = f"char_{len(character_profiles) + 1}"
     character_data = profile.dict()
-    character_profiles[character_id] = character_data
+    character_id = add_character(character_data)
     return {"character_id": character_id, "profile": character_data}
 
+@app.post("/api/character/bulk")
+async def bulk_create_characters(request: Request):
+    """Import many character profiles from NDJSON or a JSON array"""
+    chunks = request.stream()
+    first_chunk = b""
+    async for chunk in chunks:
+        if chunk:
+            first_chunk = chunk
+            break
+
+    async def body():
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+
+    body_format = detect_format(request.headers.get("content-type"), first_chunk)
+    parse = iter_ndjson if body_format == "ndjson" else iter_json_array
+
+    results = []
+    batch: List[Dict] = []
+    batch_indexes: List[int] = []
+
+    def flush_batch():
+        for index, character_id in zip(batch_indexes, add_characters(batch)):
+            results.append({"index": index, "character_id": character_id})
+        batch.clear()
+        batch_indexes.clear()
+
+    parse_error = None
+    try:
+        async for index, item, error in parse(body()):
+            if error is None and not isinstance(item, dict):
+                error = "Expected a JSON object"
+            if error is None:
+                try:
+                    batch.append(CharacterProfile(**item).dict())
+                    batch_indexes.append(index)
+                except ValidationError as e:
+                    error = format_validation_error(e)
+            if error is not None:
+                results.append({"index": index, "error": error})
+            if len(batch) >= BULK_BATCH_SIZE:
+                flush_batch()
+    except BulkParseError as e:
+        parse_error = str(e)
+    flush_batch()
+
+    results.sort(key=lambda result: result["index"])
+    created = sum(1 for result in results if "character_id" in result)
+    content = {
+        "format": body_format,
+        "created": created,
+        "failed": len(results) - created,
+        "results": results
+    }
+    if parse_error:
+        content["parse_error"] = parse_error
+        return DefaultJSONResponse(status_code=400, content=content)
+    return content
+
+@app.post("/api/character/replicate")
+async def replicate_characters(request: ReplicateRequest):
+    """Store characters created on another node under their ids; called by the gateway"""
+    for character_id in request.characters:
+        prefix, _, number = character_id.partition("_")
+        if prefix != "char" or not number.isdigit():
+            raise HTTPException(status_code=400, detail=f"Invalid character id '{character_id}'")
+    state.put_characters(request.characters)
+    return {"stored": len(request.characters)}
+
+def prepare_dialogue(character_id: str, session_id: str, message: str):
+    """Look up the character and build its prompt from the session history"""
+    session_key = f"{character_id}_{session_id}"
+    with span("history"):
+        character = state.get_character(character_id)
+        if character is None:
+            raise HTTPException(status_code=404, detail="Character not found")
+        conversation_history = state.recent_turns(session_key, PROMPT_HISTORY_TURNS)
+    with span("prompt"):
+        return character, session_key, build_prompt(character, message, conversation_history)
+
+def record_dialogue(session_key: str, character: Dict, message: str, npc_response: str):
+    with span("store"):
+        state.append_turns(session_key, [
+            {"speaker": "Player", "content": message, "timestamp": datetime.now().isoformat()},
+            {"speaker": character["name"], "content": npc_response, "timestamp": datetime.now().isoformat()}
+        ])
+
 @app.post("/api/dialogue/generate")
 async def generate_dialogue(request: DialogueRequest):
     """Generate dialogue with character consistency"""
     try:
-        if request.character_id not in character_profiles:
-            raise HTTPException(status_code=404, detail="Character not found")
-        
-        character = character_profiles[request.character_id]
-        session_key = f"{request.character_id}_{request.session_id}"
-        
-        # Get conversation history
-        conversation_history = conversations.get(session_key, [])
+        character, session_key, prompt = prepare_dialogue(request.character_id, request.session_id, request.message)
         
-        # Build prompt with context
-        prompt = build_prompt(character, request.message, conversation_history)
-        
-        # Generate response using Gemini
-        try:
-            response = model.generate_content(
-                f"You are an expert NPC dialogue generator. Maintain character consistency and provide engaging, immersive responses.\n\n{prompt}",
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=300,
-                    temperature=0.8
-                )
-            )
-            npc_response = response.text.strip()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error generating dialogue: {str(e)}")
+        npc_response = await generate_text(prompt, system=DEFAULT_SYSTEM_PROMPT)
         
         # Store conversation
-        conversations[session_key] = conversations.get(session_key, []) + [
-            {"speaker": "Player", "content": request.message, "timestamp": datetime.now().isoformat()},
-            {"speaker": character["name"], "content": npc_response, "timestamp": datetime.now().isoformat()}
-        ]
+        record_dialogue(session_key, character, request.message, npc_response)
         
-        return {
-            "response": npc_response,
-            "character_name": character["name"],
-            "session_id": request.session_id
-        }
+        with span("serialize"):
+            return DefaultJSONResponse({
+                "response": npc_response,
+                "character_name": character["name"],
+                "session_id": request.session_id
+            })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/dialogue/branching")
-async def generate_branching_dialogue(request: BranchingDialogueRequest):
-    """Generate branching dialogue with multiple conversation paths"""
+async def generate_text(prompt: str, system: Optional[str] = None, max_tokens: int = 300,
+                        temperature: float = 0.8, action: str = "generating dialogue") -> str:
+    """Run the provider; missing credentials become 503, other failures 500"""
+    started = time.perf_counter()
     try:
-        if request.character_id not in character_profiles:
-            raise HTTPException(status_code=404, detail="Character not found")
-        
-        character = character_profiles[request.character_id]
-        
-        # Create branching dialogue structure
-        if not request.selected_option:
-            # Initial dialogue with options
-            prompt = f"""
+        with span("provider", provider=provider.name):
+            result = await provider.generate(prompt, system=system, max_tokens=max_tokens, temperature=temperature)
+    except ProviderConfigError as e:
+        record_error(e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        record_error(e)
+        raise HTTPException(status_code=500, detail=f"Error {action}: {str(e)}")
+    observe_generation(provider.name, "generate", time.perf_counter() - started,
+                       result.input_tokens, result.output_tokens)
+    return result.text
+
+async def stream_text(prompt: str, system: Optional[str] = None, max_tokens: int = 300,
+                      temperature: float = 0.8, action: str = "generating dialogue") -> AsyncIterator[str]:
+    """Stream the provider's reply in chunks; errors map to status codes like generate_text"""
+    started = time.perf_counter()
+    first_token = None
+    output_chars = 0
+    try:
+        async for chunk in provider.stream(prompt, system=system, max_tokens=max_tokens, temperature=temperature):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            output_chars += len(chunk)
+            yield chunk
+    except ProviderConfigError as e:
+        record_error(e)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        record_error(e)
+        raise HTTPException(status_code=500, detail=f"Error {action}: {str(e)}")
+    # Streams carry no usage report, so tokens are estimated like the fake provider does
+    observe_generation(provider.name, "stream", time.perf_counter() - started,
+                       estimate_tokens(f"{system or ''}{prompt}"), max(1, output_chars // 4) if output_chars else 0,
+                       first_token_seconds=first_token)
+
+def build_branching_prompt(character: Dict, selected_option: Optional[str] = None) -> str:
+    """Build the prompt for an opening or follow-up branching dialogue node"""
+    if not selected_option:
+        # Initial dialogue with options
+        return f"""
             Create a branching dialogue for {character['name']}, a {character['role']} in a {character['setting']} setting.
             Character personality: {character['personality']}
             Backstory: {character['backstory']}
@@ -171,10 +357,9 @@ async def generate_branching_dialogue(request: BranchingDialogueRequest):
             OPTION3: [third option text]
             OPTION4: [fourth option text]
             """
-        else:
-            # Follow-up based on selected option
-            prompt = f"""
-            Continue the conversation as {character['name']} responding to the player's choice: "{request.selected_option}"
+    # Follow-up based on selected option
+    return f"""
+            Continue the conversation as {character['name']} responding to the player's choice: "{selected_option}"
             Maintain character consistency and provide 2-3 new conversation options.
             Format as:
             DIALOGUE: [character's response]
@@ -182,36 +367,58 @@ async def generate_branching_dialogue(request: BranchingDialogueRequest):
             OPTION2: [second option text]
             OPTION3: [third option text]
             """
+
+def parse_branching_response(dialogue_text: str):
+    """Split a DIALOGUE:/OPTIONn: formatted response into dialogue and options"""
+    dialogue = ""
+    options = []
+    for line in dialogue_text.split('\n'):
+        if line.startswith('DIALOGUE:'):
+            dialogue = line.replace('DIALOGUE:', '').strip()
+        elif line.startswith('OPTION'):
+            options.append(line.split(':', 1)[1].strip())
+    return dialogue, options
+
+async def generate_branching(character: Dict, selected_option: Optional[str] = None) -> Dict:
+    """Generate one branching dialogue node for a character"""
+    with span("prompt"):
+        prompt = build_branching_prompt(character, selected_option)
+    dialogue_text = await generate_text(prompt, system=BRANCHING_SYSTEM_PROMPT, max_tokens=400,
+                                        action="generating branching dialogue")
+
+    # Parse the response to extract dialogue and options
+    with span("parse"):
+        dialogue, options = parse_branching_response(dialogue_text)
+    return {
+        "dialogue": dialogue,
+        "options": options,
+        "character_name": character["name"]
+    }
+
+async def translate_text(text: str, target_language: str) -> str:
+    """Translate text while keeping the original tone"""
+    return await generate_text(
+        f"Translate the following text to {target_language}. Maintain the tone and style of the original text.\n\n{text}",
+        max_tokens=200,
+        temperature=0.3,
+        action="translating text"
+    )
+
+@app.post("/api/dialogue/branching")
+async def generate_branching_dialogue(request: BranchingDialogueRequest):
+    """Generate branching dialogue with multiple conversation paths"""
+    try:
+        with span("character"):
+            character = state.get_character(request.character_id)
+        if character is None:
+            raise HTTPException(status_code=404, detail="Character not found")
         
-        try:
-            response = model.generate_content(
-                f"You are an expert game dialogue writer. Create engaging, branching conversations that maintain character consistency.\n\n{prompt}",
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=400,
-                    temperature=0.8
-                )
-            )
-            dialogue_text = response.text.strip()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error generating branching dialogue: {str(e)}")
-        
-        # Parse the response to extract dialogue and options
-        lines = dialogue_text.split('\n')
-        dialogue = ""
-        options = []
-        
-        for line in lines:
-            if line.startswith('DIALOGUE:'):
-                dialogue = line.replace('DIALOGUE:', '').strip()
-            elif line.startswith('OPTION'):
-                options.append(line.split(':', 1)[1].strip())
-        
-        return {
-            "dialogue": dialogue,
-            "options": options,
-            "character_name": character["name"]
-        }
+        node = await generate_branching(character, request.selected_option)
+        with span("serialize"):
+            return DefaultJSONResponse(node)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -225,65 +432,516 @@ async def translate_dialogue(request: dict):
         if not text:
             raise HTTPException(status_code=400, detail="Text is required")
         
-        try:
-            response = model.generate_content(
-                f"Translate the following text to {target_language}. Maintain the tone and style of the original text.\n\n{text}",
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=200,
-                    temperature=0.3
-                )
-            )
-            translated_text = response.text.strip()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error translating text: {str(e)}")
+        translated_text = await translate_text(text, target_language)
         
-        return {
-            "original": text,
-            "translated": translated_text,
-            "target_language": target_language
-        }
+        with span("serialize"):
+            return DefaultJSONResponse({
+                "original": text,
+                "translated": translated_text,
+                "target_language": target_language
+            })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Concurrent turns allowed on one socket
+MAX_INFLIGHT_TURNS = int(os.getenv("WS_MAX_INFLIGHT", "32"))
+
+def turn_scheduler_for(run_turn) -> TurnScheduler:
+    """Scheduler for one socket; replaced and merged turns end their streams with a cancelled frame"""
+    def on_cancel(session_key: str, turn: Turn, reason: str, replaced_by):
+        stream = streams.get(session_key, turn.request_id)
+        if stream is not None:
+            stream.publish({"type": "cancelled", **turn.context, "reason": reason, "replaced_by": replaced_by})
+            streams.finish(stream)
+    # Counted as in-flight so a draining worker finishes pending replies first
+    return create_turn_scheduler(run_turn, on_cancel, track=drain.track)
+
+def submit_turn(conn: ManagedConnection, scheduler: TurnScheduler, session_key: str, turn: Turn,
+                supersede: Optional[bool]):
+    """Open the turn's resumable stream with this socket following it, then schedule the turn"""
+    stream = streams.open(session_key, turn.request_id)
+    # Queued for the connection's sender; a slow reader never blocks generation
+    stream.subscribe(conn.id, lambda frame: manager.send(conn, frame), chunks=turn.stream)
+    scheduler.submit(session_key, turn, supersede)
+
 @app.websocket("/ws/{character_id}/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, character_id: str, session_id: str):
-    """WebSocket endpoint for real-time dialogue"""
-    await websocket.accept()
-    active_connections[f"{character_id}_{session_id}"] = websocket
+    """WebSocket endpoint for real-time dialogue; offer the msgpack subprotocol for binary frames"""
+    codec, subprotocol = negotiate_codec(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    session_key = f"{character_id}_{session_id}"
+    # Subscribed to the character's channel, so broadcasts from that NPC reach this socket
+    conn = manager.register(websocket, codec, session_key, channels=[character_id])
+    state.register_connection(session_key)
+    request_ids = itertools.count(1)
+    scheduler = turn_scheduler_for(lambda turn: stream_reply(character_id, session_id, turn))
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            # Generate response
-            request = DialogueRequest(
-                message=message_data["message"],
-                character_id=character_id,
-                session_id=session_id
-            )
+            try:
+                message_data = await receive_frame(websocket, codec)
+            except InvalidFrame as e:
+                manager.touch(conn)
+                manager.send(conn, {"type": "error", "request_id": None, "status": 400, "detail": str(e)})
+                continue
+            manager.touch(conn)
+            if drain.draining:
+                await scheduler.wait()
+                await send_reconnect(conn)
+                return
+            if not isinstance(message_data, dict):
+                manager.send(conn, {"type": "error", "request_id": None, "status": 400,
+                                    "detail": "Frames must be JSON objects"})
+                continue
+            if message_data.get("type") == "pong":
+                continue
+            if message_data.get("type") == "resume":
+                resume_stream(conn, session_key, message_data, {"request_id": message_data.get("request_id")})
+                continue
             
-            response = await generate_dialogue(request)
-            
-            # Send response back through WebSocket
-            await websocket.send_text(json.dumps(response))
+            request_id = message_data.get("request_id")
+            if request_id is None:
+                # Unique per worker, so ids from an earlier socket of the session stay resumable
+                request_id = f"{conn.id}-{next(request_ids)}"
+            if not isinstance(message_data.get("message"), str):
+                manager.send(conn, {"type": "error", "request_id": request_id, "status": 400,
+                                    "detail": "message is required"})
+                continue
+            if len(scheduler.tasks) >= MAX_INFLIGHT_TURNS:
+                manager.send(conn, {"type": "error", "request_id": request_id, "status": 429,
+                                    "detail": "Too many requests in flight on this connection"})
+                continue
+            # A newer message cancels the session's pending reply unless the client asks otherwise
+            # Chunk frames only for clients that ask for them; everyone gets the done frame
+            turn = Turn(request_id, message_data["message"], {"request_id": request_id}, bool(message_data.get("stream")))
+            submit_turn(conn, scheduler, session_key, turn, message_data.get("supersede"))
             
     except WebSocketDisconnect:
-        if f"{character_id}_{session_id}" in active_connections:
-            del active_connections[f"{character_id}_{session_id}"]
+        pass
+    finally:
+        release_turns(scheduler)
+        manager.unregister(conn)
+        state.unregister_connection(session_key)
+
+# Frames on the multiplexed socket carry these fields, and every reply echoes them
+ENVELOPE_FIELDS = ("request_id", "character_id", "session_id")
+
+@app.websocket("/ws")
+async def multiplexed_websocket(websocket: WebSocket):
+    """One socket for all of a player's NPC conversations; replies stream back interleaved"""
+    codec, subprotocol = negotiate_codec(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    conn = manager.register(websocket, codec, "mux")
+    sessions: Set[str] = set()
+    scheduler = turn_scheduler_for(
+        lambda turn: stream_reply(turn.context["character_id"], turn.context["session_id"], turn)
+    )
+
+    try:
+        while True:
+            try:
+                frame = await receive_frame(websocket, codec)
+            except InvalidFrame as e:
+                manager.touch(conn)
+                manager.send(conn, {"type": "error", **dict.fromkeys(ENVELOPE_FIELDS), "status": 400,
+                                    "detail": str(e)})
+                continue
+            manager.touch(conn)
+            if drain.draining:
+                await scheduler.wait()
+                await send_reconnect(conn)
+                return
+            if not isinstance(frame, dict):
+                manager.send(conn, {"type": "error", **dict.fromkeys(ENVELOPE_FIELDS), "status": 400,
+                                    "detail": "Frames must be JSON objects"})
+                continue
+            if frame.get("type") == "pong":
+                continue
+
+            envelope = {field: frame.get(field) for field in ENVELOPE_FIELDS}
+            if frame.get("type") == "resume" and envelope["character_id"] is not None and envelope["session_id"] is not None:
+                resume_stream(conn, f"{envelope['character_id']}_{envelope['session_id']}", frame, envelope)
+                continue
+            if any(value is None for value in envelope.values()) or not isinstance(frame.get("message"), str):
+                manager.send(conn, {"type": "error", **envelope, "status": 400,
+                                    "detail": "request_id, character_id, session_id and message are required"})
+                continue
+            if len(scheduler.tasks) >= MAX_INFLIGHT_TURNS:
+                manager.send(conn, {"type": "error", **envelope, "status": 429,
+                                    "detail": "Too many requests in flight on this connection"})
+                continue
+
+            session_key = f"{envelope['character_id']}_{envelope['session_id']}"
+            if session_key not in sessions:
+                sessions.add(session_key)
+                state.register_connection(session_key)
+                manager.subscribe(conn, envelope["character_id"])
+            turn = Turn(envelope["request_id"], frame["message"], envelope, frame.get("stream", True))
+            submit_turn(conn, scheduler, session_key, turn, frame.get("supersede"))
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        release_turns(scheduler)
+        manager.unregister(conn)
+        for session_key in sessions:
+            state.unregister_connection(session_key)
+
+async def stream_reply(character_id: str, session_id: str, turn: Turn):
+    """Generate one turn into its resumable stream: chunk frames, then a done or error frame"""
+    envelope = turn.context
+    session_key = f"{character_id}_{session_id}"
+    # Opened by submit_turn; a turn whose id was reused meanwhile still runs, without followers
+    stream = streams.get(session_key, turn.request_id) or streams.open(session_key, turn.request_id)
+    with start_trace("websocket turn", character_id=character_id, request_id=turn.request_id) as trace:
+        try:
+            character, _, prompt = prepare_dialogue(character_id, session_id, turn.message)
+            parts = []
+            with span("provider", provider=provider.name):
+                async for chunk in stream_text(prompt, system=DEFAULT_SYSTEM_PROMPT):
+                    parts.append(chunk)
+                    stream.publish({"type": "chunk", **envelope, "text": chunk})
+            npc_response = "".join(parts).strip()
+            record_dialogue(session_key, character, turn.message, npc_response)
+            # The done frame carries the whole reply, so a client that lost chunks still gets it
+            stream.publish({"type": "done", **envelope, "response": npc_response,
+                            "character_name": character["name"], "session_id": session_id,
+                            "timing": trace.timings_ms()})
+        except HTTPException as e:
+            stream.publish({"type": "error", **envelope, "status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            record_error(e)
+            stream.publish({"type": "error", **envelope, "status": 500, "detail": str(e)})
+        finally:
+            streams.finish(stream)
+
+def resume_stream(conn: ManagedConnection, session_key: str, frame: Dict, envelope: Dict):
+    """Replay a reply after last_seq to a reconnected client and follow it if still generating"""
+    stream = streams.get(session_key, frame.get("request_id"))
+    record_cache("stream_resume", stream is not None)
+    if stream is None:
+        manager.send(conn, {"type": "error", **envelope, "status": 404,
+                            "detail": "Stream not found or expired; fetch the conversation history instead"})
+        return
+    stream.subscribe(conn.id, lambda reply: manager.send(conn, reply),
+                     after_seq=int(frame.get("last_seq") or 0), chunks=bool(frame.get("stream", True)))
+
+def release_turns(scheduler: TurnScheduler):
+    """On disconnect, let buffered turns finish so the client can resume them; otherwise stop them"""
+    if not streams.enabled:
+        scheduler.cancel_all()
+
+async def send_reconnect(conn: ManagedConnection):
+    """Ask a client to reconnect (through the gateway it lands on a live node) and close"""
+    manager.send(conn, {"type": "reconnect", "reason": "server restarting"})
+    await manager.flush(conn, timeout=2.0)
+    await manager.disconnect(conn, RECONNECT_CLOSE_CODE)
+
+@drain.on_drain
+async def notify_websockets():
+    await asyncio.gather(*(send_reconnect(conn) for conn in list(manager.connections.values())))
+
+@drain.on_drain
+async def flush_state():
+    state.flush()
+
+@app.post("/api/broadcast/{character_id}")
+async def broadcast_line(character_id: str, request: BroadcastRequest):
+    """Push one line from a character to every WebSocket connected to it on this worker"""
+    character = state.get_character(character_id)
+    if character is None:
+        raise HTTPException(status_code=404, detail="Character not found")
+    delivery = manager.broadcast(character_id, {
+        "type": "broadcast",
+        "character_id": character_id,
+        "character_name": character["name"],
+        "text": request.text,
+        "timestamp": datetime.now().isoformat()
+    })
+    return {"character_id": character_id, **delivery}
+
+@app.get("/api/connections/stats")
+async def connection_stats():
+    """WebSocket connections, queued and dropped frames and resumable streams on this worker"""
+    return {**manager.stats(), "streams": streams.stats()}
 
 @app.get("/api/characters")
-async def get_characters():
-    """Get all available characters"""
-    return {"characters": character_profiles}
+async def get_characters(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[int] = Query(None, ge=0)
+):
+    """Get available characters; pass limit (and the returned next_cursor) to page through them"""
+    etag = f'W/"characters-{state.characters_version()}"'
+    cached = etag_matches(request, etag)
+    record_cache("characters_etag", cached)
+    if cached:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if limit is None and cursor is None:
+        return DefaultJSONResponse({"characters": state.all_characters()}, headers={"ETag": etag})
+
+    page, next_cursor = state.list_characters(cursor or 0, limit or MAX_PAGE_SIZE)
+    return DefaultJSONResponse({"characters": page, "next_cursor": next_cursor}, headers={"ETag": etag})
 
 @app.get("/api/conversation/{character_id}/{session_id}")
-async def get_conversation(character_id: str, session_id: str):
-    """Get conversation history"""
+async def get_conversation(
+    character_id: str,
+    session_id: str,
+    since: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE)
+):
+    """Get conversation history; since=<seq> returns only turns after that seq"""
     session_key = f"{character_id}_{session_id}"
-    return {"conversation": conversations.get(session_key, [])}
+    turns, last_seq = state.get_conversation(session_key, since, limit)
+    content = {"conversation": turns, "last_seq": last_seq}
+    if since > last_seq:
+        # The store lost turns the client has seen (a restart of a memory store), so it should refetch from 0
+        content["reset"] = True
+    return content
+
+# Background jobs for work too long for a synchronous request
+job_manager = create_job_manager()
+# Job handlers run on worker threads but the provider clients belong to the server's loop
+server_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def run_on_server_loop(coro):
+    """Run a coroutine on the server's event loop from a job thread and wait for it"""
+    return asyncio.run_coroutine_threadsafe(coro, server_loop).result()
+
+def run_bulk_character_job(payload: Dict, ctx: JobContext):
+    """Create many characters; payload: {"characters": [profile, ...]}"""
+    characters = payload.get("characters", [])
+    ctx.set_total(len(characters))
+    for index, raw_profile in enumerate(characters):
+        ctx.check_cancelled()
+        try:
+            character_data = CharacterProfile(**raw_profile).dict()
+        except ValidationError as e:
+            ctx.add_result({"index": index, "error": format_validation_error(e)}, ok=False)
+            continue
+        ctx.add_result({"index": index, "character_id": add_character(character_data)})
+
+def run_branching_tree_job(payload: Dict, ctx: JobContext):
+    """Expand a whole branching tree; payload: {"character_id", "depth", "max_nodes"}"""
+    character = state.get_character(payload.get("character_id", ""))
+    if character is None:
+        raise ValueError("Character not found")
+    depth = int(payload.get("depth", 2))
+    max_nodes = int(payload.get("max_nodes", 50))
+
+    # Breadth-first so a capped tree still covers the top levels
+    frontier = [("root", None, None, 0)]
+    node_count = 0
+    ctx.set_total(1)
+    while frontier and node_count < max_nodes:
+        ctx.check_cancelled()
+        node_id, parent_id, option, level = frontier.pop(0)
+        try:
+            node = run_on_server_loop(generate_branching(character, option))
+        except HTTPException as e:
+            ctx.add_result({"id": node_id, "parent_id": parent_id, "option": option, "error": e.detail}, ok=False)
+            continue
+        node_count += 1
+        ctx.add_result({"id": node_id, "parent_id": parent_id, "option": option, **node})
+        if level < depth:
+            for i, child_option in enumerate(node["options"]):
+                frontier.append((f"{node_id}.{i + 1}", node_id, child_option, level + 1))
+        ctx.set_total(min(max_nodes, node_count + len(frontier)))
+
+def run_translation_job(payload: Dict, ctx: JobContext):
+    """Translate many lines; payload: {"texts": [...], "target_languages": [...]}"""
+    texts = payload.get("texts", [])
+    languages = payload.get("target_languages", ["spanish"])
+    ctx.set_total(len(texts) * len(languages))
+    for index, text in enumerate(texts):
+        for language in languages:
+            ctx.check_cancelled()
+            try:
+                translated = run_on_server_loop(translate_text(text, language))
+            except HTTPException as e:
+                ctx.add_result({"index": index, "target_language": language, "error": e.detail}, ok=False)
+                continue
+            ctx.add_result({"index": index, "target_language": language, "original": text, "translated": translated})
+
+job_manager.register("bulk_create_characters", run_bulk_character_job)
+job_manager.register("branching_tree", run_branching_tree_job)
+job_manager.register("translate_batch", run_translation_job)
+
+@app.on_event("startup")
+async def start_job_workers():
+    global server_loop
+    server_loop = asyncio.get_running_loop()
+    job_manager.start()
+    manager.start()
+    if loop_monitor:
+        loop_monitor.start()
+    if continuous_profiler:
+        continuous_profiler.start()
+    if memory_guard:
+        memory_guard.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    job_manager.shutdown()
+    await manager.stop()
+    if loop_monitor:
+        await loop_monitor.stop()
+    if continuous_profiler:
+        continuous_profiler.stop()
+    if memory_guard:
+        await memory_guard.stop()
+    if traffic_capture:
+        traffic_capture.close()
+
+# Mirrors of existing state, read only when /metrics is scraped
+REGISTRY.gauge("websocket_connections", "Open WebSocket connections",
+               collect=lambda: {(): len(manager.connections)})
+REGISTRY.gauge("websocket_queued_frames", "Frames waiting in WebSocket send queues",
+               collect=lambda: {(): manager.stats()["queued_frames"]})
+REGISTRY.gauge("resumable_streams", "Reply streams kept for resuming",
+               collect=lambda: {(): streams.stats()["streams"]})
+REGISTRY.gauge("inflight_requests", "HTTP requests and WebSocket turns in progress",
+               collect=lambda: {(): drain.inflight})
+REGISTRY.gauge("job_queue_depth", "Background jobs waiting for a worker",
+               collect=lambda: {(): job_manager.store.queue_depth()})
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker"""
+    return metrics_response()
+
+# Longest on-demand profile; the sampler costs a little CPU while it runs
+PROFILE_MAX_SECONDS = 60
+
+def require_debug_token(x_debug_token: Optional[str] = Header(None)):
+    """Debug endpoints are off without DEBUG_TOKEN and need it in the X-Debug-Token header"""
+    debug_token = os.getenv("DEBUG_TOKEN")
+    if not debug_token:
+        raise HTTPException(status_code=404, detail="Debug endpoints are off (set DEBUG_TOKEN)")
+    if not x_debug_token or not secrets.compare_digest(x_debug_token, debug_token):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+
+@app.get("/debug/profile", dependencies=[Depends(require_debug_token)])
+async def debug_profile(seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS)):
+    """Sample this worker for a few seconds and return collapsed stacks for a flamegraph"""
+    try:
+        collapsed = await asyncio.to_thread(sample_for, seconds, profile_hz())
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(collapsed, media_type="text/plain",
+                    headers={"Content-Disposition": 'attachment; filename="profile.folded"'})
+
+@app.get("/debug/memory", dependencies=[Depends(require_debug_token)])
+async def memory_stats():
+    """RSS, the soft limit and the estimated size of each tracked structure"""
+    return {
+        "rss_bytes": rss_bytes(),
+        "soft_limit_bytes": memory_guard.soft_limit if memory_guard else None,
+        "structures": structure_stats(),
+        "tracemalloc": tracemalloc.is_tracing()
+    }
+
+@app.post("/debug/memory/snapshot", dependencies=[Depends(require_debug_token)])
+async def memory_snapshot(top: int = Query(20, ge=1, le=200)):
+    """Take a tracemalloc snapshot: the first starts tracing, later ones diff against the previous"""
+    return await asyncio.to_thread(snapshots.snapshot, top)
+
+@app.delete("/debug/memory/snapshot", dependencies=[Depends(require_debug_token)])
+async def stop_memory_snapshots():
+    """Stop tracemalloc, which slows allocations while it traces"""
+    snapshots.stop()
+    return {"tracemalloc": False}
+
+@app.get("/debug/loop", dependencies=[Depends(require_debug_token)])
+async def loop_stats():
+    """Event-loop lag percentiles and the stacks of recent stalls"""
+    if loop_monitor is None:
+        raise HTTPException(status_code=404, detail="Loop monitor is off (set LOOP_MONITOR_THRESHOLD_MS)")
+    return loop_monitor.stats()
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: storage answers and background workers are running"""
+    checks = {}
+    try:
+        state.characters_version()
+        checks["state_store"] = "ok"
+    except Exception as e:
+        checks["state_store"] = f"error: {e}"
+    checks["job_workers"] = "ok" if job_manager.executor is not None else "not started"
+    checks["lifecycle"] = "draining" if drain.draining else "ok"
+
+    ready = all(result == "ok" for result in checks.values())
+    return DefaultJSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not ready", "checks": checks, "boot_id": BOOT_ID}
+    )
+
+@app.post("/api/jobs")
+async def submit_job(request: JobRequest):
+    """Submit a long-running job"""
+    try:
+        job = job_manager.submit(request.kind, request.payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Get job status and progress"""
+    job = job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("payload")
+    return job
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str, stream: bool = False, after: int = 0):
+    """Get job results; with stream=true, results are sent as NDJSON while the job runs"""
+    job = job_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if not stream:
+        return {"status": job["status"], "results": job_manager.store.results(job_id, after)}
+
+    async def result_stream():
+        last_seq = after
+        while True:
+            current = job_manager.store.get(job_id)
+            for item in job_manager.store.results(job_id, last_seq):
+                last_seq = item["seq"]
+                yield dumps(item) + "\n"
+            if current["status"] in TERMINAL_STATUSES:
+                yield dumps({"status": current["status"], "error": current["error"]}) + "\n"
+                return
+            await asyncio.sleep(0.5)
+
+    # identity encoding keeps GZipMiddleware from buffering the stream
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        headers={"Content-Encoding": "identity"}
+    )
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": job["status"], "cancel_requested": job["cancel_requested"]}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from lifecycle import DrainingServer
+    DrainingServer(uvicorn.Config(app, host="0.0.0.0", port=8000)).run()
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Session-affinity gateway for multi-node deployments
+Consistent-hashes {character_id}_{session_id} onto backend nodes so every
+request and WebSocket of a session lands on the same node, with health checks
+and minimal remapping when nodes join or leave
+
+Each node keeps its sessions' history in its own state store. Characters are
+used from every node, so character creates, bulk imports, listings and jobs
+all go to one catalog node (the ring owner of CATALOG_KEY), which mints the
+ids. The gateway copies new characters to the other nodes through
+/api/character/replicate: before answering a create or bulk import, and on
+every health check, which also fills in nodes that joined or restarted
+(noticed by a new boot_id in /readyz) before they take traffic
+
+The multiplexed /ws socket carries many sessions, so it is pinned by the
+player_id query parameter instead, and the history of sessions used over it
+is kept on that player's node
+
+Usage:
+    python lifecycle.py enhanced_dialogue_api:app --port 8001
+    python gateway.py --node http://127.0.0.1:8001 --node http://127.0.0.1:8002 --port 8000
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional, Set
+
+import httpx
+import websockets
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+# Requests and responses must not forward connection-level headers
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host"
+}
+# Set again by the gateway's own server
+SERVER_HEADERS = {"date", "server"}
+SESSION_PATH = re.compile(r"^/(?:ws|api/conversation)/([^/]+)/([^/]+)")
+SESSION_BODY_PATHS = ("/api/dialogue/generate", "/api/dialogue/branching")
+# Routing key of everything that creates or lists characters, so one node mints all ids
+CATALOG_KEY = "catalog"
+CATALOG_PATHS = ("/api/character/", "/api/characters", "/api/jobs")
+# Character writes answered only once the new characters are on every node
+REPLICATED_WRITES = ("/api/character/create", "/api/character/bulk")
+REPLICATION_PAGE_SIZE = 1000
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes: Optional[List[str]] = None, replicas: int = 100):
+        self.replicas = replicas
+        self._keys: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self.nodes: List[str] = []
+        for node in nodes or []:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def add_node(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            bisect.insort(self._keys, point)
+            self._owners[point] = node
+
+    def remove_node(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            index = bisect.bisect_left(self._keys, point)
+            if index < len(self._keys) and self._keys[index] == point:
+                self._keys.pop(index)
+            self._owners.pop(point, None)
+
+    def get_nodes(self, key: str) -> List[str]:
+        """Nodes in ring order starting from the key's owner, for failover"""
+        if not self._keys:
+            return []
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        ordered: List[str] = []
+        for offset in range(len(self._keys)):
+            node = self._owners[self._keys[(index + offset) % len(self._keys)]]
+            if node not in ordered:
+                ordered.append(node)
+                if len(ordered) == len(self.nodes):
+                    break
+        return ordered
+
+    def get_node(self, key: str) -> Optional[str]:
+        nodes = self.get_nodes(key)
+        return nodes[0] if nodes else None
+
+class NodeRequest(BaseModel):
+    url: str
+
+class Gateway:
+    def __init__(self, nodes: List[str], health_path: str = "/readyz",
+                 health_interval: float = 2.0, failure_threshold: int = 2):
+        self.members = [node.rstrip("/") for node in nodes]
+        self.ring = HashRing(self.members)
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.failure_threshold = failure_threshold
+        self.failures: Dict[str, int] = {node: 0 for node in self.members}
+        # Every character seen on any node, the highest character number read from each node,
+        # the ids each node is known to hold and the boot id each node last reported
+        self.catalog: Dict[str, Dict] = {}
+        self.cursors: Dict[str, int] = {}
+        self.replicated: Dict[str, Set[str]] = {}
+        self.boot_ids: Dict[str, str] = {}
+        self.sync_lock = asyncio.Lock()
+        self.client: Optional[httpx.AsyncClient] = None
+        self.health_task: Optional[asyncio.Task] = None
+
+    def add_member(self, node: str):
+        node = node.rstrip("/")
+        if node not in self.members:
+            self.members.append(node)
+            self.failures[node] = 0
+            self.ring.add_node(node)
+
+    def remove_member(self, node: str):
+        node = node.rstrip("/")
+        if node in self.members:
+            self.members.remove(node)
+            self.failures.pop(node, None)
+            self.forget(node)
+        self.ring.remove_node(node)
+
+    def mark_failure(self, node: str):
+        if node not in self.failures:
+            return
+        self.failures[node] += 1
+        if self.failures[node] >= self.failure_threshold:
+            self.ring.remove_node(node)
+
+    def mark_healthy(self, node: str):
+        if node not in self.failures:
+            return
+        self.failures[node] = 0
+        self.ring.add_node(node)
+
+    def forget(self, node: str):
+        """Drop what the gateway knows a node holds, so everything is read from and copied to it again"""
+        self.cursors.pop(node, None)
+        self.replicated.pop(node, None)
+        self.boot_ids.pop(node, None)
+
+    async def check_health(self):
+        while True:
+            healthy = []
+            for node in list(self.members):
+                try:
+                    response = await self.client.get(f"{node}{self.health_path}", timeout=self.health_interval)
+                except httpx.HTTPError:
+                    self.mark_failure(node)
+                    continue
+                if response.status_code >= 500:
+                    self.mark_failure(node)
+                    continue
+                boot_id = boot_id_of(response)
+                if boot_id != self.boot_ids.get(node):
+                    # A restarted node may have lost its memory store
+                    self.forget(node)
+                    self.boot_ids[node] = boot_id
+                healthy.append(node)
+            # Joining and restarted nodes get the characters before they are routed any sessions
+            await self.sync_characters(healthy)
+            for node in healthy:
+                self.mark_healthy(node)
+            await asyncio.sleep(self.health_interval)
+
+    async def sync_characters(self, nodes: Optional[List[str]] = None, sources: Optional[List[str]] = None):
+        """Read new characters from the sources (default: every node) and copy each to the nodes that miss it"""
+        nodes = list(self.ring.nodes) if nodes is None else nodes
+        async with self.sync_lock:
+            for node in nodes if sources is None else sources:
+                try:
+                    await self._pull_characters(node)
+                except (httpx.HTTPError, ValueError, KeyError):
+                    continue
+            for node in nodes:
+                held = self.replicated.setdefault(node, set())
+                missing = [character_id for character_id in self.catalog if character_id not in held]
+                for start in range(0, len(missing), REPLICATION_PAGE_SIZE):
+                    batch = missing[start:start + REPLICATION_PAGE_SIZE]
+                    try:
+                        response = await self.client.post(f"{node}/api/character/replicate", json={
+                            "characters": {character_id: self.catalog[character_id] for character_id in batch}})
+                    except httpx.HTTPError:
+                        break
+                    if response.status_code >= 400:
+                        break
+                    held.update(batch)
+
+    async def _pull_characters(self, node: str):
+        cursor = self.cursors.get(node, 0)
+        held = self.replicated.setdefault(node, set())
+        while True:
+            response = await self.client.get(f"{node}/api/characters",
+                                             params={"cursor": cursor, "limit": REPLICATION_PAGE_SIZE})
+            response.raise_for_status()
+            data = response.json()
+            for character_id, profile in data["characters"].items():
+                self.catalog.setdefault(character_id, profile)
+                held.add(character_id)
+                cursor = max(cursor, int(character_id.split("_", 1)[1]))
+            self.cursors[node] = cursor
+            if data.get("next_cursor") is None:
+                return
+
+def boot_id_of(response: httpx.Response) -> Optional[str]:
+    try:
+        return response.json().get("boot_id")
+    except (ValueError, AttributeError):
+        return None
+
+def routing_key(path: str, body: bytes = b"") -> str:
+    """Session key for session-scoped requests, otherwise a stable per-resource key"""
+    match = SESSION_PATH.match(path)
+    if match:
+        return f"{match.group(1)}_{match.group(2)}"
+    if path in SESSION_BODY_PATHS and body:
+        try:
+            data = json.loads(body)
+            return f"{data['character_id']}_{data['session_id']}"
+        except (ValueError, KeyError, TypeError):
+            pass
+    if path.startswith(CATALOG_PATHS):
+        # Only the catalog node mints character ids; a job's submit, status and result calls stay together
+        return CATALOG_KEY
+    return path
+
+def create_gateway_app(gateway: Gateway) -> FastAPI:
+    app = FastAPI(title="NPC Dialogue Gateway")
+
+    @app.on_event("startup")
+    async def start_gateway():
+        gateway.client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=2.0))
+        gateway.health_task = asyncio.create_task(gateway.check_health())
+
+    @app.on_event("shutdown")
+    async def stop_gateway():
+        gateway.health_task.cancel()
+        await gateway.client.aclose()
+
+    @app.get("/gateway/nodes")
+    async def list_nodes():
+        """Node membership, health and ring ownership"""
+        return {
+            "nodes": [
+                {"url": node, "healthy": node in gateway.ring.nodes, "failures": gateway.failures.get(node, 0),
+                 "characters": len(gateway.replicated.get(node, ()))}
+                for node in gateway.members
+            ],
+            "catalog_node": gateway.ring.get_node(CATALOG_KEY),
+            "characters": len(gateway.catalog)
+        }
+
+    @app.get("/healthz")
+    async def healthz():
+        """Liveness of the gateway itself"""
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz():
+        """Ready while at least one backend node is healthy"""
+        if not gateway.ring.nodes:
+            raise HTTPException(status_code=503, detail="No healthy backend nodes")
+        return {"status": "ready", "healthy_nodes": len(gateway.ring.nodes)}
+
+    @app.post("/gateway/nodes")
+    async def add_node(request: NodeRequest):
+        """Join a node to the ring"""
+        gateway.add_member(request.url)
+        return await list_nodes()
+
+    @app.delete("/gateway/nodes")
+    async def remove_node(url: str):
+        """Remove a node from the ring"""
+        gateway.remove_member(url)
+        return await list_nodes()
+
+    @app.websocket("/ws/{character_id}/{session_id}")
+    async def proxy_websocket(websocket: WebSocket, character_id: str, session_id: str):
+        """Proxy a dialogue WebSocket to the session's node"""
+        await proxy_socket(websocket, gateway.ring.get_nodes(f"{character_id}_{session_id}"))
+
+    @app.websocket("/ws")
+    async def proxy_multiplexed_websocket(websocket: WebSocket):
+        """Proxy a multiplexed WebSocket to the node of its ?player_id="""
+        player_id = websocket.query_params.get("player_id")
+        if not player_id:
+            await websocket.close(code=1008, reason="player_id query parameter is required")
+            return
+        await proxy_socket(websocket, gateway.ring.get_nodes(f"player_{player_id}"))
+
+    async def proxy_socket(websocket: WebSocket, nodes: List[str]):
+        """Relay frames both ways between the client and the first reachable node"""
+        offered = websocket.scope.get("subprotocols") or []
+        upstream = None
+        for node in nodes:
+            url = node.replace("http", "ws", 1) + websocket.url.path
+            if websocket.url.query:
+                url += f"?{websocket.url.query}"
+            try:
+                upstream = await websockets.connect(url, subprotocols=offered or None)
+                break
+            except (OSError, websockets.exceptions.WebSocketException):
+                gateway.mark_failure(node)
+        if upstream is None:
+            await websocket.close(code=1013)
+            return
+
+        await websocket.accept(subprotocol=upstream.subprotocol)
+
+        async def client_to_upstream():
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                await upstream.send(message["bytes"] if message.get("bytes") is not None else message["text"])
+
+        async def upstream_to_client():
+            async for data in upstream:
+                if isinstance(data, bytes):
+                    await websocket.send_bytes(data)
+                else:
+                    await websocket.send_text(data)
+
+        tasks = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await upstream.close()
+            # Pass the node's close code on, so a draining node's 1012 still tells the client to reconnect
+            code = upstream.close_code
+            if code in (None, 1005, 1006):
+                code = 1000 if code == 1005 else 1011
+            try:
+                await websocket.close(code=code, reason=upstream.close_reason or "")
+            except (RuntimeError, WebSocketDisconnect):
+                pass
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
+    async def proxy_http(request: Request, path: str):
+        """Proxy an HTTP request to the node owning its routing key"""
+        # Uploads such as bulk imports are streamed through; everything else is small enough to buffer
+        streamed = request.method in ("POST", "PUT", "PATCH") and request.url.path not in SESSION_BODY_PATHS
+        body = None if streamed else await request.body()
+        nodes = gateway.ring.get_nodes(routing_key(request.url.path, body or b""))
+        if not nodes:
+            raise HTTPException(status_code=503, detail="No healthy backend nodes")
+
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+        for attempt, node in enumerate(nodes):
+            # A streamed body can only be sent once, so only buffered requests fail over
+            if attempt and streamed:
+                break
+            upstream_request = gateway.client.build_request(
+                request.method,
+                f"{node}{request.url.path}",
+                params=request.url.query,
+                headers=headers,
+                content=body if body is not None else request.stream()
+            )
+            try:
+                upstream = await gateway.client.send(upstream_request, stream=True)
+            except httpx.ConnectError:
+                gateway.mark_failure(node)
+                continue
+
+            response_headers = {
+                k: v for k, v in upstream.headers.items()
+                if k.lower() not in HOP_BY_HOP_HEADERS and k.lower() not in SERVER_HEADERS
+            }
+            response_headers["X-Gateway-Node"] = node
+            if request.method == "POST" and request.url.path in REPLICATED_WRITES and upstream.status_code < 500:
+                # Sessions on other nodes must find the new characters as soon as the client has their ids
+                # Raw bytes, so a gzipped body still matches the forwarded headers
+                content = b"".join([chunk async for chunk in upstream.aiter_raw()])
+                await upstream.aclose()
+                await gateway.sync_characters(sources=[node])
+                return Response(content, status_code=upstream.status_code, headers=response_headers)
+            return StreamingResponse(
+                upstream.aiter_raw(),
+                status_code=upstream.status_code,
+                headers=response_headers,
+                background=BackgroundTask(upstream.aclose)
+            )
+        raise HTTPException(status_code=502, detail="No backend node reachable")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Session-affinity gateway for NPC dialogue backends")
+    parser.add_argument("--node", action="append", required=True, help="Backend base URL (repeatable)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--health-path", default="/readyz")
+    parser.add_argument("--health-interval", type=float, default=2.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    gateway = Gateway(args.node, health_path=args.health_path, health_interval=args.health_interval)
+    print(f"🔀 Gateway on :{args.port} routing to {', '.join(gateway.members)}")
+    uvicorn.run(create_gateway_app(gateway), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
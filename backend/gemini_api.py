@@ -3,18 +3,24 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-if not GOOGLE_API_KEY:
-    raise ValueError("Google API key not found. Set GOOGLE_API_KEY in .env file.")
-
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+model = None
+
+def get_model():
+    """Configure Gemini on first use so the app starts without a key"""
+    global model
+    if model is None:
+        if not GOOGLE_API_KEY:
+            raise HTTPException(status_code=503, detail="Google API key not found. Set GOOGLE_API_KEY in .env file.")
+        import google.generativeai as genai
+        from providers import gemini_configure_kwargs
+        genai.configure(api_key=GOOGLE_API_KEY, **gemini_configure_kwargs())
+        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+    return model
 
 app = FastAPI()
 
@@ -36,7 +42,7 @@ chat_sessions = {}
 def chat(message: Message):
     session_id = "default"  # For now, single session
     if session_id not in chat_sessions:
-        chat_sessions[session_id] = model.start_chat()
+        chat_sessions[session_id] = get_model().start_chat()
 
     try:
         convo = chat_sessions[session_id]
@@ -0,0 +1,243 @@
+"""
+Background job subsystem for long-running dialogue work
+Jobs are persisted in a SQLite table and executed by a thread pool that is
+sized independently of the request path (JOB_WORKERS)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+class JobCancelled(Exception):
+    pass
+
+class JobStore:
+    """SQLite-backed job table and per-item result log"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connect()
+        # A pre-forked worker must not share its parent's SQLite handle
+        os.register_at_fork(after_in_child=self._connect)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    owner_pid INTEGER,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            try:
+                # Job tables created before multi-worker support lack the owner column
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+            except sqlite3.OperationalError:
+                pass
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_results (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    item TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            """)
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+
+    def _row_to_job(self, row) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def create(self, kind: str, payload: Dict) -> Dict:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def claim(self, job_id: str) -> bool:
+        """Atomically move a queued job to running; False if someone else has it"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'running', owner_pid = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+                (os.getpid(), time.time(), job_id)
+            )
+        return cursor.rowcount == 1
+
+    def set_total(self, job_id: str, total: int):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET total = ?, updated_at = ? WHERE id = ?", (total, time.time(), job_id))
+
+    def append_result(self, job_id: str, item: Dict, ok: bool = True):
+        column = "completed" if ok else "failed"
+        with self.lock, self.conn:
+            seq = self.conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM job_results WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO job_results (job_id, seq, item) VALUES (?, ?, ?)",
+                (job_id, seq, json.dumps(item))
+            )
+            self.conn.execute(
+                f"UPDATE jobs SET {column} = {column} + 1, updated_at = ? WHERE id = ?",
+                (time.time(), job_id)
+            )
+
+    def results(self, job_id: str, after_seq: int = 0) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT seq, item FROM job_results WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after_seq)
+            ).fetchall()
+        return [{"seq": row["seq"], **json.loads(row["item"])} for row in rows]
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+    def request_cancel(self, job_id: str) -> bool:
+        """Flag a job for cancellation; queued jobs are cancelled immediately"""
+        with self.lock, self.conn:
+            now = time.time()
+            self.conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'queued'",
+                (now, job_id)
+            )
+            cursor = self.conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'",
+                (now, job_id)
+            )
+        return cursor.rowcount == 1
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def requeue_interrupted(self) -> List[str]:
+        """Put jobs whose worker process has died back in the queue"""
+        with self.lock, self.conn:
+            running = self.conn.execute("SELECT id, owner_pid FROM jobs WHERE status = 'running'").fetchall()
+            for row in running:
+                if not _pid_alive(row["owner_pid"]):
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'queued', updated_at = ? WHERE id = ?", (time.time(), row["id"])
+                    )
+            rows = self.conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        return [row["id"] for row in rows]
+
+    def queue_depth(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    # Other uvicorn workers share this table, so only their own death orphans a job
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class JobContext:
+    """Handed to job handlers for progress reporting and cancellation checks"""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+
+    def set_total(self, total: int):
+        self.store.set_total(self.job_id, total)
+
+    def add_result(self, item: Dict, ok: bool = True):
+        self.store.append_result(self.job_id, item, ok)
+
+    def check_cancelled(self):
+        if self.store.is_cancel_requested(self.job_id):
+            raise JobCancelled()
+
+class JobManager:
+    """Runs registered job handlers on a dedicated thread pool"""
+
+    def __init__(self, store: JobStore, workers: int = 2):
+        self.store = store
+        self.workers = workers
+        self.handlers: Dict[str, Callable[[Dict, JobContext], None]] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def register(self, kind: str, handler: Callable[[Dict, JobContext], None]):
+        self.handlers[kind] = handler
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-worker")
+        for job_id in self.store.requeue_interrupted():
+            self.executor.submit(self._run, job_id)
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, kind: str, payload: Dict) -> Dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}'. Choose from: {', '.join(self.handlers)}")
+        job = self.store.create(kind, payload)
+        self.executor.submit(self._run, job["id"])
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        self.store.request_cancel(job_id)
+        return self.store.get(job_id)
+
+    def _run(self, job_id: str):
+        if not self.store.claim(job_id):
+            return
+        job = self.store.get(job_id)
+        try:
+            self.handlers[job["kind"]](job["payload"], JobContext(self.store, job_id))
+            self.store.finish(job_id, "completed")
+        except JobCancelled:
+            self.store.finish(job_id, "cancelled")
+        except Exception as e:
+            self.store.finish(job_id, "failed", f"{type(e).__name__}: {e}")
+
+def create_job_manager() -> JobManager:
+    """Build a manager from JOB_DB_PATH and JOB_WORKERS"""
+    store = JobStore(os.getenv("JOB_DB_PATH", "jobs.db"))
+    return JobManager(store, workers=int(os.getenv("JOB_WORKERS", "2")))
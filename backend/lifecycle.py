@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Graceful drain for backend workers
+When a worker is asked to stop it closes its listening socket, tells clients
+on open keep-alive connections to reconnect (Connection: close), waits for
+in-flight requests and generations up to DRAIN_TIMEOUT, then runs the app's
+drain callbacks (reconnect notices for WebSocket clients, storage flush)
+before uvicorn exits
+
+Usage (one worker; the pre-fork runner also starts workers this way on reload):
+    python lifecycle.py enhanced_dialogue_api:app --port 8000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+from typing import Awaitable, Callable, List, Optional
+
+import uvicorn
+
+logger = logging.getLogger("uvicorn.error")
+
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+# "Service restart": clients should reconnect, possibly to another node
+RECONNECT_CLOSE_CODE = 1012
+# Lets busy keep-alive clients send one more request and receive Connection: close,
+# instead of racing uvicorn closing their idle connection
+KEEPALIVE_GRACE = 0.5
+
+class DrainController:
+    """Tracks in-flight work and runs drain callbacks once it has settled"""
+
+    def __init__(self):
+        self.draining = False
+        self.inflight = 0
+        self._callbacks: List[Callable[[], Awaitable[None]]] = []
+
+    def on_drain(self, callback: Callable[[], Awaitable[None]]):
+        """Register an async callback to run after in-flight work finishes"""
+        self._callbacks.append(callback)
+        return callback
+
+    @contextlib.contextmanager
+    def track(self):
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT, should_abort: Optional[Callable[[], bool]] = None) -> bool:
+        """Mark the worker as draining and wait for in-flight work; False if the deadline cut it short"""
+        if self.draining:
+            return False
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + timeout
+        if self.inflight:
+            logger.info("Draining %d in-flight request(s) for up to %.0fs", self.inflight, timeout)
+        while loop.time() < deadline and not (should_abort and should_abort()):
+            if not self.inflight and loop.time() - started >= min(KEEPALIVE_GRACE, timeout):
+                break
+            await asyncio.sleep(0.05)
+        finished = self.inflight == 0
+        if not finished:
+            logger.warning("Drain deadline reached with %d request(s) still in flight", self.inflight)
+        for callback in self._callbacks:
+            try:
+                await callback()
+            except Exception:
+                logger.exception("Drain callback %s failed", getattr(callback, "__name__", callback))
+        return finished
+
+# One worker process serves one app, so the app and the server share this controller
+drain = DrainController()
+
+class DrainMiddleware:
+    """Counts in-flight HTTP requests and moves clients off a draining worker"""
+
+    def __init__(self, app, controller: DrainController = drain):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            async def send_with_close(message):
+                # Requests already on an open connection are served, but the connection is not reused
+                if message["type"] == "http.response.start" and self.controller.draining:
+                    message["headers"] = [
+                        (name, value) for name, value in message.get("headers", []) if name.lower() != b"connection"
+                    ] + [(b"connection", b"close")]
+                await send(message)
+
+            with self.controller.track():
+                await self.app(scope, receive, send_with_close)
+            return
+        if scope["type"] == "websocket" and self.controller.draining:
+            await send({"type": "websocket.close", "code": RECONNECT_CLOSE_CODE})
+            return
+        await self.app(scope, receive, send)
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains the app before closing connections"""
+
+    def __init__(self, config: uvicorn.Config, controller: DrainController = drain,
+                 drain_timeout: float = DRAIN_TIMEOUT, ready_fd: Optional[int] = None):
+        super().__init__(config)
+        self.controller = controller
+        self.drain_timeout = drain_timeout
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.ready_fd is not None and self.started:
+            # Tells a supervising process that this worker can take traffic
+            os.write(self.ready_fd, b"1")
+            os.close(self.ready_fd)
+            self.ready_fd = None
+
+    async def shutdown(self, sockets=None):
+        # Stop accepting first, so new connections go to the remaining workers
+        for server in self.servers:
+            server.close()
+        for sock in sockets or []:
+            sock.close()
+        await self.controller.drain(self.drain_timeout, should_abort=lambda: self.force_exit)
+        await super().shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one backend worker with graceful drain")
+    parser.add_argument("app", help="Import string, e.g. enhanced_dialogue_api:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fd", type=int, help="Serve an inherited listening socket instead of binding")
+    parser.add_argument("--ready-fd", type=int, help="Write one byte to this fd once startup finished")
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    config = uvicorn.Config(args.app, host=args.host, port=args.port, fd=args.fd, log_level=args.log_level)
+    DrainingServer(config, drain_timeout=args.drain_timeout, ready_fd=args.ready_fd).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Event-loop lag watchdog
+A task on the loop sleeps for LOOP_MONITOR_INTERVAL_MS at a time, and any
+extra delay before it wakes up is lag. Lag samples go to an
+event_loop_lag_seconds histogram, and the p50/p90/p99 of the last minute are
+available as gauges. A watchdog thread checks the task's heartbeat, and when
+the loop has been stuck for longer than LOOP_MONITOR_THRESHOLD_MS it records
+the loop thread's stack at that moment. That stack shows the sync call
+blocking the loop, such as a provider SDK call inside an async def handler.
+Stalls are logged and kept for /debug/loop
+
+Off unless LOOP_MONITOR_THRESHOLD_MS is set
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger("uvicorn.error")
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUANTILES = (0.5, 0.9, 0.99)
+# Innermost frames kept per stall; the blocking call is at the bottom
+STACK_DEPTH = 12
+
+LOOP_LAG = REGISTRY.histogram("event_loop_lag_seconds", "Delay of event loop wake-ups beyond their schedule",
+                              buckets=LAG_BUCKETS)
+LOOP_STALLS = REGISTRY.counter("event_loop_stalls_total", "Times the event loop was blocked beyond the threshold")
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+class LoopMonitor:
+    """Samples event-loop lag and captures the stack of long blocking calls"""
+
+    def __init__(self, threshold: float, interval: float = 0.1, window: int = 600, keep_stalls: int = 20):
+        self.threshold = threshold
+        self.interval = interval
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.stalls: Deque[Dict] = deque(maxlen=keep_stalls)
+        self.heartbeat = time.monotonic()
+        self._stall: Optional[Dict] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        REGISTRY.gauge("event_loop_lag_quantile_seconds", "Event loop lag percentiles over the recent window",
+                       ("quantile",), collect=self.quantiles)
+
+    def start(self):
+        """Start sampling; call from the running loop, e.g. a startup hook"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sample(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - started - self.interval, 0.0)
+            self.heartbeat = now
+            self.samples.append(lag)
+            LOOP_LAG.observe(value=lag)
+            stall, self._stall = self._stall, None
+            if stall is not None:
+                LOOP_STALLS.inc()
+                stall["lag_ms"] = round(lag * 1000, 1)
+                self.stalls.append(stall)
+                logger.warning("Event loop blocked for %.0f ms in:\n%s", lag * 1000, stall["stack"])
+
+    def _watch(self):
+        # Checks often enough to catch the blocking call before it returns
+        while not self._stop.wait(min(self.threshold / 4, 0.05)):
+            blocked = time.monotonic() - self.heartbeat - self.interval
+            if blocked < self.threshold or self._stall is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            # The sampler counts the stall on the loop thread once the blocking call returns
+            self._stall = {"at": time.time(), "stack": "".join(traceback.format_stack(frame, STACK_DEPTH))}
+
+    def quantiles(self) -> Dict:
+        samples = list(self.samples)
+        return {(str(q),): percentile(samples, q) for q in QUANTILES}
+
+    def stats(self) -> Dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "lag_ms": {f"p{int(float(q) * 100)}": round(value * 1000, 2) for (q,), value in self.quantiles().items()},
+            "stalls": list(self.stalls)
+        }
+
+def create_loop_monitor() -> Optional[LoopMonitor]:
+    """Build the monitor from LOOP_MONITOR_THRESHOLD_MS and LOOP_MONITOR_INTERVAL_MS, or None when off"""
+    threshold_ms = float(os.getenv("LOOP_MONITOR_THRESHOLD_MS", "0"))
+    if threshold_ms <= 0:
+        return None
+    return LoopMonitor(threshold=threshold_ms / 1000,
+                       interval=float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000)
@@ -1,21 +1,31 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-import google.generativeai as genai
 from dotenv import load_dotenv
+import itertools
 import os
+import time
+from loop_monitor import create_loop_monitor
+from memory import create_memory_guard
+from metrics import REGISTRY, MetricsMiddleware, metrics_response, observe_generation, record_error
 
 # Load environment variables
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-# Ensure key is present
-if not GOOGLE_API_KEY:
-    raise ValueError("❌ Google API key not found. Please set it in a `.env` file.")
+# Gemini is configured on the first chat, so the app starts without a key
+model = None
 
-# Configure Gemini API
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel(model_name="models/gemini-1.5-flash")
+def get_model():
+    global model
+    if model is None:
+        if not GOOGLE_API_KEY:
+            raise HTTPException(status_code=503, detail="❌ Google API key not found. Please set it in a `.env` file.")
+        import google.generativeai as genai
+        from providers import gemini_configure_kwargs
+        genai.configure(api_key=GOOGLE_API_KEY, **gemini_configure_kwargs())
+        model = genai.GenerativeModel(model_name="models/gemini-1.5-flash")
+    return model
 
 # Initialize FastAPI
 app = FastAPI()
@@ -29,8 +39,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency and status counts for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Chat sessions
 chat_sessions = {}
+REGISTRY.gauge("chat_sessions", "Gemini chat sessions held in memory", collect=lambda: {(): len(chat_sessions)})
 
 # Request schema
 class ChatRequest(BaseModel):
@@ -46,10 +60,49 @@ async def chat(req: ChatRequest):
     session_id = req.session_id
 
     if session_id not in chat_sessions:
-        chat_sessions[session_id] = model.start_chat()
+        chat_sessions[session_id] = get_model().start_chat()
 
+    started = time.perf_counter()
     try:
         response = chat_sessions[session_id].send_message(req.message)
+        usage = getattr(response, "usage_metadata", None)
+        observe_generation("gemini", "chat", time.perf_counter() - started,
+                           getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0))
         return ChatResponse(reply=response.text)
     except Exception as e:
+        record_error(e)
         return ChatResponse(reply=f"❌ Error: {str(e)}")
+
+# Event-loop lag watchdog, off unless LOOP_MONITOR_THRESHOLD_MS is set
+loop_monitor = create_loop_monitor()
+
+def evict_chat_sessions() -> int:
+    """Forget the oldest quarter of chat sessions"""
+    stale = list(itertools.islice(chat_sessions, len(chat_sessions) // 4))
+    for session_id in stale:
+        chat_sessions.pop(session_id, None)
+    return len(stale)
+
+# Above MEMORY_SOFT_LIMIT_MB the oldest chat sessions are dropped
+memory_guard = create_memory_guard()
+if memory_guard:
+    memory_guard.on_pressure("chat_sessions")(evict_chat_sessions)
+
+@app.on_event("startup")
+async def start_monitors():
+    if loop_monitor:
+        loop_monitor.start()
+    if memory_guard:
+        memory_guard.start()
+
+@app.on_event("shutdown")
+async def stop_monitors():
+    if loop_monitor:
+        await loop_monitor.stop()
+    if memory_guard:
+        await memory_guard.stop()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this process"""
+    return metrics_response()
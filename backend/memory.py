@@ -0,0 +1,226 @@
+"""
+Memory accounting, tracemalloc snapshots and an RSS soft limit
+track_memory() registers a source of named in-memory structures, such as a
+store's sessions and turns, reply buffers or sockets. /metrics then reports
+each structure's item count and estimated size as memory_structure_items and
+memory_structure_bytes. Sizes come from measuring a sample of entries, so a
+scrape stays cheap when a dict holds millions of turns
+
+TracemallocSnapshots starts tracemalloc on the first snapshot and diffs each
+later snapshot against the previous one, to show which lines keep allocating
+
+MemoryGuard checks RSS every MEMORY_CHECK_INTERVAL seconds. Above
+MEMORY_SOFT_LIMIT_MB it runs the registered eviction callbacks (finished
+reply buffers, then the least recently used sessions), so the process sheds
+memory before the kernel's OOM killer stops it. Freed memory is reused by
+Python but not always returned to the OS, so set the limit well above the
+steady-state RSS. When a round leaves RSS no lower, the guard holds off until
+RSS grows by another tenth of the limit, rather than dropping a quarter of the
+sessions on every check for memory it cannot give back
+"""
+
+import asyncio
+import gc
+import itertools
+import logging
+import os
+import sys
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("uvicorn.error")
+
+# Entries measured per structure on each scrape
+SAMPLE_SIZE = 64
+
+def deep_size(obj, seen: Optional[set] = None) -> int:
+    """Bytes held by obj and the dicts, lists and strings inside it"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+def estimate_size(container, measure: Callable = deep_size) -> int:
+    """Bytes of a dict's items or a list's entries, extrapolated from the first SAMPLE_SIZE of them"""
+    count = len(container)
+    if not count:
+        return 0
+    entries = itertools.islice(container.items() if isinstance(container, dict) else container, SAMPLE_SIZE)
+    sampled = [measure(entry) for entry in entries]
+    return int(sum(sampled) / len(sampled) * count)
+
+# Each source returns {structure name: (items, bytes)}
+MemorySource = Callable[[], Dict[str, Tuple[int, int]]]
+SOURCES: List[MemorySource] = []
+
+def track_memory(source: MemorySource):
+    """Report a source's structures in /metrics and /debug/memory"""
+    SOURCES.append(source)
+
+def structure_stats() -> Dict[str, Dict[str, int]]:
+    stats = {}
+    for source in SOURCES:
+        try:
+            usage = source()
+        except Exception:
+            # A structure changing size mid-scrape is reported next time
+            continue
+        for name, (items, size) in usage.items():
+            stats[name] = {"items": items, "bytes": size}
+    return stats
+
+def rss_bytes() -> int:
+    """Resident set size of this process (peak RSS where /proc is missing)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def _collect_structures(field: str) -> Dict:
+    return {(name,): stats[field] for name, stats in structure_stats().items()}
+
+REGISTRY.gauge("memory_structure_items", "Entries in tracked in-memory structures", ("structure",),
+               collect=lambda: _collect_structures("items"))
+REGISTRY.gauge("memory_structure_bytes", "Estimated bytes held by tracked in-memory structures", ("structure",),
+               collect=lambda: _collect_structures("bytes"))
+REGISTRY.gauge("process_resident_memory_bytes", "Resident memory of this process", collect=lambda: {(): rss_bytes()})
+MEMORY_EVICTIONS = REGISTRY.counter("memory_evictions_total", "Entries evicted under the RSS soft limit",
+                                    ("structure",))
+
+class TracemallocSnapshots:
+    """Takes tracemalloc snapshots and diffs each against the previous one"""
+
+    def __init__(self, frames: int = 1):
+        self.frames = frames
+        self.previous: Optional[tracemalloc.Snapshot] = None
+
+    def snapshot(self, top: int = 20) -> Dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.previous = None
+        current = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ])
+        traced, peak = tracemalloc.get_traced_memory()
+        result: Dict = {"traced_bytes": traced, "peak_bytes": peak}
+        if self.previous is None:
+            result["top"] = [self._format(stat) for stat in current.statistics("lineno")[:top]]
+        else:
+            result["growth"] = [self._format(stat) for stat in current.compare_to(self.previous, "lineno")[:top]]
+        self.previous = current
+        return result
+
+    def stop(self):
+        tracemalloc.stop()
+        self.previous = None
+
+    @staticmethod
+    def _format(stat) -> Dict:
+        frame = stat.traceback[0]
+        entry = {"location": f"{frame.filename}:{frame.lineno}", "bytes": stat.size, "count": stat.count}
+        if hasattr(stat, "size_diff"):
+            entry.update(bytes_diff=stat.size_diff, count_diff=stat.count_diff)
+        return entry
+
+# Returns how many entries were evicted
+Evictor = Callable[[], int]
+# After a round that did not lower RSS, evict again only once RSS has grown by this share of the limit
+REGROWTH = 0.1
+
+class MemoryGuard:
+    """Runs eviction callbacks whenever RSS is above a soft limit"""
+
+    def __init__(self, soft_limit: int, interval: float = 5.0):
+        self.soft_limit = soft_limit
+        self.interval = interval
+        self.evictors: List[Tuple[str, Evictor]] = []
+        # RSS after the last round that freed nothing, while still over the limit
+        self.stalled_at: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def on_pressure(self, name: str):
+        """Decorator registering an evictor, run in registration order"""
+        def register(callback: Evictor) -> Evictor:
+            self.evictors.append((name, callback))
+            return callback
+        return register
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
+
+    def check(self) -> Optional[Dict[str, int]]:
+        """Relieve pressure above the limit, unless the last round freed nothing and RSS has not grown since"""
+        rss = rss_bytes()
+        if rss <= self.soft_limit:
+            self.stalled_at = None
+            return None
+        if self.stalled_at is not None and rss < self.stalled_at + self.soft_limit * REGROWTH:
+            return None
+        evicted = self.relieve()
+        after = rss_bytes()
+        self.stalled_at = after if after >= rss else None
+        if self.stalled_at is not None:
+            logger.warning("Eviction did not lower RSS, holding off until it passes %.0f MB",
+                           (after + self.soft_limit * REGROWTH) / 2**20)
+        return evicted
+
+    def relieve(self) -> Dict[str, int]:
+        """Run evictors until RSS is back under the limit"""
+        rss = rss_bytes()
+        evicted = {}
+        for name, callback in self.evictors:
+            try:
+                count = callback()
+            except Exception:
+                logger.exception("Evictor %s failed", name)
+                continue
+            evicted[name] = count
+            if count:
+                MEMORY_EVICTIONS.inc(name, amount=count)
+            gc.collect()
+            if rss_bytes() <= self.soft_limit:
+                break
+        logger.warning("RSS %.0f MB above the %.0f MB soft limit, evicted %s (now %.0f MB)",
+                       rss / 2**20, self.soft_limit / 2**20, evicted, rss_bytes() / 2**20)
+        return evicted
+
+def create_memory_guard() -> Optional[MemoryGuard]:
+    """Build the guard from MEMORY_SOFT_LIMIT_MB and MEMORY_CHECK_INTERVAL, or None when no limit is set"""
+    limit_mb = float(os.getenv("MEMORY_SOFT_LIMIT_MB", "0"))
+    if limit_mb <= 0:
+        return None
+    return MemoryGuard(int(limit_mb * 2**20), float(os.getenv("MEMORY_CHECK_INTERVAL", "5")))
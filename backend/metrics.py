@@ -0,0 +1,214 @@
+"""
+Prometheus metrics without extra dependencies
+Counters, gauges and fixed-bucket histograms keep their values in plain dicts
+keyed by label values. Updates happen on the event loop thread and are a dict
+lookup plus an add, with no locks. /metrics renders the text exposition format
+on demand. Gauges that mirror existing state (open sockets, queued jobs) read
+it at scrape time instead of being updated on the request path
+
+Each worker process has its own registry, so scrape workers individually
+"""
+
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.responses import Response
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; dialogue turns range from a cached 304 to a long provider call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> Iterable[str]:
+        return []
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class Gauge(Metric):
+    """A settable gauge, or one read from collect() at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+        self.collect = collect
+
+    def set(self, *labels: str, value: float):
+        self.values[labels] = value
+
+    def samples(self):
+        values = self.values
+        if self.collect is not None:
+            try:
+                values = self.collect()
+            except Exception:
+                # A broken collector must not take the whole scrape down
+                return
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., count above the last bucket], sum
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, *labels: str, value: float):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def samples(self):
+        for labels, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(self.sums[labels])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # Re-registering returns the existing metric, so several apps in one process can share them
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              collect: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Gauge:
+        gauge = self.register(Gauge(name, documentation, labelnames, collect))
+        if collect is not None:
+            gauge.collect = collect
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests by route and status",
+                                 ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency by route",
+                                  ("method", "route"))
+PROVIDER_LATENCY = REGISTRY.histogram("provider_request_duration_seconds",
+                                      "Provider call latency until the full reply", ("provider", "operation"))
+PROVIDER_TTFT = REGISTRY.histogram("provider_time_to_first_token_seconds",
+                                   "Time from a streaming provider call to its first chunk", ("provider",))
+PROVIDER_TOKENS = REGISTRY.counter("provider_tokens_total", "Provider tokens, reported or estimated",
+                                   ("provider", "direction"))
+ERRORS = REGISTRY.counter("errors_total", "Errors by class", ("kind",))
+CACHE_REQUESTS = REGISTRY.counter("cache_requests_total", "Cache lookups by result (hit or miss)",
+                                  ("cache", "result"))
+
+def observe_generation(provider: str, operation: str, seconds: float, input_tokens: int = 0,
+                       output_tokens: int = 0, first_token_seconds: Optional[float] = None):
+    """Record one provider call"""
+    PROVIDER_LATENCY.observe(provider, operation, value=seconds)
+    if first_token_seconds is not None:
+        PROVIDER_TTFT.observe(provider, value=first_token_seconds)
+    if input_tokens:
+        PROVIDER_TOKENS.inc(provider, "input", amount=input_tokens)
+    if output_tokens:
+        PROVIDER_TOKENS.inc(provider, "output", amount=output_tokens)
+
+def record_error(error: BaseException):
+    ERRORS.inc(type(error).__name__)
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+class MetricsMiddleware:
+    """Times HTTP requests per route template, so /api/jobs/{job_id} is one series"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            record_error(e)
+            raise
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_LATENCY.observe(scope["method"], route, value=time.perf_counter() - started)
+            HTTP_REQUESTS.inc(scope["method"], route, str(status))
+            if status >= 500:
+                ERRORS.inc(f"http_{status}")
+
+def metrics_response(registry: Registry = REGISTRY) -> Response:
+    return Response(registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,170 @@
+"""
+Sampling profiler for the live backend
+A thread reads every thread's current Python stack PROFILE_HZ times a second
+(sys._current_frames), so the code being profiled runs unmodified. It counts
+the stacks in the collapsed format ("thread;outer;inner count" per line) that
+flamegraph.pl and speedscope read. sample_for() profiles for a fixed time,
+which is what /debug/profile serves
+
+With PROFILE_SAMPLE_RATE set (e.g. 0.01), ProfilingMiddleware picks that share
+of requests. While any picked request is in flight, the event loop thread is
+sampled. Every PROFILE_ROTATE_SECONDS the samples are written to PROFILE_DIR
+as profile-<time>.folded, and only the newest PROFILE_KEEP files are kept
+"""
+
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Optional
+
+class ProfilerBusy(Exception):
+    """Another on-demand profile is already running"""
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def collapse(frame, root: str) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    return ";".join(reversed(labels))
+
+def take_sample(counts: Counter, thread_ids: Optional[Iterable[int]] = None):
+    """Add the current stack of each thread (or only thread_ids) to counts"""
+    own = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    frames = sys._current_frames()
+    for thread_id in (frames if thread_ids is None else thread_ids):
+        frame = frames.get(thread_id)
+        if frame is not None and thread_id != own:
+            counts[collapse(frame, names.get(thread_id, str(thread_id)))] += 1
+
+def render(counts: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+_on_demand = threading.Lock()
+
+def sample_for(seconds: float, hz: float = 100) -> str:
+    """Sample all threads for a while and return the collapsed stacks; blocks, so run it in a thread"""
+    if not _on_demand.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already being taken")
+    try:
+        counts: Counter = Counter()
+        interval = 1 / hz
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            take_sample(counts)
+            time.sleep(interval)
+        return render(counts)
+    finally:
+        _on_demand.release()
+
+class ContinuousProfiler:
+    """Samples the event loop thread while sampled requests run, into rotating files"""
+
+    def __init__(self, directory: str, sample_rate: float, hz: float = 100, rotate_seconds: float = 60,
+                 keep: int = 10):
+        self.directory = Path(directory)
+        self.sample_rate = sample_rate
+        self.interval = 1 / hz
+        self.rotate_seconds = rotate_seconds
+        self.keep = keep
+        self.counts: Counter = Counter()
+        self.active = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the sampler thread; call from the event loop thread"""
+        if self._thread is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def should_sample(self) -> bool:
+        return random.random() < self.sample_rate
+
+    @contextlib.contextmanager
+    def track(self):
+        """Sample the loop while the enclosed request runs"""
+        self.active += 1
+        self._wake.set()
+        try:
+            yield
+        finally:
+            self.active -= 1
+
+    def _run(self):
+        rotate_at = time.monotonic() + self.rotate_seconds
+        while not self._stop.is_set():
+            # Cleared before checking, so a request starting in between still wakes us
+            self._wake.clear()
+            if self.active:
+                take_sample(self.counts, (self._loop_thread,))
+                self._stop.wait(self.interval)
+            else:
+                self._wake.wait(max(rotate_at - time.monotonic(), 0))
+            if time.monotonic() >= rotate_at:
+                self.rotate()
+                rotate_at = time.monotonic() + self.rotate_seconds
+        self.rotate()
+
+    def rotate(self):
+        """Write the samples so far to a new file and prune the oldest files"""
+        counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+        path = self.directory / f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.folded"
+        path.write_text(render(counts))
+        for old in sorted(self.directory.glob("profile-*.folded"), key=lambda p: p.stat().st_mtime)[:-self.keep]:
+            old.unlink(missing_ok=True)
+
+class ProfilingMiddleware:
+    """Profiles a random PROFILE_SAMPLE_RATE share of HTTP requests"""
+
+    def __init__(self, app, profiler: ContinuousProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_sample():
+            await self.app(scope, receive, send)
+            return
+        with self.profiler.track():
+            await self.app(scope, receive, send)
+
+def profile_hz() -> float:
+    return float(os.getenv("PROFILE_HZ", "100"))
+
+def create_continuous_profiler() -> Optional[ContinuousProfiler]:
+    """Build the continuous profiler from PROFILE_* env, or None unless PROFILE_SAMPLE_RATE is set"""
+    sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    if sample_rate <= 0:
+        return None
+    return ContinuousProfiler(
+        directory=os.getenv("PROFILE_DIR", "profiles"),
+        sample_rate=sample_rate,
+        hz=profile_hz(),
+        rotate_seconds=float(os.getenv("PROFILE_ROTATE_SECONDS", "60")),
+        keep=int(os.getenv("PROFILE_KEEP", "10"))
+    )
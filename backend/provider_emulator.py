@@ -0,0 +1,260 @@
+"""
+Local LLM provider emulator for offline benchmarks and CI
+Speaks enough of two wire formats for the official SDKs to talk to it:
+- Gemini: POST /v1beta/models/{model}:generateContent and
+  :streamGenerateContent (JSON array, or SSE with ?alt=sse)
+- OpenAI: POST /v1/chat/completions, streaming as SSE when "stream": true
+
+Replies are canned NPC lines, picked per prompt so a prompt always gets the
+same reply. Branching prompts get DIALOGUE:/OPTION lines back. Timing and
+failures are configurable on the command line or at runtime via
+POST /emulator/config:
+- latency: seconds before the first token
+- tokens_per_second: pace of the rest of the reply (0 = all at once)
+- error_rate: share of requests failing with a 500
+- rate_limit: requests per second before 429s (0 = unlimited)
+
+Point the backends at it with GEMINI_BASE_URL=http://127.0.0.1:8400 and
+OPENAI_BASE_URL=http://127.0.0.1:8400/v1, plus any non-empty API keys
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from providers import FAKE_LINES, estimate_tokens
+
+BRANCHING_OPTIONS = ["Tell me more.", "What do you want in return?", "I should be going.", "Can I help?"]
+
+class EmulatorConfig(BaseModel):
+    latency: float = 0.2
+    tokens_per_second: float = 50.0
+    error_rate: float = 0.0
+    rate_limit: float = 0.0
+    reply_sentences: int = 2
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second with a one-second burst"""
+
+    def __init__(self):
+        # Capped to a full bucket on first use
+        self.tokens = float("inf")
+        self.updated = time.monotonic()
+
+    def allow(self, rate: float) -> bool:
+        if rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(rate, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+app = FastAPI(title="Provider emulator")
+config = EmulatorConfig()
+limiter = RateLimiter()
+stats: Dict[str, int] = {"requests": 0, "streams": 0, "errors": 0, "rate_limited": 0}
+
+def reply_for(prompt: str) -> str:
+    rng = random.Random(prompt)
+    text = " ".join(rng.choice(FAKE_LINES) for _ in range(max(config.reply_sentences, 1)))
+    if "OPTION1:" in prompt:
+        options = rng.sample(BRANCHING_OPTIONS, 3)
+        return "\n".join([f"DIALOGUE: {text}"] + [f"OPTION{i}: {option}" for i, option in enumerate(options, 1)])
+    return text
+
+def chunks_of(text: str) -> List[str]:
+    words = text.split(" ")
+    return [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+
+async def paced(chunks: List[str]) -> AsyncIterator[str]:
+    """Yield chunks at the configured first-token latency and token rate"""
+    await asyncio.sleep(config.latency)
+    for i, chunk in enumerate(chunks):
+        if i and config.tokens_per_second:
+            await asyncio.sleep(estimate_tokens(chunk) / config.tokens_per_second)
+        yield chunk
+
+async def full_reply(text: str):
+    await asyncio.sleep(config.latency + (estimate_tokens(text) / config.tokens_per_second
+                                          if config.tokens_per_second else 0))
+
+def injected_failure(flavor: str) -> Optional[JSONResponse]:
+    """A 429 or 500 in the provider's own error format, or None to serve the request"""
+    stats["requests"] += 1
+    if not limiter.allow(config.rate_limit):
+        stats["rate_limited"] += 1
+        if flavor == "gemini":
+            body = {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+                              "status": "RESOURCE_EXHAUSTED"}}
+        else:
+            body = {"error": {"message": "Rate limit reached for requests", "type": "requests",
+                              "param": None, "code": "rate_limit_exceeded"}}
+        return JSONResponse(body, status_code=429, headers={"Retry-After": "1"})
+    if config.error_rate and random.random() < config.error_rate:
+        stats["errors"] += 1
+        if flavor == "gemini":
+            body = {"error": {"code": 500, "message": "An internal error has occurred.", "status": "INTERNAL"}}
+        else:
+            body = {"error": {"message": "The server had an error while processing your request.",
+                              "type": "server_error", "param": None, "code": None}}
+        return JSONResponse(body, status_code=500)
+    return None
+
+def sse(payload: Dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+# ---- Gemini ----
+
+def gemini_prompt(body: Dict) -> str:
+    parts = [part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])]
+    system = body.get("systemInstruction") or body.get("system_instruction") or {}
+    return "\n".join([part.get("text", "") for part in system.get("parts", [])] + parts)
+
+def gemini_response(text: str, prompt_tokens: int, output_tokens: int, finished: bool = True) -> Dict:
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    return {
+        "candidates": [candidate],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                          "totalTokenCount": prompt_tokens + output_tokens},
+        "modelVersion": "emulator"
+    }
+
+@app.post("/{version}/models/{model}:generateContent")
+async def gemini_generate(version: str, model: str, request: Request):
+    failure = injected_failure("gemini")
+    if failure:
+        return failure
+    prompt = gemini_prompt(await request.json())
+    text = reply_for(prompt)
+    await full_reply(text)
+    return gemini_response(text, estimate_tokens(prompt), estimate_tokens(text))
+
+@app.post("/{version}/models/{model}:streamGenerateContent")
+async def gemini_stream(version: str, model: str, request: Request, alt: Optional[str] = None):
+    failure = injected_failure("gemini")
+    if failure:
+        return failure
+    stats["streams"] += 1
+    prompt = gemini_prompt(await request.json())
+    text = reply_for(prompt)
+    prompt_tokens = estimate_tokens(prompt)
+
+    async def events():
+        chunks = chunks_of(text)
+        sent = 0
+        async for chunk in paced(chunks):
+            sent += 1
+            payload = gemini_response(chunk, prompt_tokens, estimate_tokens("".join(chunks[:sent])),
+                                      finished=sent == len(chunks))
+            if alt == "sse":
+                yield sse(payload)
+            else:
+                # Without alt=sse the API streams one JSON array, an element at a time
+                yield ("[" if sent == 1 else ",\r\n") + json.dumps(payload)
+        if alt != "sse":
+            yield "]"
+
+    media_type = "text/event-stream" if alt == "sse" else "application/json"
+    return StreamingResponse(events(), media_type=media_type)
+
+# ---- OpenAI ----
+
+def openai_prompt(body: Dict) -> str:
+    messages = body.get("messages", [])
+    return "\n".join(message["content"] if isinstance(message.get("content"), str) else
+                     " ".join(part.get("text", "") for part in message.get("content") or [])
+                     for message in messages)
+
+@app.post("/v1/chat/completions")
+async def openai_chat(request: Request):
+    failure = injected_failure("openai")
+    if failure:
+        return failure
+    body = await request.json()
+    prompt = openai_prompt(body)
+    text = reply_for(prompt)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    model = body.get("model", "emulator")
+    usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(text),
+             "total_tokens": estimate_tokens(prompt) + estimate_tokens(text)}
+
+    if not body.get("stream"):
+        await full_reply(text)
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    stats["streams"] += 1
+
+    def chunk(delta: Dict, finish_reason: Optional[str] = None) -> Dict:
+        return {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    async def events():
+        yield sse(chunk({"role": "assistant", "content": ""}))
+        async for piece in paced(chunks_of(text)):
+            yield sse(chunk({"content": piece}))
+        yield sse(chunk({}, "stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield sse({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                       "model": model, "choices": [], "usage": usage})
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+# ---- Control ----
+
+@app.get("/emulator/config")
+async def get_config():
+    return config
+
+@app.post("/emulator/config")
+async def update_config(changes: Dict):
+    """Change latency, tokens_per_second, error_rate, rate_limit or reply_sentences while running"""
+    global config
+    config = config.model_copy(update={key: value for key, value in changes.items() if key in EmulatorConfig.model_fields})
+    return config
+
+@app.get("/emulator/stats")
+async def get_stats():
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate the Gemini and OpenAI APIs locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8400)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="0 sends the reply at once")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests per second before 429s (0 = off)")
+    parser.add_argument("--reply-sentences", type=int, default=2)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+
+    global config
+    config = EmulatorConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                            error_rate=args.error_rate, rate_limit=args.rate_limit,
+                            reply_sentences=args.reply_sentences)
+    import uvicorn
+    print(f"🎭 Provider emulator on http://{args.host}:{args.port}")
+    print(f"   GEMINI_BASE_URL=http://{args.host}:{args.port}  OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Provider layer for NPC dialogue generation
+Wraps Gemini, OpenAI and an offline fake provider behind one async interface:
+generate() returns the whole reply, stream() yields it in text chunks
+
+GEMINI_BASE_URL and OPENAI_BASE_URL point the providers at another endpoint,
+such as provider_emulator.py for offline benchmarks
+"""
+
+import asyncio
+import json
+import os
+import random
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+
+DEFAULT_SYSTEM_PROMPT = "You are an expert NPC dialogue generator. Maintain character consistency and provide engaging, immersive responses."
+
+class ProviderConfigError(ValueError):
+    """A provider is missing credentials or configuration"""
+
+@dataclass
+class GenerationResult:
+    text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    provider: str = ""
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate for providers that don't report usage"""
+    return max(1, len(text) // 4) if text else 0
+
+def gemini_configure_kwargs() -> Dict:
+    """Extra genai.configure() arguments pointing the sync SDK at GEMINI_BASE_URL, if set"""
+    base_url = os.getenv("GEMINI_BASE_URL")
+    return {"transport": "rest", "client_options": {"api_endpoint": base_url}} if base_url else {}
+
+class GeminiProvider:
+    """Google Gemini via google-generativeai, or its REST API at base_url"""
+    name = "gemini"
+
+    def __init__(self, model_name: str = "gemini-1.5-flash", api_key: Optional[str] = None,
+                 base_url: Optional[str] = None):
+        self.model_name = model_name
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        # The SDK's async client has no REST transport, so custom endpoints are called directly
+        self.base_url = (base_url or os.getenv("GEMINI_BASE_URL") or "").rstrip("/")
+        self._model = None
+        self._http = None
+
+    def _get_http(self):
+        if self._http is None:
+            if not self.api_key:
+                raise ProviderConfigError("Google API key not found. Set GOOGLE_API_KEY in .env file.")
+            import httpx
+            self._http = httpx.AsyncClient(base_url=self.base_url, timeout=60,
+                                           headers={"x-goog-api-key": self.api_key})
+        return self._http
+
+    def _rest_body(self, contents: str, max_tokens: int, temperature: float) -> Dict:
+        return {"contents": [{"role": "user", "parts": [{"text": contents}]}],
+                "generationConfig": {"maxOutputTokens": max_tokens, "temperature": temperature}}
+
+    @staticmethod
+    def _rest_text(payload: Dict) -> str:
+        candidates = payload.get("candidates") or [{}]
+        return "".join(part.get("text", "") for part in candidates[0].get("content", {}).get("parts", []))
+
+    def _get_model(self):
+        if self._model is None:
+            if not self.api_key:
+                raise ProviderConfigError("Google API key not found. Set GOOGLE_API_KEY in .env file.")
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(model_name=self.model_name)
+        return self._model
+
+    async def generate(self, prompt: str, system: Optional[str] = None,
+                       max_tokens: int = 300, temperature: float = 0.8) -> GenerationResult:
+        contents = f"{system}\n\n{prompt}" if system else prompt
+        if self.base_url:
+            response = await self._get_http().post(f"/v1beta/models/{self.model_name}:generateContent",
+                                                   json=self._rest_body(contents, max_tokens, temperature))
+            response.raise_for_status()
+            payload = response.json()
+            text = self._rest_text(payload).strip()
+            usage = payload.get("usageMetadata", {})
+            return GenerationResult(
+                text=text,
+                input_tokens=usage.get("promptTokenCount") or estimate_tokens(contents),
+                output_tokens=usage.get("candidatesTokenCount") or estimate_tokens(text),
+                provider=self.name
+            )
+        model = self._get_model()
+        import google.generativeai as genai
+        response = await model.generate_content_async(
+            contents,
+            generation_config=genai.types.GenerationConfig(
+                max_output_tokens=max_tokens,
+                temperature=temperature
+            )
+        )
+        text = response.text.strip()
+        usage = getattr(response, "usage_metadata", None)
+        return GenerationResult(
+            text=text,
+            input_tokens=getattr(usage, "prompt_token_count", 0) or estimate_tokens(contents),
+            output_tokens=getattr(usage, "candidates_token_count", 0) or estimate_tokens(text),
+            provider=self.name
+        )
+
+    async def stream(self, prompt: str, system: Optional[str] = None,
+                     max_tokens: int = 300, temperature: float = 0.8) -> AsyncIterator[str]:
+        contents = f"{system}\n\n{prompt}" if system else prompt
+        if self.base_url:
+            async with self._get_http().stream(
+                    "POST", f"/v1beta/models/{self.model_name}:streamGenerateContent",
+                    params={"alt": "sse"}, json=self._rest_body(contents, max_tokens, temperature)) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line.startswith("data: "):
+                        text = self._rest_text(json.loads(line[len("data: "):]))
+                        if text:
+                            yield text
+            return
+        model = self._get_model()
+        import google.generativeai as genai
+        response = await model.generate_content_async(
+            contents,
+            generation_config=genai.types.GenerationConfig(
+                max_output_tokens=max_tokens,
+                temperature=temperature
+            ),
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+class OpenAIProvider:
+    """OpenAI chat completions"""
+    name = "openai"
+
+    def __init__(self, model_name: str = "gpt-3.5-turbo", api_key: Optional[str] = None,
+                 base_url: Optional[str] = None):
+        self.model_name = model_name
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            if not self.api_key:
+                raise ProviderConfigError("OPENAI_API_KEY not found in environment variables.")
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self._client
+
+    async def generate(self, prompt: str, system: Optional[str] = None,
+                       max_tokens: int = 300, temperature: float = 0.8) -> GenerationResult:
+        client = self._get_client()
+        messages = []
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.append({"role": "user", "content": prompt})
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        text = response.choices[0].message.content.strip()
+        usage = response.usage
+        return GenerationResult(
+            text=text,
+            input_tokens=usage.prompt_tokens if usage else estimate_tokens(prompt),
+            output_tokens=usage.completion_tokens if usage else estimate_tokens(text),
+            provider=self.name
+        )
+
+    async def stream(self, prompt: str, system: Optional[str] = None,
+                     max_tokens: int = 300, temperature: float = 0.8) -> AsyncIterator[str]:
+        client = self._get_client()
+        messages = []
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.append({"role": "user", "content": prompt})
+        response = await client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+FAKE_LINES = [
+    "Greetings, traveler! The road has been long, I can see it in your eyes.",
+    "Few ask me that. Sit, and I will tell you what I know.",
+    "Trust is earned slowly in these parts, but you have made a fair start.",
+    "Keep your wits about you. Not everything in this place is as it seems.",
+    "Ah, that is a tale for another time. For now, tell me what brings you here."
+]
+
+class FakeProvider:
+    """Offline provider returning canned lines, for tests and benchmarks
+
+    latency is the wait before the first token (FAKE_LATENCY seconds) and
+    tokens_per_second paces the rest of the reply (FAKE_TOKENS_PER_SECOND, 0 = instant)
+    """
+    name = "fake"
+
+    def __init__(self, model_name: str = "fake", latency: Optional[float] = None,
+                 tokens_per_second: Optional[float] = None, **kwargs):
+        self.model_name = model_name
+        self.latency = float(os.getenv("FAKE_LATENCY", "0")) if latency is None else latency
+        self.tokens_per_second = (float(os.getenv("FAKE_TOKENS_PER_SECOND", "0"))
+                                  if tokens_per_second is None else tokens_per_second)
+
+    async def generate(self, prompt: str, system: Optional[str] = None,
+                       max_tokens: int = 300, temperature: float = 0.8) -> GenerationResult:
+        text = random.Random(prompt).choice(FAKE_LINES)
+        delay = self.latency + (estimate_tokens(text) / self.tokens_per_second if self.tokens_per_second else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        return GenerationResult(
+            text=text,
+            input_tokens=estimate_tokens(f"{system or ''}{prompt}"),
+            output_tokens=estimate_tokens(text),
+            provider=self.name
+        )
+
+    async def stream(self, prompt: str, system: Optional[str] = None,
+                     max_tokens: int = 300, temperature: float = 0.8) -> AsyncIterator[str]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        words = random.Random(prompt).choice(FAKE_LINES).split(" ")
+        for i, word in enumerate(words):
+            chunk = word if i == len(words) - 1 else word + " "
+            # Yield to the loop between chunks, like a network stream would
+            await asyncio.sleep(estimate_tokens(chunk) / self.tokens_per_second if self.tokens_per_second and i else 0)
+            yield chunk
+
+PROVIDERS: Dict[str, type] = {
+    "gemini": GeminiProvider,
+    "openai": OpenAIProvider,
+    "fake": FakeProvider,
+}
+
+def get_provider(name: Optional[str] = None, **kwargs):
+    """Create a provider by name, defaulting to DIALOGUE_PROVIDER or gemini"""
+    name = (name or os.getenv("DIALOGUE_PROVIDER", "gemini")).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider '{name}'. Choose from: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name](**kwargs)
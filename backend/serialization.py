@@ -0,0 +1,102 @@
+"""
+Fast serialization helpers
+orjson-backed JSON responses and negotiated WebSocket frame codecs (JSON text or msgpack binary)
+Both libraries are optional; without them everything falls back to the stdlib json module
+"""
+
+import json
+import os
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class InvalidFrame(ValueError):
+    """A WebSocket frame that is not valid JSON or msgpack"""
+
+# Errors the codecs raise for malformed input; orjson's and msgpack's all derive from these
+DECODE_ERRORS = (ValueError, TypeError) + ((msgpack.UnpackException,) if msgpack is not None else ())
+
+FAST_JSON_ENABLED = orjson is not None and os.getenv("FAST_JSON", "1") != "0"
+
+def dumps(obj: Any) -> str:
+    if FAST_JSON_ENABLED:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+def loads(data: Union[str, bytes]) -> Any:
+    if FAST_JSON_ENABLED:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+# Used as the app-wide default_response_class
+DefaultJSONResponse = FastJSONResponse if FAST_JSON_ENABLED else JSONResponse
+
+class JSONCodec:
+    name = "json"
+
+    def encode(self, obj: Any) -> str:
+        return dumps(obj)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return loads(data)
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            # Clients may still send JSON text frames on a msgpack connection
+            return loads(data)
+        return msgpack.unpackb(data, raw=False)
+
+def negotiate_codec(websocket: WebSocket):
+    """Pick a frame codec from the offered subprotocols or ?encoding=, returning (codec, subprotocol)"""
+    offered = websocket.scope.get("subprotocols") or []
+    wants_msgpack = "msgpack" in offered or websocket.query_params.get("encoding") == "msgpack"
+    if wants_msgpack and msgpack is not None:
+        return MsgpackCodec(), "msgpack" if "msgpack" in offered else None
+    return JSONCodec(), "json" if "json" in offered else None
+
+async def receive_frame(websocket: WebSocket, codec) -> Any:
+    """Receive and decode one text or binary frame; raises InvalidFrame when it does not decode"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    data = message.get("bytes")
+    if data is None:
+        data = message.get("text", "")
+    try:
+        return codec.decode(data)
+    except DECODE_ERRORS as e:
+        raise InvalidFrame(f"Frame is not valid {codec.name}: {e}") from e
+
+async def send_payload(websocket: WebSocket, payload: Union[str, bytes]):
+    """Send an already encoded frame, binary for bytes and text for str"""
+    if isinstance(payload, bytes):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+
+async def send_frame(websocket: WebSocket, codec, obj: Any):
+    """Encode and send one frame, binary for msgpack and text for JSON"""
+    await send_payload(websocket, codec.encode(obj))
@@ -1,11 +1,16 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Dict, List, Optional
+from typing import Optional
 import json
 import os
+import time
 from dotenv import load_dotenv
-import openai
+from state_store import create_state_store
+from lifecycle import DrainMiddleware, drain
+from loop_monitor import create_loop_monitor
+from memory import create_memory_guard, track_memory
+from metrics import REGISTRY, MetricsMiddleware, metrics_response, observe_generation, record_error
 
 load_dotenv()
 
@@ -19,13 +24,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
-client = openai.OpenAI(api_key=openai.api_key)
+# Per-route latency and status counts for /metrics
+app.add_middleware(MetricsMiddleware)
 
-# In-memory storage
-conversations: Dict[str, List[Dict]] = {}
-character_profiles: Dict[str, Dict] = {}
+# Turn new work away while a stopping worker finishes its in-flight requests
+app.add_middleware(DrainMiddleware)
+
+# OpenAI is imported and the key checked on the first generation, so the app starts without it
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise HTTPException(status_code=503, detail="OPENAI_API_KEY not found in environment variables.")
+        import openai
+        client = openai.OpenAI(api_key=api_key)
+    return client
+
+def chat_completion(**kwargs):
+    """Call OpenAI and record its latency and token usage"""
+    started = time.perf_counter()
+    try:
+        response = get_client().chat.completions.create(model="gpt-3.5-turbo", **kwargs)
+    except HTTPException:
+        raise
+    except Exception as e:
+        record_error(e)
+        raise
+    usage = response.usage
+    observe_generation("openai", "generate", time.perf_counter() - started,
+                       usage.prompt_tokens if usage else 0, usage.completion_tokens if usage else 0)
+    return response
+
+# Shared storage (STATE_BACKEND=sqlite lets several workers see the same data)
+state = create_state_store()
 
 class CharacterProfile(BaseModel):
     name: str
@@ -94,35 +128,33 @@ async def root():
 @app.post("/api/character/create")
 async def create_character(profile: CharacterProfile):
     """Create a new character profile"""
-    character_id = f"char_{len(character_profiles) + 1}"
     character_data = profile.dict()
-    character_profiles[character_id] = character_data
+    character_id = state.add_characters([character_data])[0]
     return {"character_id": character_id, "profile": character_data}
 
 @app.get("/api/characters")
 async def get_characters():
     """Get all available characters"""
-    return {"characters": character_profiles}
+    return {"characters": state.all_characters()}
 
 @app.post("/api/dialogue/generate")
 async def generate_dialogue(request: DialogueRequest):
     """Generate dialogue with character consistency"""
     try:
-        if request.character_id not in character_profiles:
+        character = state.get_character(request.character_id)
+        if character is None:
             raise HTTPException(status_code=404, detail="Character not found")
         
-        character = character_profiles[request.character_id]
         session_key = f"{request.character_id}_{request.session_id}"
         
-        # Get conversation history
-        conversation_history = conversations.get(session_key, [])
+        # Get conversation history (build_prompt only uses the last 5 turns)
+        conversation_history = state.recent_turns(session_key, 5)
         
         # Build prompt with context
         prompt = build_prompt(character, request.message, conversation_history)
         
         # Generate response using OpenAI
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        response = chat_completion(
             messages=[
                 {"role": "system", "content": "You are an expert NPC dialogue generator. Maintain character consistency and provide engaging, immersive responses."},
                 {"role": "user", "content": prompt}
@@ -134,10 +166,10 @@ async def generate_dialogue(request: DialogueRequest):
         npc_response = response.choices[0].message.content.strip()
         
         # Store conversation
-        conversations[session_key] = conversations.get(session_key, []) + [
+        state.append_turns(session_key, [
             {"speaker": "Player", "content": request.message, "timestamp": "now"},
             {"speaker": character["name"], "content": npc_response, "timestamp": "now"}
-        ]
+        ])
         
         return {
             "response": npc_response,
@@ -145,6 +177,8 @@ async def generate_dialogue(request: DialogueRequest):
             "session_id": request.session_id
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -152,11 +186,10 @@ async def generate_dialogue(request: DialogueRequest):
 async def generate_branching_dialogue(request: BranchingDialogueRequest):
     """Generate branching dialogue with multiple conversation paths"""
     try:
-        if request.character_id not in character_profiles:
+        character = state.get_character(request.character_id)
+        if character is None:
             raise HTTPException(status_code=404, detail="Character not found")
         
-        character = character_profiles[request.character_id]
-        
         # Create branching dialogue structure
         if not request.selected_option:
             # Initial dialogue with options
@@ -185,8 +218,7 @@ async def generate_branching_dialogue(request: BranchingDialogueRequest):
             OPTION3: [third option text]
             """
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        response = chat_completion(
             messages=[
                 {"role": "system", "content": "You are an expert game dialogue writer. Create engaging, branching conversations that maintain character consistency."},
                 {"role": "user", "content": prompt}
@@ -214,6 +246,8 @@ async def generate_branching_dialogue(request: BranchingDialogueRequest):
             "character_name": character["name"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -227,8 +261,7 @@ async def translate_dialogue(request: dict):
         if not text:
             raise HTTPException(status_code=400, detail="Text is required")
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        response = chat_completion(
             messages=[
                 {"role": "system", "content": f"Translate the following text to {target_language}. Maintain the tone and style of the original text."},
                 {"role": "user", "content": text}
@@ -245,15 +278,68 @@ async def translate_dialogue(request: dict):
             "target_language": target_language
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Event-loop lag watchdog, off unless LOOP_MONITOR_THRESHOLD_MS is set
+loop_monitor = create_loop_monitor()
+# Per-structure memory in /metrics; above MEMORY_SOFT_LIMIT_MB the oldest sessions are evicted
+track_memory(state.memory_usage)
+memory_guard = create_memory_guard()
+if memory_guard:
+    memory_guard.on_pressure("sessions")(state.evict_sessions)
+
+@app.on_event("startup")
+async def start_monitors():
+    if loop_monitor:
+        loop_monitor.start()
+    if memory_guard:
+        memory_guard.start()
+
+@app.on_event("shutdown")
+async def stop_monitors():
+    if loop_monitor:
+        await loop_monitor.stop()
+    if memory_guard:
+        await memory_guard.stop()
+
+REGISTRY.gauge("inflight_requests", "HTTP requests in progress", collect=lambda: {(): drain.inflight})
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker"""
+    return metrics_response()
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the state store answers and the worker is not draining"""
+    if drain.draining:
+        raise HTTPException(status_code=503, detail="Draining")
+    try:
+        state.characters_version()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"State store unavailable: {e}")
+    return {"status": "ready"}
+
 @app.get("/api/conversation/{character_id}/{session_id}")
 async def get_conversation(character_id: str, session_id: str):
     """Get conversation history"""
     session_key = f"{character_id}_{session_id}"
-    return {"conversation": conversations.get(session_key, [])}
+    turns, _ = state.get_conversation(session_key)
+    return {"conversation": turns}
+
+@drain.on_drain
+async def flush_state():
+    state.flush()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from lifecycle import DrainingServer
+    DrainingServer(uvicorn.Config(app, host="0.0.0.0", port=8000)).run()
@@ -0,0 +1,307 @@
+"""
+Pluggable storage for characters, conversations and connection presence
+MemoryStateStore keeps everything in this process (the original behaviour);
+SQLiteStateStore shares one database file between uvicorn workers so every
+process sees the same characters and sessions
+
+Pick one with STATE_BACKEND=memory|sqlite and STATE_DB_PATH
+
+put_characters() stores characters under ids minted by another node, so a
+gateway can replicate the character catalog to every node; later ids minted
+here continue after the highest one stored
+"""
+
+import bisect
+import itertools
+import json
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from memory import deep_size, estimate_size
+
+class MemoryStateStore:
+    """Single-process store backed by dicts"""
+    name = "memory"
+
+    def __init__(self):
+        self.characters: Dict[str, Dict] = {}
+        self.conversations: Dict[str, List[Dict]] = {}
+        # Last seq of every session, kept when its turns are evicted so its seq never goes back
+        self.last_seqs: Dict[str, int] = {}
+        self.connections: Dict[str, int] = {}
+        # Highest character number stored; ids are minted under the lock, so requests and job threads never share one
+        self._last_number = 0
+        # Sorted character numbers for cursor pagination, and a version that changes on every write
+        self._character_index: List[int] = []
+        self._version = 0
+        # Versions restart at 0 with the process, so an ETag from an earlier run must not match a new one
+        self._boot_id = secrets.token_hex(4)
+        self._lock = threading.Lock()
+
+    def add_characters(self, batch: List[Dict]) -> List[str]:
+        with self._lock:
+            numbers = list(range(self._last_number + 1, self._last_number + 1 + len(batch)))
+            self._last_number += len(batch)
+            character_ids = [f"char_{n}" for n in numbers]
+            self.characters.update(zip(character_ids, batch))
+            for n in numbers:
+                bisect.insort(self._character_index, n)
+            self._version += 1
+        return character_ids
+
+    def put_characters(self, characters: Dict[str, Dict]):
+        with self._lock:
+            for character_id, profile in characters.items():
+                n = int(character_id.split("_", 1)[1])
+                if character_id not in self.characters:
+                    bisect.insort(self._character_index, n)
+                self.characters[character_id] = profile
+                self._last_number = max(self._last_number, n)
+            self._version += 1
+
+    def get_character(self, character_id: str) -> Optional[Dict]:
+        return self.characters.get(character_id)
+
+    def all_characters(self) -> Dict[str, Dict]:
+        return self.characters
+
+    def list_characters(self, cursor: int, limit: int) -> Tuple[Dict[str, Dict], Optional[int]]:
+        with self._lock:
+            start = bisect.bisect_right(self._character_index, cursor)
+            numbers = self._character_index[start:start + limit]
+            has_more = start + limit < len(self._character_index)
+        page = {f"char_{n}": self.characters[f"char_{n}"] for n in numbers}
+        return page, numbers[-1] if numbers and has_more else None
+
+    def characters_version(self) -> str:
+        return f"{self._boot_id}-{self._version}"
+
+    def append_turns(self, session_key: str, turns: List[Dict]):
+        # Re-inserted so the dict stays ordered from least to most recently used
+        history = self.conversations.pop(session_key, None) or []
+        self.conversations[session_key] = history
+        last_seq = self.last_seqs.get(session_key, 0)
+        for turn in turns:
+            last_seq += 1
+            turn["seq"] = last_seq
+            history.append(turn)
+        self.last_seqs[session_key] = last_seq
+
+    def recent_turns(self, session_key: str, count: int) -> List[Dict]:
+        return self.conversations.get(session_key, [])[-count:]
+
+    def get_conversation(self, session_key: str, since: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict], int]:
+        history = self.conversations.get(session_key)
+        if not history:
+            return [], self.last_seqs.get(session_key, 0)
+        # Seqs are contiguous within the history, but an evicted session's history starts after its last seq
+        start = since - history[0]["seq"] + 1
+        if start < 0:
+            start = 0
+        turns = history[start:start + limit] if limit else history[start:]
+        return turns, history[-1]["seq"]
+
+    def register_connection(self, key: str):
+        self.connections[key] = self.connections.get(key, 0) + 1
+
+    def unregister_connection(self, key: str):
+        if self.connections.get(key, 0) <= 1:
+            self.connections.pop(key, None)
+        else:
+            self.connections[key] -= 1
+
+    def connection_count(self) -> int:
+        return sum(self.connections.values())
+
+    def evict_sessions(self, fraction: float = 0.25) -> int:
+        """Forget the least recently used share of conversations"""
+        count = int(len(self.conversations) * fraction)
+        for session_key in list(itertools.islice(self.conversations, count)):
+            self.conversations.pop(session_key, None)
+        return count
+
+    def memory_usage(self) -> Dict[str, Tuple[int, int]]:
+        conversations = self.conversations
+        return {
+            "characters": (len(self.characters), sys.getsizeof(self.characters) + estimate_size(self.characters)),
+            "sessions": (len(conversations), sys.getsizeof(conversations) + estimate_size(
+                conversations, lambda item: sys.getsizeof(item[0]) + sys.getsizeof(item[1]))),
+            "turns": (sum(map(len, conversations.values())), estimate_size(
+                conversations, lambda item: sum(deep_size(turn) for turn in item[1]))),
+            "session_seqs": (len(self.last_seqs), sys.getsizeof(self.last_seqs) + estimate_size(self.last_seqs))
+        }
+
+    def flush(self):
+        pass
+
+class SQLiteStateStore:
+    """Store shared by every process that opens the same database file"""
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connect()
+        # A pre-forked worker must not share its parent's SQLite handle
+        os.register_at_fork(after_in_child=self._connect)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS characters (
+                    num INTEGER PRIMARY KEY AUTOINCREMENT,
+                    profile TEXT NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS turns (
+                    session_key TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    turn TEXT NOT NULL,
+                    PRIMARY KEY (session_key, seq)
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS connections (
+                    key TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (key, pid)
+                )
+            """)
+            # Connections left behind by a previous run of this pid are stale
+            self.conn.execute("DELETE FROM connections WHERE pid = ?", (self.pid,))
+
+    def _connect(self):
+        self.pid = os.getpid()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.lock = threading.Lock()
+
+    def _write(self, callback):
+        """Run callback in an IMMEDIATE transaction so concurrent writers serialize cleanly"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = callback(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def _query(self, sql: str, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def add_characters(self, batch: List[Dict]) -> List[str]:
+        def insert(conn):
+            character_ids = []
+            for profile in batch:
+                cursor = conn.execute("INSERT INTO characters (profile) VALUES (?)", (json.dumps(profile),))
+                character_ids.append(f"char_{cursor.lastrowid}")
+            return character_ids
+        return self._write(insert)
+
+    def put_characters(self, characters: Dict[str, Dict]):
+        # An explicit num also moves AUTOINCREMENT past it, so local ids continue after replicated ones
+        self._write(lambda conn: conn.executemany(
+            "INSERT OR REPLACE INTO characters (num, profile) VALUES (?, ?)",
+            [(int(character_id.split("_", 1)[1]), json.dumps(profile)) for character_id, profile in characters.items()]
+        ))
+
+    def get_character(self, character_id: str) -> Optional[Dict]:
+        try:
+            num = int(character_id.split("_", 1)[1])
+        except (IndexError, ValueError):
+            return None
+        rows = self._query("SELECT profile FROM characters WHERE num = ?", (num,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def all_characters(self) -> Dict[str, Dict]:
+        rows = self._query("SELECT num, profile FROM characters ORDER BY num")
+        return {f"char_{num}": json.loads(profile) for num, profile in rows}
+
+    def list_characters(self, cursor: int, limit: int) -> Tuple[Dict[str, Dict], Optional[int]]:
+        rows = self._query(
+            "SELECT num, profile FROM characters WHERE num > ? ORDER BY num LIMIT ?", (cursor, limit + 1)
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        page = {f"char_{num}": json.loads(profile) for num, profile in rows}
+        return page, rows[-1][0] if rows and has_more else None
+
+    def characters_version(self) -> str:
+        # Characters are kept across restarts and never deleted; replicated ones may land below the highest id
+        highest, count = self._query("SELECT COALESCE(MAX(num), 0), COUNT(*) FROM characters")[0]
+        return f"{highest}-{count}"
+
+    def append_turns(self, session_key: str, turns: List[Dict]):
+        def insert(conn):
+            last_seq = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM turns WHERE session_key = ?", (session_key,)
+            ).fetchone()[0]
+            for turn in turns:
+                last_seq += 1
+                turn["seq"] = last_seq
+                conn.execute(
+                    "INSERT INTO turns (session_key, seq, turn) VALUES (?, ?, ?)",
+                    (session_key, last_seq, json.dumps(turn))
+                )
+        self._write(insert)
+
+    def recent_turns(self, session_key: str, count: int) -> List[Dict]:
+        rows = self._query(
+            "SELECT turn FROM turns WHERE session_key = ? ORDER BY seq DESC LIMIT ?", (session_key, count)
+        )
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def get_conversation(self, session_key: str, since: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict], int]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT turn FROM turns WHERE session_key = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (session_key, since, limit if limit else -1)
+            ).fetchall()
+            last_seq = self.conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM turns WHERE session_key = ?", (session_key,)
+            ).fetchone()[0]
+        return [json.loads(row[0]) for row in rows], last_seq
+
+    def register_connection(self, key: str):
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO connections (key, pid, count) VALUES (?, ?, 1) "
+            "ON CONFLICT (key, pid) DO UPDATE SET count = count + 1",
+            (key, self.pid)
+        ))
+
+    def unregister_connection(self, key: str):
+        def remove(conn):
+            conn.execute("UPDATE connections SET count = count - 1 WHERE key = ? AND pid = ?", (key, self.pid))
+            conn.execute("DELETE FROM connections WHERE count <= 0")
+        self._write(remove)
+
+    def connection_count(self) -> int:
+        return self._query("SELECT COALESCE(SUM(count), 0) FROM connections")[0][0]
+
+    def evict_sessions(self, fraction: float = 0.25) -> int:
+        # Conversations live in the database file, not in this process
+        return 0
+
+    def memory_usage(self) -> Dict[str, Tuple[int, int]]:
+        return {}
+
+    def flush(self):
+        """Checkpoint the WAL so a stopping worker leaves everything in the main database file"""
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+def create_state_store():
+    """Build the store selected by STATE_BACKEND"""
+    backend = os.getenv("STATE_BACKEND", "memory").lower()
+    if backend == "sqlite":
+        return SQLiteStateStore(os.getenv("STATE_DB_PATH", "state.db"))
+    if backend == "memory":
+        return MemoryStateStore()
+    raise ValueError(f"Unknown STATE_BACKEND '{backend}'. Choose from: memory, sqlite")
@@ -0,0 +1,149 @@
+"""
+Resumable reply streams
+Every WebSocket reply is recorded as numbered frames (seq 1, 2, ...) in a
+per-session buffer. A client that reconnects sends {"type": "resume"} with the
+last seq it received and gets the rest of the reply, live if it is still being
+generated, instead of asking for a new generation. Finished streams expire
+after STREAM_BUFFER_TTL seconds and each session keeps only its latest
+STREAM_BUFFER_PER_SESSION streams, which bounds memory
+
+STREAM_BUFFER_TTL=0 drops a stream as soon as it finishes
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from memory import deep_size, estimate_size
+
+# Returns False once the receiver is gone, which unsubscribes it
+FrameSender = Callable[[Dict], bool]
+
+class ReplyStream:
+    """The frames of one reply and the connections following it"""
+    __slots__ = ("session_key", "request_id", "frames", "subscribers", "finished", "expires")
+
+    def __init__(self, session_key: str, request_id: Any):
+        self.session_key = session_key
+        self.request_id = request_id
+        self.frames: List[Dict] = []
+        self.subscribers: Dict[Any, Tuple[FrameSender, bool]] = {}
+        self.finished = False
+        self.expires = 0.0
+
+    def subscribe(self, key: Any, send: FrameSender, after_seq: int = 0, chunks: bool = True):
+        """Replay the frames after after_seq, then follow the stream until it finishes"""
+        for frame in self.frames[max(after_seq, 0):]:
+            if chunks or frame["type"] != "chunk":
+                send(frame)
+        if not self.finished:
+            self.subscribers[key] = (send, chunks)
+
+    def publish(self, frame: Dict) -> Dict:
+        """Number a frame, keep it, and send it to every subscriber"""
+        frame = {**frame, "seq": len(self.frames) + 1}
+        self.frames.append(frame)
+        for key, (send, chunks) in list(self.subscribers.items()):
+            if frame["type"] == "chunk" and not chunks:
+                continue
+            if not send(frame):
+                del self.subscribers[key]
+        return frame
+
+class StreamBuffers:
+    """Recent reply streams per session, for resuming after a reconnect"""
+
+    def __init__(self, ttl: float = 30.0, per_session: int = 4):
+        self.ttl = ttl
+        self.per_session = per_session
+        self.sessions: Dict[str, "OrderedDict[Any, ReplyStream]"] = {}
+        self._pruned = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def open(self, session_key: str, request_id: Any) -> ReplyStream:
+        """Start a stream for a turn as soon as it is accepted, so it can be resumed while queued"""
+        self.prune()
+        streams = self.sessions.setdefault(session_key, OrderedDict())
+        streams.pop(request_id, None)
+        stream = streams[request_id] = ReplyStream(session_key, request_id)
+        # Evict the oldest finished streams; running ones always stay
+        finished = [rid for rid, old in streams.items() if old.finished]
+        for rid in finished[:max(len(streams) - self.per_session, 0)]:
+            del streams[rid]
+        return stream
+
+    def finish(self, stream: ReplyStream):
+        """Stop following a stream; it stays resumable until the TTL runs out"""
+        if stream.finished:
+            return
+        stream.finished = True
+        stream.subscribers.clear()
+        stream.expires = time.monotonic() + self.ttl
+        streams = self.sessions.get(stream.session_key)
+        if not self.enabled and streams is not None and streams.get(stream.request_id) is stream:
+            self.discard(stream.session_key, stream.request_id)
+
+    def discard(self, session_key: str, request_id: Any):
+        streams = self.sessions.get(session_key)
+        if streams is not None:
+            streams.pop(request_id, None)
+            if not streams:
+                del self.sessions[session_key]
+
+    def get(self, session_key: str, request_id: Any = None) -> Optional[ReplyStream]:
+        """A session's stream by request id, or its latest one"""
+        self.prune()
+        streams = self.sessions.get(session_key)
+        if not streams:
+            return None
+        if request_id is None:
+            return next(reversed(streams.values()))
+        return streams.get(request_id)
+
+    def prune(self):
+        """Drop expired streams, at most once a second"""
+        now = time.monotonic()
+        if now - self._pruned < 1.0:
+            return
+        self._pruned = now
+        for session_key in list(self.sessions):
+            streams = self.sessions[session_key]
+            for request_id in [rid for rid, stream in streams.items() if stream.finished and stream.expires <= now]:
+                del streams[request_id]
+            if not streams:
+                del self.sessions[session_key]
+
+    def evict_finished(self) -> int:
+        """Drop every finished stream, even unexpired ones; running ones stay"""
+        evicted = 0
+        for session_key in list(self.sessions):
+            streams = self.sessions[session_key]
+            for request_id in [rid for rid, stream in streams.items() if stream.finished]:
+                del streams[request_id]
+                evicted += 1
+            if not streams:
+                del self.sessions[session_key]
+        return evicted
+
+    def memory_usage(self) -> Dict[str, Tuple[int, int]]:
+        streams = [stream for session in self.sessions.values() for stream in session.values()]
+        return {"reply_buffers": (sum(len(stream.frames) for stream in streams),
+                                  estimate_size(streams, lambda stream: deep_size(stream.frames)))}
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self.sessions),
+            "streams": sum(len(streams) for streams in self.sessions.values()),
+            "frames": sum(len(stream.frames) for streams in self.sessions.values() for stream in streams.values())
+        }
+
+def create_stream_buffers() -> StreamBuffers:
+    """Build the buffers from STREAM_BUFFER_TTL and STREAM_BUFFER_PER_SESSION"""
+    return StreamBuffers(
+        ttl=float(os.getenv("STREAM_BUFFER_TTL", "30")),
+        per_session=int(os.getenv("STREAM_BUFFER_PER_SESSION", "4"))
+    )
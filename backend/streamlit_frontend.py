@@ -2,6 +2,7 @@ import os
 import streamlit as st
 from dotenv import load_dotenv
 import google.generativeai as genai
+from providers import gemini_configure_kwargs
 
 # ---------- Load API Key from .env ----------
 load_dotenv()
@@ -12,7 +13,7 @@ if not GOOGLE_API_KEY:
     st.stop()
 
 # ---------- Configure Gemini Model ----------
-genai.configure(api_key=GOOGLE_API_KEY)
+genai.configure(api_key=GOOGLE_API_KEY, **gemini_configure_kwargs())
 model = genai.GenerativeModel(model_name="models/gemini-1.5-flash")
 
 # ---------- Initialize Chat State ----------
@@ -0,0 +1,158 @@
+"""
+Lightweight request tracing
+A trace covers one HTTP request or WebSocket turn. span("provider") times a
+stage of it, and spans nest through a context variable, so helpers can add
+spans without any objects being passed around. Finished traces become a
+Server-Timing header (or the timing of a WebSocket done frame). With
+TRACE_EXPORT_PATH set, they are also appended to that file as JSON lines,
+one span per line, using OpenTelemetry's OTLP field names
+
+An incoming W3C traceparent header is honoured, so spans join the caller's trace
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes or {}
+
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start)
+
+class Trace:
+    """The spans of one request, with the root span covering all of it"""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        # Maps perf_counter readings onto wall-clock time for the exporter
+        self.wall_offset = time.time_ns() - int(time.perf_counter() * 1e9)
+        self.root = Span(name, parent_id, attributes)
+        self.spans: List[Span] = [self.root]
+
+    def finish(self):
+        if self.root.end is None:
+            self.root.end = time.perf_counter()
+
+    def timings_ms(self) -> Dict[str, float]:
+        """Milliseconds per stage name (repeated stages are summed), plus the total"""
+        timings: Dict[str, float] = {}
+        for span in self.spans[1:]:
+            timings[span.name] = timings.get(span.name, 0.0) + span.duration * 1000
+        timings["total"] = self.root.duration * 1000
+        return {name: round(ms, 2) for name, ms in timings.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.timings_ms().items())
+
+    def to_otlp(self) -> List[Dict[str, Any]]:
+        return [{
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "startTimeUnixNano": self.wall_offset + int(span.start * 1e9),
+            "endTimeUnixNano": self.wall_offset + int((span.end or span.start) * 1e9),
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in span.attributes.items()]
+        } for span in self.spans]
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Time a stage of the current trace; does nothing outside a trace"""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _span.get() or trace.root
+    current = Span(name, parent.span_id, attributes)
+    trace.spans.append(current)
+    token = _span.set(current)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        _span.reset(token)
+
+@contextlib.contextmanager
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes):
+    """Make a new trace current for the enclosed code and export it when done"""
+    trace_id = parent_id = None
+    match = TRACEPARENT.match(traceparent or "")
+    if match:
+        trace_id, parent_id = match.groups()
+    trace = Trace(name, trace_id, parent_id, attributes)
+    trace_token = _trace.set(trace)
+    span_token = _span.set(None)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        if exporter is not None:
+            exporter.export(trace)
+
+class FileExporter:
+    """Appends finished spans to a JSON lines file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def export(self, trace: Trace):
+        lines = "".join(json.dumps(span) + "\n" for span in trace.to_otlp())
+        with self._lock:
+            self._file.write(lines)
+
+exporter: Optional[FileExporter] = FileExporter(os.environ["TRACE_EXPORT_PATH"]) if os.getenv("TRACE_EXPORT_PATH") else None
+
+class TracingMiddleware:
+    """Traces every HTTP request and reports its stages in a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1")
+        with start_trace(f"{scope['method']} {scope['path']}", traceparent) as trace:
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    route = getattr(scope.get("route"), "path", None)
+                    if route:
+                        trace.root.name = f"{scope['method']} {route}"
+                    trace.root.attributes["http.status_code"] = message["status"]
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", trace.server_timing().encode("latin-1"))
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
@@ -0,0 +1,230 @@
+"""
+Opt-in capture of anonymized player traffic for replay benchmarks
+With CAPTURE_PATH set, TrafficCaptureMiddleware appends one compact JSON line
+per API request and per WebSocket open, frame and close:
+- t: arrival time; ms and st: latency and status of HTTP requests
+- k: "http", "ws_open", "ws" or "ws_close"; r: route template; id: socket
+- pp, q, b: path parameters, query parameters and JSON body fields
+
+Character and session ids become salted hash tokens, and every word of free
+text (messages, profiles) becomes a pseudo-word of the same length. So the
+file keeps the traffic's shape (who talks to whom, when, and how much) but not
+its content. Set the same CAPTURE_SALT on every worker so a session keeps its
+token across workers; without it each process picks a random salt.
+CAPTURE_SAMPLE_RATE keeps that share of sessions, always whole sessions.
+Requests that match no route are not recorded, since only a route template
+keeps the raw path (and the ids in it) out of the file
+
+benchmarks/replay.py re-drives a capture against any backend
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from serialization import loads
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Only player-facing traffic; metrics, health checks and debug endpoints are skipped
+CAPTURED_PREFIXES = ("/api/", "/ws")
+# Replaced by tokens that are stable for one salt
+ID_FIELDS = ("character_id", "session_id")
+# Passed through, since they change what the server does but identify no one
+KEPT_FIELDS = ("target_language", "stream", "supersede", "type", "last_seq", "limit", "since", "cursor", "encoding")
+# Bodies above this (bulk imports) are recorded without their fields
+MAX_BODY_BYTES = 64 * 1024
+
+WORD = re.compile(r"\w+")
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+class TrafficCapture:
+    """Anonymizes requests and appends them to a JSON lines file"""
+
+    def __init__(self, path: str, salt: Optional[str] = None, sample_rate: float = 1.0):
+        self.path = path
+        self.salt = (salt or secrets.token_hex(16)).encode()
+        self.sample_rate = sample_rate
+        self._sockets = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def _hash(self, value: str, size: int = 6) -> bytes:
+        return hashlib.blake2b(value.encode(), key=self.salt, digest_size=size).digest()
+
+    def token(self, field: str, value: Any) -> str:
+        return f"{field[0]}_{self._hash(str(value)).hex()}"
+
+    def scrub(self, text: str) -> str:
+        """Replace each word with a pseudo-word of the same length; the same word always maps the same way"""
+        def pseudo(match):
+            word = match.group()
+            digest = self._hash(word, min(len(word), 64))
+            return "".join(LETTERS[b % 26] for b in digest) + "x" * (len(word) - len(digest))
+        return WORD.sub(pseudo, text)
+
+    def anonymize(self, fields: Dict) -> Dict:
+        out = {}
+        for key, value in fields.items():
+            if key in ID_FIELDS and value is not None:
+                out[key] = self.token(key, value)
+            elif key in KEPT_FIELDS or isinstance(value, (bool, int, float)) or value is None:
+                out[key] = value
+            elif isinstance(value, str):
+                out[key] = self.scrub(value)
+            # Lists and nested objects would leak structure the replay cannot use
+        return out
+
+    def sampled(self, session: Optional[str]) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        if session is None:
+            return random.random() < self.sample_rate
+        digest = self._hash(session, 4)
+        return int.from_bytes(digest, "big") / 2**32 < self.sample_rate
+
+    def socket_id(self) -> str:
+        return f"{os.getpid()}-{next(self._sockets)}"
+
+    def write(self, record: Dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            # Sockets still closing after shutdown have nowhere to write
+            if not self._file.closed:
+                self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def _session_of(fields: Dict) -> Optional[str]:
+    if fields.get("session_id") is None:
+        return None
+    return f"{fields.get('character_id')}_{fields['session_id']}"
+
+def _body_fields(body: bytes) -> Dict:
+    if not body or len(body) > MAX_BODY_BYTES:
+        return {}
+    try:
+        data = loads(body)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _frame_fields(message: Dict) -> Dict:
+    try:
+        if message.get("bytes") is not None:
+            data = msgpack.unpackb(message["bytes"], raw=False) if msgpack is not None else None
+        else:
+            data = loads(message.get("text") or "")
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _query_fields(scope) -> Dict:
+    query = scope.get("query_string", b"").decode("latin-1")
+    return dict(pair.split("=", 1) if "=" in pair else (pair, "") for pair in query.split("&") if pair)
+
+class TrafficCaptureMiddleware:
+    """Records player-facing HTTP requests and WebSocket frames through a TrafficCapture"""
+
+    def __init__(self, app, capture: TrafficCapture):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not scope["path"].startswith(CAPTURED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            await self._websocket(scope, receive, send)
+
+    async def _http(self, scope, receive, send):
+        arrived = time.time()
+        started = time.perf_counter()
+        chunks = []
+        size = 0
+        status = 500
+
+        async def receive_recording():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request" and size <= MAX_BODY_BYTES:
+                size += len(message.get("body", b""))
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_recording, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            path_params = scope.get("path_params") or {}
+            body = _body_fields(b"".join(chunks))
+            if route is not None and self.capture.sampled(_session_of({**body, **path_params})):
+                record = {"t": round(arrived, 3), "k": "http", "m": scope["method"],
+                          "r": route, "ms": round((time.perf_counter() - started) * 1000, 1), "st": status}
+                for key, fields in (("pp", path_params), ("q", _query_fields(scope)), ("b", body)):
+                    if fields:
+                        record[key] = self.capture.anonymize(fields)
+                self.capture.write(record)
+
+    async def _websocket(self, scope, receive, send):
+        capture = self.capture
+        socket_id = capture.socket_id()
+        opened = False
+        recorded = False
+
+        async def receive_recording():
+            nonlocal opened, recorded
+            message = await receive()
+            path_params = scope.get("path_params") or {}
+            if not opened:
+                # The first receive is websocket.connect, after routing has filled in the path parameters
+                opened = True
+                route = getattr(scope.get("route"), "path", None)
+                # Multiplexed sockets are always opened; their frames are sampled by session
+                recorded = route is not None and (not path_params or capture.sampled(_session_of(path_params)))
+                if recorded:
+                    record = {"t": round(time.time(), 3), "k": "ws_open", "id": socket_id, "r": route}
+                    if path_params:
+                        record["pp"] = capture.anonymize(path_params)
+                    query = _query_fields(scope)
+                    if query:
+                        record["q"] = capture.anonymize(query)
+                    capture.write(record)
+            elif message["type"] == "websocket.receive" and recorded:
+                fields = _frame_fields(message)
+                # Multiplexed frames name their session; per-session sockets carry it in the path
+                if capture.sampled(_session_of(fields if "session_id" in fields else path_params)):
+                    capture.write({"t": round(time.time(), 3), "k": "ws", "id": socket_id,
+                                   "b": capture.anonymize(fields)})
+            elif message["type"] == "websocket.disconnect" and recorded:
+                capture.write({"t": round(time.time(), 3), "k": "ws_close", "id": socket_id})
+            return message
+
+        await self.app(scope, receive_recording, send)
+
+def create_traffic_capture() -> Optional[TrafficCapture]:
+    """Build the capture from CAPTURE_PATH, CAPTURE_SALT and CAPTURE_SAMPLE_RATE, or None unless a path is set"""
+    path = os.getenv("CAPTURE_PATH")
+    if not path:
+        return None
+    return TrafficCapture(path, os.getenv("CAPTURE_SALT"), float(os.getenv("CAPTURE_SAMPLE_RATE", "1")))
@@ -0,0 +1,125 @@
+"""
+Scheduling of WebSocket dialogue turns
+Turns on one socket run concurrently instead of one after another. Within a
+session the newest message wins: it cancels the generation still running for
+that session (supersede), and messages arriving within the debounce window are
+coalesced into one turn, so a player typing in bursts costs one provider call
+
+Configure with WS_SUPERSEDE=1|0 and WS_DEBOUNCE_MS (0 disables debouncing)
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, ContextManager, Dict, List, Optional, Set
+
+logger = logging.getLogger("uvicorn.error")
+
+@dataclass
+class Turn:
+    request_id: Any
+    message: str
+    # Caller data echoed with the reply, e.g. the envelope of a multiplexed frame
+    context: Any = None
+    # Send the reply in chunk frames as it is generated, not only as a whole
+    stream: bool = True
+
+class _Session:
+    __slots__ = ("pending", "running", "task")
+
+    def __init__(self):
+        self.pending: List[Turn] = []
+        self.running: List[Turn] = []
+        self.task: Optional[asyncio.Task] = None
+
+class TurnScheduler:
+    """Runs the turns of one socket, superseding and coalescing per session"""
+
+    def __init__(self, run_turn: Callable[[Turn], Awaitable[None]],
+                 on_cancel: Callable[[str, Turn, str, Any], None],
+                 debounce: float = 0.0, supersede: bool = True,
+                 track: Callable[[], ContextManager] = contextlib.nullcontext):
+        self.run_turn = run_turn
+        self.on_cancel = on_cancel
+        self.debounce = debounce
+        self.supersede = supersede
+        self.track = track
+        self.sessions: Dict[str, _Session] = {}
+        self.tasks: Set[asyncio.Task] = set()
+
+    def submit(self, session_key: str, turn: Turn, supersede: Optional[bool] = None):
+        """Schedule a turn; supersede=False runs it alongside the session's other turns"""
+        if not (self.supersede if supersede is None else supersede):
+            self._spawn(self._run_alone(turn))
+            return
+
+        session = self.sessions.setdefault(session_key, _Session())
+        if session.task is not None and not session.task.done():
+            # Still debouncing: keep its messages and restart the window.
+            # Already generating: the stale answer is no longer wanted
+            for stale in session.running:
+                self.on_cancel(session_key, stale, "superseded", turn.request_id)
+            session.running = []
+            session.task.cancel()
+        session.pending.append(turn)
+        session.task = self._spawn(self._run_session(session_key, session))
+
+    def cancel_all(self):
+        """Stop every turn; queued ones are reported as cancelled"""
+        for session_key, session in list(self.sessions.items()):
+            for turn in session.pending:
+                self.on_cancel(session_key, turn, "closed", None)
+            session.pending = []
+        for task in list(self.tasks):
+            task.cancel()
+
+    async def wait(self):
+        """Wait for every scheduled turn to finish"""
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._finished)
+        return task
+
+    def _finished(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("WebSocket turn failed", exc_info=task.exception())
+
+    async def _run_alone(self, turn: Turn):
+        with self.track():
+            await self.run_turn(turn)
+
+    async def _run_session(self, session_key: str, session: _Session):
+        with self.track():
+            try:
+                if self.debounce:
+                    await asyncio.sleep(self.debounce)
+                batch, session.pending = session.pending, []
+                latest = batch[-1]
+                session.running = [latest]
+                for earlier in batch[:-1]:
+                    self.on_cancel(session_key, earlier, "coalesced", latest.request_id)
+                if len(batch) > 1:
+                    latest = Turn(latest.request_id, "\n".join(turn.message for turn in batch), latest.context,
+                                  latest.stream)
+                await self.run_turn(latest)
+            finally:
+                if session.task is asyncio.current_task():
+                    del self.sessions[session_key]
+
+def create_turn_scheduler(run_turn: Callable[[Turn], Awaitable[None]],
+                          on_cancel: Callable[[str, Turn, str, Any], None],
+                          track: Callable[[], ContextManager] = contextlib.nullcontext) -> TurnScheduler:
+    """Build a scheduler from the WS_SUPERSEDE and WS_DEBOUNCE_MS environment variables"""
+    return TurnScheduler(
+        run_turn,
+        on_cancel,
+        debounce=float(os.getenv("WS_DEBOUNCE_MS", "0")) / 1000,
+        supersede=os.getenv("WS_SUPERSEDE", "1").lower() not in ("0", "false", "no"),
+        track=track
+    )
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+WebSocket connection and broadcast benchmark
+Starts one backend worker with the fake provider, opens N WebSocket listeners on
+one character, and reports the server's memory per connection and how long a
+broadcast ("town crier") takes to reach every listener
+
+Usage:
+    python benchmarks/bench_connections.py [--connections 500] [--broadcasts 20] [--json results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+import websockets
+
+from bench_utils import backend_worker
+
+PROFILE = {
+    "name": "Town Crier",
+    "role": "Herald",
+    "personality": "Loud, punctual, dramatic",
+    "backstory": "Announces the news of the realm in the market square every hour."
+}
+
+def rss_kb(pid: int) -> int:
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1])
+    return 0
+
+async def open_listeners(url: str, count: int, batch: int = 50):
+    listeners = []
+    for start in range(0, count, batch):
+        listeners += await asyncio.gather(*(
+            websockets.connect(url, open_timeout=10, max_queue=None) for _ in range(min(batch, count - start))
+        ))
+    return listeners
+
+async def measure_broadcast(base: str, character_id: str, listeners, rounds: int):
+    """Seconds from sending a broadcast until the last listener received it"""
+    loop = asyncio.get_running_loop()
+    timings = []
+    for i in range(rounds):
+        text = f"Hear ye, hear ye! Announcement {i}"
+        receivers = [asyncio.ensure_future(listener.recv()) for listener in listeners]
+        started = time.perf_counter()
+        response = await loop.run_in_executor(None, lambda: requests.post(
+            f"{base}/api/broadcast/{character_id}", json={"text": text}, timeout=30))
+        frames = await asyncio.wait_for(asyncio.gather(*receivers), timeout=30)
+        timings.append(time.perf_counter() - started)
+        missing = sum(1 for frame in frames if json.loads(frame).get("text") != text)
+        if response.status_code != 200 or missing:
+            raise RuntimeError(f"Broadcast {i} failed: {response.status_code}, {missing} listeners missed it")
+    return timings
+
+async def run(base: str, server_pid: int, character_id: str, connections: int, rounds: int):
+    baseline_kb = rss_kb(server_pid)
+    listeners = await open_listeners(f"ws://127.0.0.1:{base.rsplit(':', 1)[1]}/ws/{character_id}/listener", connections)
+    await asyncio.sleep(1.0)
+    connected_kb = rss_kb(server_pid)
+    stats = requests.get(f"{base}/api/connections/stats", timeout=5).json()
+    try:
+        timings = await measure_broadcast(base, character_id, listeners, rounds)
+    finally:
+        await asyncio.gather(*(listener.close() for listener in listeners), return_exceptions=True)
+    return {
+        "connections": stats["connections"],
+        "rss_before_kb": baseline_kb,
+        "rss_after_kb": connected_kb,
+        "kb_per_connection": (connected_kb - baseline_kb) / max(connections, 1),
+        "broadcast_median_ms": statistics.median(timings) * 1000,
+        "broadcast_max_ms": max(timings) * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-connection memory and broadcast fan-out latency")
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--broadcasts", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8310)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DIALOGUE_PROVIDER="fake", STATE_DB_PATH=os.path.join(tmp, "state.db"),
+                   JOB_DB_PATH=os.path.join(tmp, "jobs.db"))
+        with backend_worker(args.port, env) as server:
+            character_id = requests.post(f"{base}/api/character/create", json=PROFILE, timeout=10).json()["character_id"]
+            print(f"📡 {args.connections} listeners on one character, {args.broadcasts} broadcasts")
+            print("=" * 50)
+            results = asyncio.run(run(base, server.pid, character_id, args.connections, args.broadcasts))
+
+    print(f"🔌 Connections held: {results['connections']}")
+    print(f"💾 Server RSS: {results['rss_before_kb'] / 1024:.1f} MB -> {results['rss_after_kb'] / 1024:.1f} MB "
+          f"({results['kb_per_connection']:.1f} KB per connection)")
+    print(f"📣 Broadcast to all listeners: median {results['broadcast_median_ms']:.1f} ms, "
+          f"max {results['broadcast_max_ms']:.1f} ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for backend modules
+Imports each module in a fresh interpreter without any API keys set, and fails
+if the median cold import exceeds its budget or pulls in a provider SDK
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs 5] [--budget-scale 1.5] [--json results.json]
+    python benchmarks/bench_import_time.py --profile enhanced_dialogue_api
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# Cold import budgets in milliseconds; the app modules are dominated by FastAPI and pydantic
+BUDGETS_MS = {
+    "enhanced_dialogue_api": 1000,
+    "simple_api": 1000,
+    "gemini_api": 1000,
+    "mainapi": 1000,
+    "dialogue_gen": 150,
+}
+# Loaded only when a request actually needs a provider
+HEAVY_MODULES = ["google.generativeai", "grpc", "openai"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def clean_env(tmp: str):
+    # Empty rather than unset, so load_dotenv() cannot fill them in from a local .env
+    env = dict(os.environ, GOOGLE_API_KEY="", OPENAI_API_KEY="")
+    # Keep job and state databases out of the source tree
+    env.update(JOB_DB_PATH=os.path.join(tmp, "jobs.db"), STATE_DB_PATH=os.path.join(tmp, "state.db"),
+               PYTHONDONTWRITEBYTECODE="1")
+    return env
+
+def measure(module: str, runs: int, env):
+    timings = []
+    heavy = set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"}
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(sample["ms"])
+        heavy.update(sample["heavy"])
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "heavy": sorted(heavy)}
+
+def profile(module: str, env, top: int = 15):
+    """Print the slowest imports reported by -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # import time:  self [us] | cumulative | imported package
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    print(f"🔍 Slowest imports under {module} (cumulative ms, self ms):")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold import-time budget for backend modules")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply every budget, e.g. for slow CI")
+    parser.add_argument("--module", action="append", help="Only check these modules (repeatable)")
+    parser.add_argument("--profile", help="Show the slowest imports of one module instead")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = clean_env(tmp)
+        if args.profile:
+            profile(args.profile, env)
+            return 0
+
+        print("⏱️  Cold import times (no API keys set)")
+        print("=" * 50)
+        results = {}
+        failed = False
+        for module in args.module or BUDGETS_MS:
+            budget = BUDGETS_MS.get(module, 1000) * args.budget_scale
+            result = measure(module, args.runs, env)
+            result["budget_ms"] = budget
+            results[module] = result
+            if "error" in result:
+                print(f"❌ {module}: {result['error']}")
+                failed = True
+            elif result["heavy"]:
+                print(f"❌ {module}: imports {', '.join(result['heavy'])} at load time")
+                failed = True
+            elif result["median_ms"] > budget:
+                print(f"❌ {module}: {result['median_ms']:.0f} ms > budget {budget:.0f} ms")
+                failed = True
+            else:
+                print(f"✅ {module}: {result['median_ms']:.0f} ms (min {result['min_ms']:.0f}, budget {budget:.0f})")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Serialization benchmark for NPC Dialogue Generator payloads
+Compares encode/decode cost and payload size of stdlib json, orjson and msgpack
+for typical dialogue responses and conversation histories
+
+Usage:
+    python benchmarks/bench_serialization.py [--number 2000] [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def dialogue_payload():
+    return {
+        "response": "Ah, a traveler! Few dare to walk the Whispering Woods after dusk. "
+                    "The trees remember every footstep, and not all of them kindly.",
+        "character_name": "Elder Rynn",
+        "session_id": "session_1712345678901"
+    }
+
+def history_payload(turns: int):
+    conversation = []
+    for seq in range(1, turns + 1):
+        speaker = "Player" if seq % 2 else "Elder Rynn"
+        conversation.append({
+            "speaker": speaker,
+            "content": "Why do you protect this forest?" if speaker == "Player" else
+                       "Because the forest protected me once, long before your grandfather's grandfather was born.",
+            "timestamp": datetime(2025, 1, 1, 12, 0, seq % 60).isoformat(),
+            "seq": seq
+        })
+    return {"conversation": conversation, "last_seq": turns}
+
+def codecs():
+    available = {"json": (lambda obj: json.dumps(obj).encode(), json.loads)}
+    if orjson is not None:
+        available["orjson"] = (orjson.dumps, orjson.loads)
+    if msgpack is not None:
+        available["msgpack"] = (lambda obj: msgpack.packb(obj, use_bin_type=True),
+                                lambda data: msgpack.unpackb(data, raw=False))
+    return available
+
+def run(number: int):
+    payloads = {
+        "dialogue": dialogue_payload(),
+        "history_10": history_payload(10),
+        "history_100": history_payload(100),
+        "history_1000": history_payload(1000),
+    }
+    results = []
+    for payload_name, payload in payloads.items():
+        # Scale iterations down for big payloads so every case takes similar time
+        iterations = max(10, number // max(1, len(payload.get("conversation", [])) // 10))
+        for codec_name, (encode, decode) in codecs().items():
+            encoded = encode(payload)
+            assert decode(encoded) == payload
+            encode_time = timeit.timeit(lambda: encode(payload), number=iterations) / iterations
+            decode_time = timeit.timeit(lambda: decode(encoded), number=iterations) / iterations
+            results.append({
+                "payload": payload_name,
+                "codec": codec_name,
+                "bytes": len(encoded),
+                "encode_us": round(encode_time * 1e6, 2),
+                "decode_us": round(decode_time * 1e6, 2),
+            })
+    return results
+
+def print_table(results):
+    print(f"{'payload':<14}{'codec':<10}{'bytes':>10}{'encode µs':>12}{'decode µs':>12}{'vs json':>10}")
+    print("-" * 68)
+    baseline = {}
+    for row in results:
+        if row["codec"] == "json":
+            baseline[row["payload"]] = row["encode_us"] + row["decode_us"]
+        total = row["encode_us"] + row["decode_us"]
+        speedup = baseline[row["payload"]] / total if total else 0
+        print(f"{row['payload']:<14}{row['codec']:<10}{row['bytes']:>10}"
+              f"{row['encode_us']:>12.2f}{row['decode_us']:>12.2f}{speedup:>9.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON/orjson/msgpack on dialogue payloads")
+    parser.add_argument("--number", type=int, default=2000, help="Iterations for the smallest payload")
+    parser.add_argument("--json", dest="json_path", help="Also write results to this file")
+    args = parser.parse_args()
+
+    if orjson is None or msgpack is None:
+        print("⚠️  orjson and/or msgpack not installed; only available codecs are measured")
+
+    results = run(args.number)
+    print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
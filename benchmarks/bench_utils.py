@@ -0,0 +1,62 @@
+"""
+Shared helpers for the benchmark scripts
+Sample NPC profiles, latency percentiles, and a local backend worker run
+under lifecycle.py that is polled until ready (through launch_utils) and
+stopped when the benchmark finishes
+"""
+
+import subprocess
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / "backend"
+sys.path.insert(0, str(ROOT_DIR))
+
+from launch_utils import stop_process, wait_until_ready
+
+PROFILES = [
+    {"name": "Elder Rynn", "role": "Forest Guardian", "personality": "Wise, cryptic, protective",
+     "backstory": "He has guarded the Whispering Woods for centuries."},
+    {"name": "Mira", "role": "Blacksmith", "personality": "Gruff, honest, proud",
+     "backstory": "She forged the blades of the old royal guard."},
+    {"name": "Tobble", "role": "Merchant", "personality": "Cheerful, greedy, talkative",
+     "backstory": "He sells curiosities from every corner of the realm."},
+]
+MESSAGES = ["Any news?", "What do you sell?", "Tell me about this place.", "Have you seen anything strange?"]
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    return {f"p{int(q * 100)}_ms": round(percentile(values, q) * 1000, 2) if values else None
+            for q in (0.5, 0.95, 0.99)}
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    """Like launch_utils.wait_until_ready, but a process that never gets ready stops the benchmark"""
+    if not wait_until_ready(url, process, timeout=timeout):
+        raise RuntimeError(f"{url} exited during startup" if process.poll() is not None
+                           else f"{url} did not become ready")
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    stop_process(process, timeout=10)
+
+@contextmanager
+def backend_worker(port: int, env: Dict[str, str]) -> Iterator[subprocess.Popen]:
+    """Run enhanced_dialogue_api on 127.0.0.1:port under lifecycle.py until the block exits"""
+    process = subprocess.Popen(
+        [sys.executable, "lifecycle.py", "enhanced_dialogue_api:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--drain-timeout", "2"],
+        cwd=BACKEND_DIR, env=env
+    )
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/readyz", process)
+        yield process
+    finally:
+        stop(process)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test for the dialogue backend
+Drives character creation, dialogue, branching, translation and WebSocket
+turns against a backend worker running the fake provider (or any --url).
+Two modes:
+- closed loop: --concurrency users, each sending its next request as soon
+  as the previous one finishes
+- open loop: --rate requests per second with Poisson arrivals, sent whether
+  or not earlier ones finished, so queueing in the server shows up as latency
+
+Reports throughput and p50/p95/p99 latency per operation, plus time to first
+chunk (TTFT) for WebSocket turns. --json writes the results for regression
+tracking
+
+Usage:
+    python benchmarks/load_test.py --concurrency 50 --duration 30
+    python benchmarks/load_test.py --rate 200 --duration 30 --fake-latency 0.5 --fake-tps 40 --json load.json
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --mix generate=1,websocket=1
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+from bench_utils import MESSAGES, PROFILES, backend_worker, summarize
+
+DEFAULT_MIX = "generate=5,websocket=3,branching=1,translate=1,create=1"
+
+class Recorder:
+    """Latency, TTFT and errors per operation"""
+
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = {}
+        self.ttft: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def ok(self, operation: str, seconds: float, ttft: Optional[float] = None):
+        self.latency.setdefault(operation, []).append(seconds)
+        if ttft is not None:
+            self.ttft.setdefault(operation, []).append(ttft)
+
+    def error(self, operation: str, kind: str):
+        counts = self.errors.setdefault(operation, {})
+        counts[kind] = counts.get(kind, 0) + 1
+
+    def report(self, elapsed: float) -> Dict:
+        operations = {}
+        for operation in sorted(set(self.latency) | set(self.errors)):
+            latencies = self.latency.get(operation, [])
+            errors = sum(self.errors.get(operation, {}).values())
+            entry = {"requests": len(latencies) + errors, "errors": errors,
+                     "throughput_rps": round(len(latencies) / elapsed, 2), **summarize(latencies)}
+            if operation in self.ttft:
+                entry["ttft"] = summarize(self.ttft[operation])
+            if errors:
+                entry["error_kinds"] = self.errors[operation]
+            operations[operation] = entry
+        everything = [value for values in self.latency.values() for value in values]
+        failed = sum(sum(counts.values()) for counts in self.errors.values())
+        return {"elapsed_s": round(elapsed, 2), "requests": len(everything) + failed, "errors": failed,
+                "throughput_rps": round(len(everything) / elapsed, 2), **summarize(everything),
+                "operations": operations}
+
+class LoadClient:
+    """One operation per call, timed into the recorder"""
+
+    def __init__(self, base: str, character_ids: List[str], recorder: Recorder, timeout: float):
+        self.base = base
+        self.ws_base = "ws" + base[len("http"):]
+        self.character_ids = character_ids
+        self.recorder = recorder
+        self.timeout = timeout
+        self.http = httpx.AsyncClient(base_url=base, timeout=timeout,
+                                      limits=httpx.Limits(max_connections=None, max_keepalive_connections=200))
+        # Open sockets waiting for their next turn; new ones are opened when none is free
+        self.sockets: List = []
+        self.request_ids = itertools.count(1)
+
+    async def close(self):
+        await self.http.aclose()
+        await asyncio.gather(*(socket.close() for socket in self.sockets), return_exceptions=True)
+
+    async def run(self, operation: str):
+        started = time.perf_counter()
+        try:
+            ttft = await getattr(self, f"op_{operation}")()
+        except httpx.HTTPStatusError as e:
+            self.recorder.error(operation, f"http_{e.response.status_code}")
+        except Exception as e:
+            self.recorder.error(operation, type(e).__name__)
+        else:
+            self.recorder.ok(operation, time.perf_counter() - started, ttft)
+
+    async def post(self, path: str, payload: Dict):
+        response = await self.http.post(path, json=payload)
+        response.raise_for_status()
+        return response
+
+    async def op_create(self):
+        await self.post("/api/character/create", random.choice(PROFILES))
+
+    async def op_generate(self):
+        await self.post("/api/dialogue/generate", {"character_id": random.choice(self.character_ids),
+                                                   "session_id": f"load_{random.randrange(1000)}",
+                                                   "message": random.choice(MESSAGES)})
+
+    async def op_branching(self):
+        await self.post("/api/dialogue/branching", {"character_id": random.choice(self.character_ids),
+                                                    "session_id": f"load_{random.randrange(1000)}"})
+
+    async def op_translate(self):
+        await self.post("/api/translate", {"text": random.choice(MESSAGES), "target_language": "spanish"})
+
+    async def op_websocket(self) -> float:
+        """One streamed turn on the multiplexed socket; returns the time to its first chunk"""
+        socket = self.sockets.pop() if self.sockets else await websockets.connect(
+            f"{self.ws_base}/ws", open_timeout=self.timeout, max_queue=None)
+        started = time.perf_counter()
+        request_id = f"r{next(self.request_ids)}"
+        ttft = None
+        try:
+            # A fresh session per turn, so concurrent turns never supersede each other
+            await socket.send(json.dumps({"request_id": request_id, "character_id": random.choice(self.character_ids),
+                                          "session_id": f"ws_{request_id}", "message": random.choice(MESSAGES)}))
+            while True:
+                frame = json.loads(await asyncio.wait_for(socket.recv(), self.timeout))
+                if frame.get("request_id") != request_id:
+                    continue
+                if ttft is None and frame["type"] in ("chunk", "done"):
+                    ttft = time.perf_counter() - started
+                if frame["type"] == "done":
+                    break
+                if frame["type"] in ("error", "cancelled"):
+                    raise RuntimeError(f"ws_{frame['type']}")
+        except BaseException:
+            await socket.close()
+            raise
+        self.sockets.append(socket)
+        return ttft
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if not hasattr(LoadClient, f"op_{name.strip()}"):
+            raise SystemExit(f"Unknown operation '{name}'. Choose from: create, generate, branching, translate, websocket")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+async def closed_loop(client: LoadClient, pick, concurrency: int, duration: float):
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            await client.run(pick())
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+
+async def open_loop(client: LoadClient, pick, rate: float, duration: float, max_inflight: int) -> int:
+    """Send at Poisson arrivals; returns how many arrivals were skipped at max_inflight"""
+    deadline = time.perf_counter() + duration
+    inflight = set()
+    skipped = 0
+    next_at = time.perf_counter()
+    while True:
+        next_at += random.expovariate(rate)
+        if next_at >= deadline:
+            break
+        await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+        if len(inflight) >= max_inflight:
+            skipped += 1
+            continue
+        task = asyncio.ensure_future(client.run(pick()))
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+    if inflight:
+        await asyncio.wait(inflight)
+    return skipped
+
+async def run(args, base: str) -> Dict:
+    recorder = Recorder()
+    async with httpx.AsyncClient(base_url=base, timeout=args.timeout) as setup:
+        character_ids = [(await setup.post("/api/character/create", json=profile)).json()["character_id"]
+                         for profile in PROFILES]
+    client = LoadClient(base, character_ids, recorder, args.timeout)
+    weights = parse_mix(args.mix)
+    operations, shares = list(weights), list(weights.values())
+
+    def pick() -> str:
+        return random.choices(operations, shares)[0]
+
+    started = time.perf_counter()
+    skipped = 0
+    try:
+        if args.rate:
+            skipped = await open_loop(client, pick, args.rate, args.duration, args.max_inflight)
+        else:
+            await closed_loop(client, pick, args.concurrency, args.duration)
+    finally:
+        await client.close()
+    results = recorder.report(time.perf_counter() - started)
+    results["config"] = {"mode": "open" if args.rate else "closed", "rate": args.rate,
+                         "concurrency": None if args.rate else args.concurrency, "duration_s": args.duration,
+                         "mix": weights, "fake_latency_s": args.fake_latency, "fake_tokens_per_second": args.fake_tps,
+                         "url": args.url or "local"}
+    if args.rate:
+        results["skipped_arrivals"] = skipped
+    return results
+
+def print_report(results: Dict):
+    def row(name, entry):
+        ttft = entry.get("ttft")
+        ttft_text = f"  ttft p50 {ttft['p50_ms']} / p99 {ttft['p99_ms']} ms" if ttft else ""
+        print(f"  {name:<10} {entry['requests']:>7} req {entry['errors']:>5} err {entry['throughput_rps']:>8} rps  "
+              f"p50 {entry['p50_ms']} / p95 {entry['p95_ms']} / p99 {entry['p99_ms']} ms{ttft_text}")
+
+    print("=" * 50)
+    for name, entry in results["operations"].items():
+        row(name, entry)
+    row("total", results)
+    if results.get("skipped_arrivals"):
+        print(f"⚠️  {results['skipped_arrivals']} arrivals skipped at --max-inflight")
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test with throughput and latency percentiles")
+    parser.add_argument("--url", help="Target a running backend instead of starting one with the fake provider")
+    parser.add_argument("--concurrency", type=int, default=20, help="Closed-loop users")
+    parser.add_argument("--rate", type=float, help="Open-loop arrivals per second (overrides --concurrency)")
+    parser.add_argument("--max-inflight", type=int, default=2000, help="Open-loop cap on outstanding requests")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--fake-latency", type=float, default=0.2, help="Fake provider seconds to first token")
+    parser.add_argument("--fake-tps", type=float, default=50.0, help="Fake provider tokens per second")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=8320)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    mode = f"open loop at {args.rate}/s" if args.rate else f"closed loop with {args.concurrency} users"
+    print(f"🏋️ Load test: {mode} for {args.duration:.0f}s, mix {args.mix}")
+    if args.url:
+        results = asyncio.run(run(args, args.url.rstrip("/")))
+    else:
+        base = f"http://127.0.0.1:{args.port}"
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DIALOGUE_PROVIDER="fake", FAKE_LATENCY=str(args.fake_latency),
+                       FAKE_TOKENS_PER_SECOND=str(args.fake_tps), STATE_DB_PATH=os.path.join(tmp, "state.db"),
+                       JOB_DB_PATH=os.path.join(tmp, "jobs.db"))
+            with backend_worker(args.port, env):
+                results = asyncio.run(run(args, base))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+    return 1 if results["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
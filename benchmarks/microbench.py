@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the pure-Python hot paths, with regression thresholds
+Times prompt building, branching parsing, the simple backend's canned replies,
+conversation append/read, CharacterProfile validation and history encoding.
+Each run is compared with benchmarks/microbench_baseline.json and fails when
+a case is slower than its baseline by more than its threshold
+
+Baselines are machine specific: after an intended change, or on a new CI
+runner, record a fresh one with --save-baseline
+
+Usage:
+    python benchmarks/microbench.py [--repeat 7] [--threshold 0.25] [--case build_prompt] [--json results.json]
+    python benchmarks/microbench.py --save-baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+BASELINE_PATH = Path(__file__).resolve().parent / "microbench_baseline.json"
+
+# Allowed slowdown over the baseline, as a fraction
+DEFAULT_THRESHOLD = 0.25
+# Sub-microsecond cases jitter more between runs
+THRESHOLDS = {
+    "build_prompt[history=0]": 0.5,
+    "conversation_page[since=900]": 0.5,
+}
+
+PROFILE = {
+    "name": "Elder Rynn",
+    "role": "Forest Guardian",
+    "personality": "Patient, cryptic and fiercely protective of the woods",
+    "backstory": "Has watched over the Whispering Woods for three hundred years",
+    "setting": "fantasy",
+    "speaking_style": "slow, formal and full of old proverbs",
+    "key_traits": "wise, wary of strangers"
+}
+
+BRANCHING_TEXT = (
+    "DIALOGUE: The trees whisper of your coming, traveler. Few find this glade by chance.\n"
+    "OPTION1: Who are you?\n"
+    "OPTION2: I am looking for the old shrine.\n"
+    "OPTION3: I mean no harm to the forest."
+)
+
+def history(turns: int):
+    return [{
+        "speaker": "Player" if seq % 2 else PROFILE["name"],
+        "content": "Why do you protect this forest?" if seq % 2 else
+                   "Because the forest protected me once, long before your grandfather's grandfather was born.",
+        "timestamp": datetime(2025, 1, 1, 12, 0, seq % 60).isoformat(),
+        "seq": seq
+    } for seq in range(1, turns + 1)]
+
+def load_backend(tmp: str):
+    """Import the backend modules without API keys, keeping job and state files out of the tree"""
+    os.environ.update(GOOGLE_API_KEY="", OPENAI_API_KEY="", DIALOGUE_PROVIDER="fake", STATE_BACKEND="memory",
+                      JOB_DB_PATH=os.path.join(tmp, "jobs.db"), STATE_DB_PATH=os.path.join(tmp, "state.db"))
+    sys.path.insert(0, str(BACKEND_DIR))
+    import prompt_builder
+    import serialization
+    import simple_dialogue_api
+    import state_store
+    from enhanced_dialogue_api import parse_branching_response
+    return prompt_builder, serialization, simple_dialogue_api, state_store, parse_branching_response
+
+def build_cases(tmp: str) -> Dict[str, Callable[[], object]]:
+    prompt_builder, serialization, simple_dialogue_api, state_store, parse_branching_response = load_backend(tmp)
+    cases: Dict[str, Callable[[], object]] = {}
+
+    for turns in (0, 5, 50, 500):
+        past = history(turns)
+        cases[f"build_prompt[history={turns}]"] = (
+            lambda past=past: prompt_builder.build_prompt(PROFILE, "What lies beyond the river?", past))
+
+    cases["parse_branching_response"] = lambda: parse_branching_response(BRANCHING_TEXT)
+
+    roles = ["Royal Knight", "Court Wizard", "Travelling Merchant", "Gate Keeper", "Innkeeper"]
+    cases["get_character_type"] = lambda: [simple_dialogue_api.get_character_type(role) for role in roles]
+    character = dict(PROFILE)
+    random.seed(0)
+    cases["generate_response"] = lambda: simple_dialogue_api.generate_response(character, "Hello, can you help me?")
+
+    store = state_store.MemoryStateStore()
+    session_keys = [f"char_1_session_{n}" for n in range(100)]
+    calls = iter(range(sys.maxsize))
+
+    def append_and_read():
+        session_key = session_keys[next(calls) % len(session_keys)]
+        store.append_turns(session_key, [
+            {"speaker": "Player", "content": "What lies beyond the river?", "timestamp": "2025-01-01T12:00:00"},
+            {"speaker": PROFILE["name"], "content": "Only fog, and those who got lost in it.",
+             "timestamp": "2025-01-01T12:00:01"}
+        ])
+        turns = store.recent_turns(session_key, 5)
+        # Keep histories at a realistic length however many iterations run
+        if len(store.conversations[session_key]) >= 200:
+            del store.conversations[session_key]
+        return turns
+    cases["conversation_append_read"] = append_and_read
+
+    long_store = state_store.MemoryStateStore()
+    long_store.append_turns("char_1_long", history(1000))
+    cases["conversation_page[since=900]"] = lambda: long_store.get_conversation("char_1_long", since=900, limit=50)
+
+    raw_profile = dict(PROFILE)
+    cases["character_profile_validate"] = lambda: simple_dialogue_api.CharacterProfile.model_validate(raw_profile)
+
+    for turns in (10, 100, 1000):
+        payload = {"conversation": history(turns), "last_seq": turns}
+        cases[f"encode_history[turns={turns}]"] = lambda payload=payload: serialization.dumps(payload)
+
+    return cases
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """Best time per call in microseconds over `repeat` runs of about 0.2 s each"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+def load_baseline(path: Path) -> Dict:
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for hot helpers with regression thresholds")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--threshold", type=float, help=f"Allowed slowdown for every case (default {DEFAULT_THRESHOLD})")
+    parser.add_argument("--case", action="append", help="Only run cases whose name contains this (repeatable)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Record these results as the new baseline")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = build_cases(tmp)
+        if args.case:
+            cases = {name: func for name, func in cases.items() if any(part in name for part in args.case)}
+
+        baseline = load_baseline(args.baseline)
+        baseline_cases = baseline.get("cases", {})
+        if baseline and baseline.get("python") != platform.python_version():
+            print(f"⚠️  Baseline was recorded on Python {baseline.get('python')}, "
+                  f"this is {platform.python_version()}")
+
+        print("⏱️  Micro-benchmarks (best µs per call)")
+        print("=" * 72)
+        results = {}
+        failed = False
+        for name, func in cases.items():
+            us = measure(func, args.repeat)
+            result = {"us": round(us, 3)}
+            results[name] = result
+            base = baseline_cases.get(name, {}).get("us")
+            if args.save_baseline or base is None:
+                print(f"📏 {name:<36}{us:>12.3f}")
+                continue
+            threshold = args.threshold if args.threshold is not None else THRESHOLDS.get(name, DEFAULT_THRESHOLD)
+            change = us / base - 1
+            if change > threshold:
+                # Re-measure before failing, so one noisy run on a shared machine is not a regression
+                us = min(us, measure(func, args.repeat))
+                result["us"] = round(us, 3)
+                change = us / base - 1
+            result.update(baseline_us=base, change=round(change, 3), threshold=threshold)
+            if change > threshold:
+                print(f"❌ {name:<36}{us:>12.3f}  {change:+7.1%} vs {base:.3f} (limit {threshold:+.0%})")
+                failed = True
+            else:
+                print(f"✅ {name:<36}{us:>12.3f}  {change:+7.1%} vs {base:.3f}")
+
+    if args.save_baseline:
+        # Merge so that saving a subset of cases keeps the others
+        baseline_cases.update({name: {"us": result["us"]} for name, result in results.items()})
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "recorded": datetime.now().isoformat(timespec="seconds"), "cases": baseline_cases},
+                      f, indent=2)
+            f.write("\n")
+        print(f"💾 Baseline written to {args.baseline}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Deterministic replay of captured player traffic
+Reads files written by the backend with CAPTURE_PATH set and re-drives them,
+in capture order, at --speed 1, 10 (or any factor) or max. Each session (and
+each WebSocket) is replayed as one sequential stream, so a conversation's
+turns keep their order while sessions overlap as they did in production. At
+max speed a stream sends its next request as soon as the previous one is
+answered, up to --max-inflight at once
+
+Captured characters are recreated first, one per character token. By default
+the tool starts a worker whose Gemini provider points at a local
+provider_emulator.py, so the real provider code runs without API keys;
+--provider fake uses the in-process fake provider and --url targets a running
+backend. Reports latency percentiles and status mismatches per route, next to
+the latencies recorded at capture time. Compare two versions with --json on
+one run and --compare on the next
+
+Usage:
+    python benchmarks/replay.py capture.jsonl --speed 10
+    python benchmarks/replay.py capture.jsonl --speed max --json new.json --compare old.json
+    python benchmarks/replay.py capture.jsonl --url http://127.0.0.1:8000 --speed 1
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+import requests
+import websockets
+
+from bench_utils import BACKEND_DIR, PROFILES, backend_worker, percentile, stop, summarize, wait_ready
+
+WS_ROUTE = "websocket turn"
+
+def load_capture(paths: List[str]) -> List[Dict]:
+    events = []
+    for path in paths:
+        with open(path) as f:
+            events += [json.loads(line) for line in f if line.strip()]
+    # Stable, so events with the same timestamp keep their file order
+    events.sort(key=lambda event: event["t"])
+    return events
+
+def fields_of(event: Dict) -> Dict:
+    return {**event.get("q", {}), **event.get("b", {}), **event.get("pp", {})}
+
+def group_streams(events: List[Dict]) -> List[List[Dict]]:
+    """One stream per WebSocket and per session; requests without a session run on their own"""
+    streams: Dict[str, List[Dict]] = {}
+    solo = itertools.count()
+    for event in events:
+        if event["k"] != "http":
+            key = f"ws:{event['id']}"
+        else:
+            fields = fields_of(event)
+            key = (f"session:{fields.get('character_id')}:{fields['session_id']}" if fields.get("session_id")
+                   else f"solo:{next(solo)}")
+        streams.setdefault(key, []).append(event)
+    return list(streams.values())
+
+class Replayer:
+    def __init__(self, args, base: str, characters: Dict[str, str], t0: float):
+        self.args = args
+        self.base = base
+        self.ws_base = base.replace("http", "ws", 1)
+        self.characters = characters
+        self.t0 = t0
+        self.speed = None if args.speed == "max" else float(args.speed)
+        self.slots = asyncio.Semaphore(args.max_inflight)
+        self.http = httpx.AsyncClient(base_url=base, timeout=args.timeout,
+                                      limits=httpx.Limits(max_connections=args.max_inflight))
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.captured: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.mismatches: Dict[str, int] = defaultdict(int)
+        # Turns superseded by the session's next message, which a slower backend makes more likely
+        self.cancelled = 0
+        # How late each event started relative to its schedule, so a saturated client shows up
+        self.lag: List[float] = []
+        self.request_ids = itertools.count(1)
+        self.started = 0.0
+
+    def map_fields(self, fields: Dict) -> Dict:
+        mapped = dict(fields)
+        if "character_id" in mapped:
+            mapped["character_id"] = self.characters.get(mapped["character_id"], mapped["character_id"])
+        return mapped
+
+    async def wait_for(self, event: Dict):
+        if self.speed is None:
+            return
+        due = self.started + (event["t"] - self.t0) / self.speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.lag.append(max(-delay, 0))
+
+    async def run_stream(self, stream: List[Dict]):
+        socket = None
+        pending: Dict[str, float] = {}
+        reader = None
+        try:
+            for event in stream:
+                await self.wait_for(event)
+                kind = event["k"]
+                if kind == "http":
+                    async with self.slots:
+                        await self.request(event)
+                elif kind == "ws_open":
+                    path = event["r"].format(**self.map_fields(event.get("pp", {})))
+                    socket = await websockets.connect(f"{self.ws_base}{path}", open_timeout=self.args.timeout,
+                                                      max_queue=None, ping_interval=None)
+                    reader = asyncio.ensure_future(self.read_replies(socket, pending))
+                elif kind == "ws" and socket is not None and "message" in event.get("b", {}):
+                    await self.send_turn(socket, event, pending)
+                elif kind == "ws_close" and socket is not None:
+                    await self.settle(pending)
+                    await socket.close()
+                    socket = None
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+            self.errors[WS_ROUTE] += 1
+        finally:
+            if socket is not None:
+                await self.settle(pending)
+                await socket.close()
+            if reader is not None:
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+
+    async def request(self, event: Dict):
+        route = f"{event['m']} {event['r']}"
+        path = event["r"].format(**self.map_fields(event.get("pp", {})))
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(event["m"], path, params=self.map_fields(event.get("q", {})) or None,
+                                               json=self.map_fields(event["b"]) if "b" in event else None)
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            return
+        self.latencies[route].append(time.perf_counter() - started)
+        self.captured[route].append(event["ms"] / 1000)
+        if response.status_code >= 500:
+            self.errors[route] += 1
+        if response.status_code != event["st"]:
+            self.mismatches[route] += 1
+
+    async def send_turn(self, socket, event: Dict, pending: Dict[str, float]):
+        frame = self.map_fields(event["b"])
+        # Our own ids, so every reply can be matched to the turn that asked for it
+        frame["request_id"] = f"replay-{next(self.request_ids)}"
+        pending[frame["request_id"]] = time.perf_counter()
+        async with self.slots:
+            await socket.send(json.dumps(frame))
+            if self.speed is None:
+                # At max speed a turn holds its slot until answered, like an HTTP request
+                await self.settle(pending)
+
+    async def read_replies(self, socket, pending: Dict[str, float]):
+        async for message in socket:
+            frame = json.loads(message)
+            if frame.get("type") == "ping":
+                await socket.send(json.dumps({"type": "pong"}))
+                continue
+            sent_at = pending.pop(frame.get("request_id"), None) if frame.get("type") in (
+                "done", "error", "cancelled") else None
+            if sent_at is None:
+                continue
+            if frame["type"] == "done":
+                self.latencies[WS_ROUTE].append(time.perf_counter() - sent_at)
+            elif frame["type"] == "error":
+                self.errors[WS_ROUTE] += 1
+            else:
+                self.cancelled += 1
+
+    async def settle(self, pending: Dict[str, float]):
+        """Wait for the socket's outstanding replies, counting those that never come as errors"""
+        deadline = time.perf_counter() + self.args.timeout
+        while pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        self.errors[WS_ROUTE] += len(pending)
+        pending.clear()
+
+    async def run(self, streams: List[List[Dict]]) -> float:
+        self.started = time.perf_counter()
+        try:
+            await asyncio.gather(*(self.run_stream(stream) for stream in streams))
+        finally:
+            await self.http.aclose()
+        return time.perf_counter() - self.started
+
+def create_characters(base: str, events: List[Dict], timeout: float) -> Dict[str, str]:
+    """A fresh character for every captured character token"""
+    tokens = sorted({fields_of(event)["character_id"] for event in events if "character_id" in fields_of(event)})
+    characters = {}
+    for i, token in enumerate(tokens):
+        response = requests.post(f"{base}/api/character/create", json=PROFILES[i % len(PROFILES)], timeout=timeout)
+        response.raise_for_status()
+        characters[token] = response.json()["character_id"]
+    return characters
+
+async def replay(args, base: str, events: List[Dict]) -> Dict:
+    loop = asyncio.get_running_loop()
+    characters = await loop.run_in_executor(None, create_characters, base, events, args.timeout)
+    streams = group_streams(events)
+    replayer = Replayer(args, base, characters, events[0]["t"])
+    elapsed = await replayer.run(streams)
+    routes = {}
+    for route in sorted(set(replayer.latencies) | set(replayer.errors)):
+        latencies = replayer.latencies[route]
+        routes[route] = {
+            "count": len(latencies),
+            "errors": replayer.errors[route],
+            "status_mismatches": replayer.mismatches[route],
+            **summarize(latencies),
+            "captured": summarize(replayer.captured[route]) if replayer.captured[route] else None
+        }
+    completed = sum(len(values) for values in replayer.latencies.values())
+    return {
+        "speed": args.speed,
+        "events": len(events),
+        "streams": len(streams),
+        "characters": len(characters),
+        "captured_seconds": round(events[-1]["t"] - events[0]["t"], 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0,
+        "errors": sum(replayer.errors.values()),
+        "cancelled_turns": replayer.cancelled,
+        "schedule_lag_p99_ms": round(percentile(replayer.lag, 0.99) * 1000, 2) if replayer.lag else None,
+        "routes": routes
+    }
+
+def print_report(results: Dict, previous: Optional[Dict]):
+    print("=" * 96)
+    print(f"{'route':<44}{'count':>7}{'errors':>7}{'status≠':>8}{'p50 ms':>10}{'p99 ms':>10}{'captured p99':>14}")
+    for route, stats in results["routes"].items():
+        captured = (stats["captured"] or {}).get("p99_ms")
+        print(f"{route:<44}{stats['count']:>7}{stats['errors']:>7}{stats['status_mismatches']:>8}"
+              f"{stats['p50_ms'] or 0:>10.1f}{stats['p99_ms'] or 0:>10.1f}"
+              f"{captured if captured is not None else '-':>14}")
+    print(f"🚀 {results['throughput_rps']} requests/s over {results['elapsed_seconds']}s "
+          f"({results['captured_seconds']}s captured, {results['streams']} streams, speed {results['speed']})")
+    if results["cancelled_turns"]:
+        print(f"✂️  {results['cancelled_turns']} WebSocket turns superseded by the next message of their session")
+    if results["schedule_lag_p99_ms"] is not None:
+        print(f"⏳ Schedule lag p99: {results['schedule_lag_p99_ms']} ms")
+    if previous is None:
+        return
+    print("📊 Compared with the previous run:")
+    print(f"   throughput {previous['throughput_rps']} -> {results['throughput_rps']} requests/s")
+    for route, stats in results["routes"].items():
+        before = previous.get("routes", {}).get(route)
+        if not before or not before.get("p99_ms") or not stats["p99_ms"]:
+            continue
+        change = stats["p99_ms"] / before["p99_ms"] - 1
+        print(f"   {route:<44} p99 {before['p99_ms']:.1f} -> {stats['p99_ms']:.1f} ms ({change:+.1%})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured player traffic against a backend")
+    parser.add_argument("capture", nargs="+", help="Capture files (CAPTURE_PATH) from one or more workers")
+    parser.add_argument("--speed", default="1", help="Time compression factor, e.g. 1 or 10, or max")
+    parser.add_argument("--url", help="Target a running backend instead of starting one")
+    parser.add_argument("--provider", choices=["emulator", "fake"], default="emulator",
+                        help="Provider of the started worker")
+    parser.add_argument("--latency", type=float, default=0.2, help="Provider seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Provider token rate")
+    parser.add_argument("--max-inflight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=8340, help="Worker port; the emulator uses the next one")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Results of an earlier run (--json) to compare with")
+    args = parser.parse_args()
+    if args.speed != "max" and float(args.speed) <= 0:
+        raise SystemExit("--speed must be positive or 'max'")
+
+    events = load_capture(args.capture)
+    if not events:
+        raise SystemExit("No events in the capture")
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    print(f"🔁 Replaying {len(events)} events at speed {args.speed}")
+    if args.url:
+        results = asyncio.run(replay(args, args.url.rstrip("/"), events))
+    else:
+        base = f"http://127.0.0.1:{args.port}"
+        emulator_process = None
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, STATE_DB_PATH=os.path.join(tmp, "state.db"), JOB_DB_PATH=os.path.join(tmp, "jobs.db"))
+            # Never capture the replay itself
+            env.pop("CAPTURE_PATH", None)
+            try:
+                if args.provider == "emulator":
+                    emulator = f"http://127.0.0.1:{args.port + 1}"
+                    emulator_process = subprocess.Popen(
+                        [sys.executable, "provider_emulator.py", "--port", str(args.port + 1),
+                         "--latency", str(args.latency), "--tokens-per-second", str(args.tokens_per_second)],
+                        cwd=BACKEND_DIR, env=env)
+                    wait_ready(f"{emulator}/emulator/config", emulator_process)
+                    env.update(DIALOGUE_PROVIDER="gemini", GEMINI_BASE_URL=emulator, GOOGLE_API_KEY="replay")
+                else:
+                    env.update(DIALOGUE_PROVIDER="fake", FAKE_LATENCY=str(args.latency),
+                               FAKE_TOKENS_PER_SECOND=str(args.tokens_per_second))
+                with backend_worker(args.port, env):
+                    results = asyncio.run(replay(args, base, events))
+            finally:
+                if emulator_process is not None:
+                    stop(emulator_process)
+
+    print_report(results, previous)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+    return 1 if results["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+WebSocket soak test for connection scaling
+Starts one backend worker with the fake provider (or targets --url), ramps up
+to --connections sockets on /ws/{character_id}/{session_id} and keeps them
+chatting at an aggregate --rate messages per second for --duration seconds.
+Clients answer server pings and reconnect with jittered backoff when a socket
+closes, like a game client would
+
+Every --sample seconds it prints and records:
+- open sockets and the worker's RSS per socket above its idle baseline
+- worker CPU (local worker only)
+- send-to-reply latency p50/p99 of the turns finished in that window
+- heartbeat misses: expected pings that never arrived, and sockets that have
+  gone two intervals without one (needs server pings)
+- reconnects, and reconnect storms where more than --storm-fraction of the
+  sockets reconnect within one second
+
+Usage:
+    python benchmarks/ws_soak.py --connections 2000 --rate 100 --duration 600
+    python benchmarks/ws_soak.py --url http://127.0.0.1:8000 --heartbeat 0 --json soak.json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+import websockets
+
+from bench_utils import MESSAGES, PROFILES, backend_worker, percentile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+def raise_fd_limit():
+    """Thousands of sockets need more file descriptors than the usual soft limit of 1024"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+
+class WorkerProbe:
+    """RSS and CPU of the backend: from /proc for a local worker, RSS from /metrics otherwise"""
+
+    def __init__(self, base: str, pid: Optional[int]):
+        self.base = base
+        self.pid = pid
+        self._cpu = self._cpu_seconds()
+        self._at = time.monotonic()
+
+    def rss_bytes(self) -> Optional[int]:
+        if self.pid:
+            for line in Path(f"/proc/{self.pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        try:
+            text = requests.get(f"{self.base}/metrics", timeout=5).text
+        except requests.exceptions.RequestException:
+            return None
+        match = re.search(r"^process_resident_memory_bytes (\S+)$", text, re.MULTILINE)
+        return int(float(match.group(1))) if match else None
+
+    def _cpu_seconds(self) -> Optional[float]:
+        if not self.pid:
+            return None
+        # utime and stime are fields 14 and 15; split after the parenthesised command name
+        fields = Path(f"/proc/{self.pid}/stat").read_text().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+    def cpu_percent(self) -> Optional[float]:
+        cpu = self._cpu_seconds()
+        if cpu is None:
+            return None
+        now = time.monotonic()
+        percent = (cpu - self._cpu) / max(now - self._at, 1e-9) * 100
+        self._cpu, self._at = cpu, now
+        return percent
+
+class Soak:
+    def __init__(self, args, base: str, character_ids: List[str]):
+        self.args = args
+        self.ws_base = base.replace("http", "ws", 1)
+        self.character_ids = character_ids
+        self.open = 0
+        self.connect_times: List[float] = []
+        self.latencies: List[float] = []
+        self.window_latencies: List[float] = []
+        self.sent = 0
+        self.skipped = 0
+        self.errors = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.close_codes: Dict[str, int] = collections.Counter()
+        # Reconnects per whole second since the start, for storm detection
+        self.reconnects_by_second: Dict[int, int] = collections.Counter()
+        # Last ping (or connect) time of each open socket
+        self.last_ping: Dict[int, float] = {}
+        self.started = time.monotonic()
+        self.stopping = False
+
+    async def client(self, index: int):
+        """One player: connect, chat at its share of --rate, reconnect when the socket closes"""
+        character_id = self.character_ids[index % len(self.character_ids)]
+        url = f"{self.ws_base}/ws/{character_id}/soak_{index}"
+        rate = self.args.rate / self.args.connections
+        backoff = self.args.backoff
+        first = True
+        while not self.stopping:
+            if not first:
+                self.reconnects += 1
+                self.reconnects_by_second[int(time.monotonic() - self.started)] += 1
+                # Full jitter, so a mass disconnect does not come back as one synchronized wave
+                await asyncio.sleep(random.uniform(0, backoff))
+                backoff = min(backoff * 2, self.args.backoff * 16)
+            first = False
+            opened = time.perf_counter()
+            try:
+                socket = await websockets.connect(url, open_timeout=self.args.timeout, max_queue=None,
+                                                  ping_interval=None)
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                self.close_codes["connect_failed"] += 1
+                continue
+            self.connect_times.append(time.perf_counter() - opened)
+            backoff = self.args.backoff
+            self.open += 1
+            self.last_ping[index] = time.monotonic()
+            try:
+                await self.converse(socket, index, rate)
+            except websockets.ConnectionClosed as e:
+                self.close_codes[str(e.rcvd.code if e.rcvd else "abnormal")] += 1
+            except OSError:
+                self.close_codes["abnormal"] += 1
+            finally:
+                self.open -= 1
+                self.last_ping.pop(index, None)
+                await socket.close()
+
+    async def converse(self, socket, index: int, rate: float):
+        pending: Dict[str, float] = {}
+        heartbeat = self.args.heartbeat
+        request_ids = iter(range(sys.maxsize))
+
+        async def read():
+            while True:
+                frame = json.loads(await socket.recv())
+                now = time.monotonic()
+                kind = frame.get("type")
+                if kind == "ping":
+                    # Pings due in the gap since the last one, beyond one interval of slack
+                    if heartbeat:
+                        self.misses += max(int((now - self.last_ping[index]) / heartbeat) - 1, 0)
+                    self.last_ping[index] = now
+                    await socket.send(json.dumps({"type": "pong"}))
+                elif kind in ("done", "error", "cancelled"):
+                    sent_at = pending.pop(frame.get("request_id"), None)
+                    if sent_at is None:
+                        continue
+                    if kind == "done":
+                        self.window_latencies.append(now - sent_at)
+                    else:
+                        self.errors += 1
+
+        async def write():
+            while not self.stopping:
+                await asyncio.sleep(random.expovariate(rate) if rate > 0 else 3600)
+                if pending:
+                    # Players wait for the NPC's answer before talking again
+                    self.skipped += 1
+                    continue
+                request_id = f"m{next(request_ids)}"
+                pending[request_id] = time.monotonic()
+                self.sent += 1
+                await socket.send(json.dumps({"request_id": request_id, "message": random.choice(MESSAGES)}))
+
+        reader = asyncio.ensure_future(read())
+        writer = asyncio.ensure_future(write())
+        try:
+            done, _ = await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            reader.cancel()
+            writer.cancel()
+            await asyncio.gather(reader, writer, return_exceptions=True)
+
+    def silent(self) -> int:
+        """Open sockets that have not seen a ping for two intervals, such as a stalled sender"""
+        if not self.args.heartbeat:
+            return 0
+        cutoff = time.monotonic() - 2 * self.args.heartbeat
+        return sum(1 for last in self.last_ping.values() if last < cutoff)
+
+    def take_window(self) -> List[float]:
+        window, self.window_latencies = self.window_latencies, []
+        self.latencies.extend(window)
+        return window
+
+    def storms(self) -> List[Dict]:
+        limit = max(self.args.storm_fraction * self.args.connections, 1)
+        return [{"second": second, "reconnects": count}
+                for second, count in sorted(self.reconnects_by_second.items()) if count >= limit]
+
+async def run(args, base: str, pid: Optional[int]) -> Dict:
+    loop = asyncio.get_running_loop()
+    character_ids = []
+    for profile in PROFILES:
+        response = await loop.run_in_executor(None, lambda: requests.post(
+            f"{base}/api/character/create", json=profile, timeout=args.timeout))
+        character_ids.append(response.json()["character_id"])
+
+    probe = WorkerProbe(base, pid)
+    rss_idle = probe.rss_bytes()
+    soak = Soak(args, base, character_ids)
+    samples = []
+
+    def sample(phase: str):
+        window = soak.take_window()
+        rss = probe.rss_bytes()
+        row = {
+            "t": round(time.monotonic() - soak.started, 1),
+            "phase": phase,
+            "open": soak.open,
+            "rss_mb": round(rss / 2**20, 1) if rss else None,
+            "kb_per_socket": round((rss - rss_idle) / 1024 / soak.open, 1) if rss and rss_idle and soak.open else None,
+            "cpu_percent": (lambda cpu: round(cpu, 1) if cpu is not None else None)(probe.cpu_percent()),
+            "replies": len(window),
+            "p50_ms": round(percentile(window, 0.5) * 1000, 1) if window else None,
+            "p99_ms": round(percentile(window, 0.99) * 1000, 1) if window else None,
+            "heartbeat_misses": soak.misses,
+            "silent": soak.silent(),
+            "reconnects": soak.reconnects,
+            "errors": soak.errors
+        }
+        samples.append(row)
+        print(f"{row['t']:>7.0f}s {phase:<6}{row['open']:>7}{row['rss_mb'] or 0:>9.1f}{row['kb_per_socket'] or 0:>9.1f}"
+              f"{row['cpu_percent'] or 0:>7.1f}{row['replies']:>8}{row['p50_ms'] or 0:>9.1f}{row['p99_ms'] or 0:>9.1f}"
+              f"{row['heartbeat_misses']:>8}{row['silent']:>8}{row['reconnects']:>8}")
+
+    print(f"{'time':>8} {'phase':<6}{'open':>7}{'rss MB':>9}{'KB/sock':>9}{'cpu %':>7}{'replies':>8}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'misses':>8}{'silent':>8}{'reconn':>8}")
+    clients = []
+    # Ramp up at --ramp sockets per second, sampling as we go
+    next_sample = time.monotonic() + args.sample
+    for index in range(args.connections):
+        clients.append(asyncio.ensure_future(soak.client(index)))
+        await asyncio.sleep(1 / args.ramp)
+        if time.monotonic() >= next_sample:
+            sample("ramp")
+            next_sample += args.sample
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        await asyncio.sleep(max(min(next_sample, deadline) - time.monotonic(), 0))
+        sample("soak")
+        next_sample += args.sample
+
+    soak.stopping = True
+    for task in clients:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+
+    latencies = soak.latencies
+    return {
+        "connections": args.connections,
+        "rate": args.rate,
+        "duration": args.duration,
+        "rss_idle_mb": round(rss_idle / 2**20, 1) if rss_idle else None,
+        "connect_p99_ms": round(percentile(soak.connect_times, 0.99) * 1000, 1) if soak.connect_times else None,
+        "messages_sent": soak.sent,
+        "messages_skipped": soak.skipped,
+        "replies": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        "errors": soak.errors,
+        "heartbeat_misses": soak.misses,
+        "reconnects": soak.reconnects,
+        "close_codes": dict(soak.close_codes),
+        "max_reconnects_per_second": max(soak.reconnects_by_second.values(), default=0),
+        "storms": soak.storms(),
+        "samples": samples
+    }
+
+def print_report(results: Dict):
+    print("=" * 84)
+    last = next((row for row in reversed(results["samples"]) if row["kb_per_socket"]), None)
+    if last:
+        print(f"💾 {last['open']} sockets held, {last['kb_per_socket']:.1f} KB of worker RSS per socket "
+              f"(idle {results['rss_idle_mb']} MB)")
+    print(f"⏱️  {results['replies']} replies: p50 {results['p50_ms']} ms, p99 {results['p99_ms']} ms "
+          f"(connect p99 {results['connect_p99_ms']} ms)")
+    print(f"💬 {results['messages_sent']} sent, {results['messages_skipped']} skipped while awaiting a reply, "
+          f"{results['errors']} errors")
+    print(f"💓 Heartbeat misses: {results['heartbeat_misses']}")
+    print(f"🔁 Reconnects: {results['reconnects']} (max {results['max_reconnects_per_second']}/s, "
+          f"close codes {results['close_codes'] or '-'})")
+    if results["storms"]:
+        print(f"🌪️  Reconnect storms at {', '.join(str(storm['second']) + 's' for storm in results['storms'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Hold thousands of chatting WebSockets and track their cost")
+    parser.add_argument("--url", help="Target a running backend instead of starting one with the fake provider")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=50.0, help="Messages per second across all sockets")
+    parser.add_argument("--ramp", type=float, default=200.0, help="New sockets per second while ramping up")
+    parser.add_argument("--duration", type=float, default=300.0, help="Seconds to soak after the ramp")
+    parser.add_argument("--sample", type=float, default=10.0, help="Seconds between samples")
+    parser.add_argument("--heartbeat", type=float, default=10.0,
+                        help="Server ping interval (WS_HEARTBEAT_INTERVAL); 0 stops counting misses")
+    parser.add_argument("--idle-timeout", type=float, default=30.0, help="WS_IDLE_TIMEOUT of the local worker")
+    parser.add_argument("--backoff", type=float, default=1.0, help="Base reconnect backoff in seconds")
+    parser.add_argument("--storm-fraction", type=float, default=0.05,
+                        help="Share of sockets reconnecting within a second that counts as a storm")
+    parser.add_argument("--fake-latency", type=float, default=0.2, help="Fake provider seconds to first token")
+    parser.add_argument("--fake-tps", type=float, default=50.0, help="Fake provider tokens per second")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=8330)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    print(f"🧪 WebSocket soak: {args.connections} sockets, {args.rate}/s messages, {args.duration:.0f}s")
+    if args.url:
+        results = asyncio.run(run(args, args.url.rstrip("/"), None))
+    else:
+        base = f"http://127.0.0.1:{args.port}"
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DIALOGUE_PROVIDER="fake", FAKE_LATENCY=str(args.fake_latency),
+                       FAKE_TOKENS_PER_SECOND=str(args.fake_tps), WS_HEARTBEAT_INTERVAL=str(args.heartbeat),
+                       WS_IDLE_TIMEOUT=str(args.idle_timeout), STATE_DB_PATH=os.path.join(tmp, "state.db"),
+                       JOB_DB_PATH=os.path.join(tmp, "jobs.db"))
+            with backend_worker(args.port, env) as server:
+                results = asyncio.run(run(args, base, server.pid))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+    return 1 if results["errors"] or results["storms"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""
+The root test_*.py files are standalone scripts that start their own servers;
+run them with python, e.g. python test_gateway.py, not through pytest
+"""
+
+collect_ignore_glob = ["test_*.py"]
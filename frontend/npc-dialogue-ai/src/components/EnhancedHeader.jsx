@@ -15,7 +15,7 @@ const EnhancedHeader = ({ character, onBack, onSettings }) => {
 
   useEffect(() => {
     const checkConnection = () => {
-      fetch('http://localhost:8000/api/characters')
+      fetch('http://localhost:8000/api/characters?limit=1')
         .then(() => setIsOnline(true))
         .catch(() => setIsOnline(false));
     };
@@ -0,0 +1,118 @@
+// Dialogue WebSocket that reconnects on drop and resumes replies in progress.
+// Each message gets a request id; the server numbers the frames of its reply
+// (seq), so after a reconnect we ask for the frames after the last one we saw
+// instead of sending the message again.
+
+const MAX_RECONNECT_DELAY = 5000;
+
+export function openDialogueSocket(url, { onChunk, onReply, onCancel, onError, onBroadcast, onStatus } = {}) {
+  const pending = new Map(); // request id -> last seq received
+  let socket = null;
+  let closed = false;
+  let retryDelay = 250;
+  let retryTimer = null;
+  let nextId = 1;
+
+  const finish = (requestId) => pending.delete(requestId);
+
+  const handleFrame = (data) => {
+    if (data.seq !== undefined && pending.has(data.request_id)) {
+      pending.set(data.request_id, data.seq);
+    }
+    switch (data.type) {
+      case "chunk":
+        onChunk?.(data.request_id, data.text);
+        break;
+      case "done":
+        finish(data.request_id);
+        onReply?.(data.request_id, data);
+        break;
+      case "cancelled":
+        // Superseded or merged into a newer message
+        finish(data.request_id);
+        onCancel?.(data.request_id, data);
+        break;
+      case "error":
+        finish(data.request_id);
+        onError?.(data.request_id, data);
+        break;
+      case "broadcast":
+        onBroadcast?.(data);
+        break;
+      case "ping":
+        socket.send(JSON.stringify({ type: "pong" }));
+        break;
+      case "reconnect":
+        // The server is restarting; onclose reconnects us
+        break;
+      default:
+        // Servers without request ids reply with a bare {response}
+        if (data.response !== undefined) {
+          onReply?.(data.request_id ?? Date.now(), data);
+        }
+    }
+  };
+
+  const connect = () => {
+    socket = new WebSocket(url);
+
+    socket.onopen = () => {
+      retryDelay = 250;
+      onStatus?.(true);
+      pending.forEach((lastSeq, requestId) => {
+        socket.send(JSON.stringify({ type: "resume", request_id: requestId, last_seq: lastSeq, stream: true }));
+      });
+    };
+
+    socket.onmessage = (event) => handleFrame(JSON.parse(event.data));
+
+    socket.onclose = () => {
+      onStatus?.(false);
+      if (!closed) {
+        retryTimer = setTimeout(connect, retryDelay);
+        retryDelay = Math.min(retryDelay * 2, MAX_RECONNECT_DELAY);
+      }
+    };
+  };
+
+  connect();
+
+  return {
+    // Returns the request id, or null if the socket is not open (callers fall back to HTTP)
+    send(message) {
+      if (!socket || socket.readyState !== WebSocket.OPEN) return null;
+      const requestId = `${Date.now()}-${nextId++}`;
+      pending.set(requestId, 0);
+      socket.send(JSON.stringify({ request_id: requestId, message, stream: true }));
+      return requestId;
+    },
+    close() {
+      closed = true;
+      clearTimeout(retryTimer);
+      socket?.close();
+    }
+  };
+}
+
+// Message list helpers: a streamed reply is one NPC message keyed by its request id
+const replyId = (requestId) => `npc-${requestId}`;
+
+export function appendChunk(messages, requestId, text) {
+  const id = replyId(requestId);
+  if (!messages.some(m => m.id === id)) {
+    return [...messages, { id, type: "npc", content: text, timestamp: new Date().toISOString() }];
+  }
+  return messages.map(m => (m.id === id ? { ...m, content: m.content + text } : m));
+}
+
+export function completeReply(messages, requestId, content) {
+  const id = replyId(requestId);
+  if (!messages.some(m => m.id === id)) {
+    return [...messages, { id, type: "npc", content, timestamp: new Date().toISOString() }];
+  }
+  return messages.map(m => (m.id === id ? { ...m, content } : m));
+}
+
+export function dropReply(messages, requestId) {
+  return messages.filter(m => m.id !== replyId(requestId));
+}
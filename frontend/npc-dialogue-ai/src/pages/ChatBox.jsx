@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useRef, useCallback } from "react";
 import './ChatBox.css';
+import { appendChunk, completeReply, dropReply, openDialogueSocket } from '../dialogueSocket';
 
 const ChatBox = ({ character, personality }) => {
   const [messages, setMessages] = useState([]);
@@ -9,7 +10,7 @@ const ChatBox = ({ character, personality }) => {
   const [branchingOptions, setBranchingOptions] = useState([]);
   const [sessionId] = useState(() => Date.now().toString());
   const [characterId, setCharacterId] = useState(null);
-  const [ws, setWs] = useState(null);
+  const socketRef = useRef(null);
   const messagesEndRef = useRef(null);
 
   const scrollToBottom = () => {
@@ -59,39 +60,34 @@ const ChatBox = ({ character, personality }) => {
     }
   }, [character, personality]);
 
-  const connectWebSocket = useCallback(() => {
-    if (characterId && sessionId) {
-      const websocket = new WebSocket(`ws://localhost:8000/ws/${characterId}/${sessionId}`);
-      
-      websocket.onopen = () => {
-        console.log("WebSocket connected");
-        setWs(websocket);
-      };
-      
-      websocket.onmessage = (event) => {
-        const data = JSON.parse(event.data);
-        const npcMessage = {
-          id: Date.now(),
-          type: "npc",
-          content: data.response,
-          timestamp: new Date().toISOString()
-        };
-        setMessages(prev => [...prev, npcMessage]);
-        setIsLoading(false);
-      };
-      
-      websocket.onclose = () => {
-        console.log("WebSocket disconnected");
-        setWs(null);
-      };
-    }
-  }, [characterId, sessionId]);
-
   useEffect(() => {
-    if (characterId) {
-      connectWebSocket();
-    }
-  }, [characterId, connectWebSocket]);
+    if (!characterId) return;
+    const finishLoading = () => {
+      setIsLoading(false);
+    };
+    const socket = openDialogueSocket(`ws://localhost:8000/ws/${characterId}/${sessionId}`, {
+      onChunk: (requestId, text) => setMessages(prev => appendChunk(prev, requestId, text)),
+      onReply: (requestId, data) => {
+        setMessages(prev => completeReply(prev, requestId, data.response));
+        finishLoading();
+      },
+      onCancel: (requestId) => setMessages(prev => dropReply(prev, requestId)),
+      onError: (requestId, data) => {
+        console.error("Dialogue error:", data.detail);
+        setMessages(prev => dropReply(prev, requestId));
+        finishLoading();
+      },
+      onBroadcast: (data) => setMessages(prev => [...prev, {
+        id: Date.now(),
+        type: "npc",
+        content: data.text,
+        timestamp: data.timestamp
+      }]),
+      onStatus: (connected) => console.log(connected ? "WebSocket connected" : "WebSocket disconnected")
+    });
+    socketRef.current = socket;
+    return () => socket.close();
+  }, [characterId, sessionId]);
 
   const handleSendMessage = async () => {
     if (!inputMessage.trim() || !characterId) return;
@@ -107,10 +103,8 @@ const ChatBox = ({ character, personality }) => {
     setIsLoading(true);
 
     if (dialogueMode === "freeform") {
-      // Use WebSocket for real-time communication
-      if (ws) {
-        ws.send(JSON.stringify({ message: inputMessage }));
-      } else {
+      // Use WebSocket for real-time communication; the reply streams in and survives reconnects
+      if (!socketRef.current?.send(inputMessage)) {
         // Fallback to HTTP
         try {
           const response = await fetch("http://localhost:8000/api/dialogue/generate", {
@@ -3,6 +3,7 @@ import EnhancedHeader from '../components/EnhancedHeader';
 import MessageBubble from '../components/MessageBubble';
 import EnhancedChatInput from '../components/EnhancedChatInput';
 import './EnhancedChatBox.css';
+import { appendChunk, completeReply, dropReply, openDialogueSocket } from '../dialogueSocket';
 
 const EnhancedChatBox = ({ character, personality, onBack }) => {
   const [messages, setMessages] = useState([]);
@@ -11,7 +12,7 @@ const EnhancedChatBox = ({ character, personality, onBack }) => {
   const [branchingOptions, setBranchingOptions] = useState([]);
   const [sessionId] = useState(() => Date.now().toString());
   const [characterId, setCharacterId] = useState(null);
-  const [ws, setWs] = useState(null);
+  const socketRef = useRef(null);
   const [showSettings, setShowSettings] = useState(false);
   const [typingIndicator, setTypingIndicator] = useState(false);
   const messagesEndRef = useRef(null);
@@ -63,40 +64,35 @@ const EnhancedChatBox = ({ character, personality, onBack }) => {
     }
   }, [character, personality]);
 
-  const connectWebSocket = useCallback(() => {
-    if (characterId && sessionId) {
-      const websocket = new WebSocket(`ws://localhost:8000/ws/${characterId}/${sessionId}`);
-      
-      websocket.onopen = () => {
-        console.log("WebSocket connected");
-        setWs(websocket);
-      };
-      
-      websocket.onmessage = (event) => {
-        const data = JSON.parse(event.data);
-        const npcMessage = {
-          id: Date.now(),
-          type: "npc",
-          content: data.response,
-          timestamp: new Date().toISOString()
-        };
-        setMessages(prev => [...prev, npcMessage]);
-        setIsLoading(false);
-        setTypingIndicator(false);
-      };
-      
-      websocket.onclose = () => {
-        console.log("WebSocket disconnected");
-        setWs(null);
-      };
-    }
-  }, [characterId, sessionId]);
-
   useEffect(() => {
-    if (characterId) {
-      connectWebSocket();
-    }
-  }, [characterId, connectWebSocket]);
+    if (!characterId) return;
+    const finishLoading = () => {
+      setIsLoading(false);
+      setTypingIndicator(false);
+    };
+    const socket = openDialogueSocket(`ws://localhost:8000/ws/${characterId}/${sessionId}`, {
+      onChunk: (requestId, text) => setMessages(prev => appendChunk(prev, requestId, text)),
+      onReply: (requestId, data) => {
+        setMessages(prev => completeReply(prev, requestId, data.response));
+        finishLoading();
+      },
+      onCancel: (requestId) => setMessages(prev => dropReply(prev, requestId)),
+      onError: (requestId, data) => {
+        console.error("Dialogue error:", data.detail);
+        setMessages(prev => dropReply(prev, requestId));
+        finishLoading();
+      },
+      onBroadcast: (data) => setMessages(prev => [...prev, {
+        id: Date.now(),
+        type: "npc",
+        content: data.text,
+        timestamp: data.timestamp
+      }]),
+      onStatus: (connected) => console.log(connected ? "WebSocket connected" : "WebSocket disconnected")
+    });
+    socketRef.current = socket;
+    return () => socket.close();
+  }, [characterId, sessionId]);
 
   const handleSendMessage = async (messageText) => {
     if (!messageText.trim() || !characterId) return;
@@ -121,9 +117,7 @@ const EnhancedChatBox = ({ character, personality, onBack }) => {
     }, 3000);
 
     if (dialogueMode === "freeform") {
-      if (ws) {
-        ws.send(JSON.stringify({ message: messageText }));
-      } else {
+      if (!socketRef.current?.send(messageText)) {
         try {
           const response = await fetch("http://localhost:8000/api/dialogue/generate", {
             method: "POST",
@@ -0,0 +1,78 @@
+"""
+Shared helpers for the launcher scripts
+Readiness polling with backoff instead of fixed sleeps, and child processes
+whose output is drained into rotating log files instead of an unread pipe
+"""
+
+import logging
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+LOG_DIR = Path(__file__).parent / "logs"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+
+def wait_until_ready(url, process=None, timeout=60.0, initial_delay=0.05, max_delay=1.0):
+    """Poll url until it answers 2xx; gives up early if process exits"""
+    deadline = time.time() + timeout
+    delay = initial_delay
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(url, timeout=max(delay, 0.5)) as response:
+                if 200 <= response.status < 300:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+    return False
+
+def get_log_path(name):
+    LOG_DIR.mkdir(exist_ok=True)
+    return LOG_DIR / f"{name}.log"
+
+def _drain(stream, logger, echo):
+    for raw in iter(stream.readline, b""):
+        line = raw.decode(errors="replace").rstrip()
+        logger.info(line)
+        if echo:
+            print(f"[{logger.name}] {line}")
+    stream.close()
+
+def start_logged_process(name, command, echo=False, **popen_kwargs):
+    """Start a process whose stdout and stderr go to logs/<name>.log (rotated)"""
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = RotatingFileHandler(get_log_path(name), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **popen_kwargs)
+    # Draining on a thread keeps a chatty server from blocking on a full pipe
+    threading.Thread(target=_drain, args=(process.stdout, logger, echo), daemon=True).start()
+    return process
+
+def stop_process(process, timeout=35.0):
+    """Wait for a process that was asked to stop, killing it only after the timeout"""
+    try:
+        return process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"⚠️  Process {process.pid} did not stop within {timeout:.0f}s, killing it")
+        process.kill()
+        return process.wait()
+
+def tail_log(name, lines=20):
+    """Last lines of a process log, for failure messages"""
+    path = get_log_path(name)
+    if not path.exists():
+        return ""
+    return "\n".join(path.read_text(errors="replace").splitlines()[-lines:])
@@ -4,6 +4,10 @@ Simple system runner for NPC Dialogue Generator
 Starts both backend and frontend with proper error handling
 """
 
+import argparse
+import gc
+import select
+import socket
 import subprocess
 import sys
 import os
@@ -12,8 +16,20 @@ import signal
 import threading
 from pathlib import Path
 
+from launch_utils import get_log_path, start_logged_process, stop_process, tail_log, wait_until_ready
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+BACKEND_URL = "http://localhost:8000"
+FRONTEND_URL = "http://localhost:3000"
+BACKEND_READY_TIMEOUT = 60
+FRONTEND_READY_TIMEOUT = 180
+# Workers get this long to finish in-flight generations before they are killed
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+STOP_TIMEOUT = DRAIN_TIMEOUT + 5
+
 class SystemRunner:
-    def __init__(self):
+    def __init__(self, workers=1):
+        self.workers = workers
         self.backend_process = None
         self.frontend_process = None
         self.running = True
@@ -21,34 +37,39 @@ class SystemRunner:
     def start_backend(self):
         """Start the FastAPI backend"""
         print("🚀 Starting Backend API...")
-        backend_path = Path(__file__).parent / "backend"
-        os.chdir(backend_path)
+        
+        env = dict(os.environ)
+        if self.workers > 1:
+            # Workers are separate processes, so they must share state through SQLite
+            env.setdefault("STATE_BACKEND", "sqlite")
+            print(f"👥 Running {self.workers} workers with {env['STATE_BACKEND']} shared state")
+        
+        if self.workers == 1:
+            # Drains in-flight generations and WebSockets on shutdown
+            command = [sys.executable, "lifecycle.py", "enhanced_dialogue_api:app",
+                       "--host", "0.0.0.0", "--port", "8000", "--drain-timeout", str(DRAIN_TIMEOUT)]
+        else:
+            # uvicorn's own supervisor only waits for open HTTP requests; use --prefork for full drain
+            command = [sys.executable, "-m", "uvicorn", "enhanced_dialogue_api:app",
+                       "--host", "0.0.0.0", "--port", "8000", "--workers", str(self.workers),
+                       "--timeout-graceful-shutdown", str(int(DRAIN_TIMEOUT))]
         
         try:
-            self.backend_process = subprocess.Popen([
-                sys.executable, "-m", "uvicorn", 
-                "enhanced_dialogue_api:app", 
-                "--host", "0.0.0.0", 
-                "--port", "8000"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            # Wait a moment for startup
-            time.sleep(3)
-            
-            if self.backend_process.poll() is None:
-                print("✅ Backend started on http://localhost:8000")
-                return True
-            else:
-                stdout, stderr = self.backend_process.communicate()
-                print(f"❌ Backend failed to start:")
-                print(f"STDOUT: {stdout.decode()}")
-                print(f"STDERR: {stderr.decode()}")
-                return False
-                
+            self.backend_process = start_logged_process("backend", command, cwd=BACKEND_DIR, env=env)
+            return True
         except Exception as e:
             print(f"❌ Error starting backend: {e}")
             return False
     
+    def wait_for_backend(self):
+        """Poll /readyz until the backend can take traffic"""
+        if wait_until_ready(f"{BACKEND_URL}/readyz", self.backend_process, timeout=BACKEND_READY_TIMEOUT):
+            print(f"✅ Backend ready on {BACKEND_URL} (logs: {get_log_path('backend')})")
+            return True
+        print("❌ Backend failed to become ready. Last log lines:")
+        print(tail_log("backend"))
+        return False
+    
     def start_frontend(self):
         """Start the React frontend"""
         print("🎨 Starting Frontend...")
@@ -59,26 +80,25 @@ class SystemRunner:
             return False
         
         try:
-            os.chdir(frontend_path)
-            
             # Check if node_modules exists
             if not (frontend_path / "node_modules").exists():
                 print("📦 Installing frontend dependencies...")
-                install_result = subprocess.run(["npm", "install"], 
+                install_result = subprocess.run(["npm", "install"], cwd=frontend_path,
                                               capture_output=True, text=True)
                 if install_result.returncode != 0:
                     print(f"❌ Failed to install dependencies: {install_result.stderr}")
                     return False
             
             # Start the React development server
-            self.frontend_process = subprocess.Popen(
-                ["npm", "start"], 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE
+            self.frontend_process = start_logged_process(
+                "frontend", ["npm", "start"], cwd=frontend_path, env=dict(os.environ, BROWSER="none")
             )
-            
-            print("✅ Frontend starting on http://localhost:3000")
-            return True
+            if wait_until_ready(FRONTEND_URL, self.frontend_process, timeout=FRONTEND_READY_TIMEOUT):
+                print(f"✅ Frontend ready on {FRONTEND_URL} (logs: {get_log_path('frontend')})")
+                return True
+            print("❌ Frontend failed to become ready. Last log lines:")
+            print(tail_log("frontend"))
+            return False
             
         except Exception as e:
             print(f"❌ Error starting frontend: {e}")
@@ -89,13 +109,19 @@ class SystemRunner:
         print("\n🛑 Shutting down system...")
         self.running = False
         
-        if self.backend_process:
-            self.backend_process.terminate()
-        if self.frontend_process:
-            self.frontend_process.terminate()
+        # Both get SIGTERM at once; the backend drains before it exits
+        processes = [p for p in (self.backend_process, self.frontend_process) if p]
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            stop_process(process, STOP_TIMEOUT)
         
         sys.exit(0)
     
+    def supervise(self):
+        """Called once a second while running; subclasses restart their workers here"""
+        pass
+    
     def run(self):
         """Main run function"""
         print("🎮 NPC Dialogue Generator - System Startup")
@@ -105,16 +131,24 @@ class SystemRunner:
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
         
-        # Start backend
+        # Start backend, then bring the frontend up while the backend finishes starting
         if not self.start_backend():
             print("❌ Failed to start backend. Exiting.")
             return
         
-        # Wait a bit for backend to fully start
-        time.sleep(2)
+        frontend_result = {}
+        frontend_thread = threading.Thread(
+            target=lambda: frontend_result.update(ok=self.start_frontend()), daemon=True
+        )
+        frontend_thread.start()
         
-        # Start frontend
-        if not self.start_frontend():
+        if not self.wait_for_backend():
+            print("❌ Failed to start backend. Exiting.")
+            self.signal_handler(signal.SIGTERM, None)
+            return
+        
+        frontend_thread.join()
+        if not frontend_result.get("ok"):
             print("❌ Failed to start frontend. Backend is still running.")
             print("💡 You can access the API at http://localhost:8000")
             print("📚 API docs at http://localhost:8000/docs")
@@ -134,10 +168,304 @@ class SystemRunner:
         try:
             # Keep running until interrupted
             while self.running:
+                self.supervise()
                 time.sleep(1)
         except KeyboardInterrupt:
             self.signal_handler(signal.SIGINT, None)
 
+def read_memory(pid):
+    """Resident memory of a process in kB: rss, pss, shared and private"""
+    memory = {}
+    try:
+        # smaps_rollup splits resident pages into shared and private, which is what copy-on-write saves
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    memory[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return {}
+    return {
+        "rss": memory.get("Rss", 0),
+        "pss": memory.get("Pss", 0),
+        "shared": memory.get("Shared_Clean", 0) + memory.get("Shared_Dirty", 0),
+        "private": memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0)
+    }
+
+def format_memory(memory):
+    if not memory:
+        return "memory unavailable"
+    return (f"RSS {memory['rss'] / 1024:.1f} MB, PSS {memory['pss'] / 1024:.1f} MB, "
+            f"shared {memory['shared'] / 1024:.1f} MB, private {memory['private'] / 1024:.1f} MB")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def measure_standard_launch(timeout=60):
+    """Start one worker the way SystemRunner does and time it until it accepts connections"""
+    port = free_port()
+    started = time.time()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "enhanced_dialogue_api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            if process.poll() is not None:
+                return None
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                break
+            except OSError:
+                if time.time() - started > timeout:
+                    return None
+                time.sleep(0.05)
+        return {"pid": process.pid, "ready": time.time() - started, "memory": read_memory(process.pid)}
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+def serve_worker(config, sock, ready_fd):
+    """Body of a forked worker: serve the inherited socket and report readiness"""
+    from lifecycle import DrainingServer
+
+    DrainingServer(config, drain_timeout=DRAIN_TIMEOUT, ready_fd=ready_fd).run(sockets=[sock])
+
+class PreforkRunner(SystemRunner):
+    """Imports and warms the app once, then forks workers that share its pages copy-on-write"""
+
+    def __init__(self, workers=1, host="0.0.0.0", port=8000, compare_launch=False):
+        super().__init__(workers=workers)
+        self.host = host
+        self.port = port
+        self.compare_launch = compare_launch
+        self.config = None
+        self.sock = None
+        self.worker_pids = set()
+        self.ready_fds = {}
+        self.spawn_times = {}
+        self.preload_time = 0.0
+        # After a reload, workers are started fresh so they pick up new code
+        self.fresh_workers = False
+        self.fresh_processes = {}
+        self.reload_requested = False
+
+    def preload(self):
+        """Import the app and everything a worker would load on its first request"""
+        started = time.time()
+        os.chdir(BACKEND_DIR)
+        sys.path.insert(0, str(BACKEND_DIR))
+        if self.workers > 1:
+            # Forked workers are separate processes, so they must share state through SQLite
+            os.environ.setdefault("STATE_BACKEND", "sqlite")
+            print(f"👥 Pre-forking {self.workers} workers with {os.environ['STATE_BACKEND']} shared state")
+
+        import uvicorn
+        from enhanced_dialogue_api import app
+
+        app.openapi()
+        self.config = uvicorn.Config(app, host=self.host, port=self.port, log_level="info")
+        # Resolves protocol classes and wraps the middleware stack once instead of in every worker
+        self.config.load()
+        self.sock = self.config.bind_socket()
+        self.sock.set_inheritable(True)
+        # Keep the garbage collector from writing to (and so un-sharing) every preloaded object
+        gc.freeze()
+        self.preload_time = time.time() - started
+
+    def spawn_worker(self):
+        read_fd, write_fd = os.pipe()
+        started = time.time()
+        if self.fresh_workers:
+            # A new interpreter that imports the current code and serves the shared socket
+            process = subprocess.Popen(
+                [sys.executable, "lifecycle.py", "enhanced_dialogue_api:app",
+                 "--fd", str(self.sock.fileno()), "--ready-fd", str(write_fd),
+                 "--drain-timeout", str(DRAIN_TIMEOUT)],
+                cwd=BACKEND_DIR, pass_fds=(self.sock.fileno(), write_fd)
+            )
+            pid = process.pid
+            self.fresh_processes[pid] = process
+        else:
+            pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            exit_code = 0
+            try:
+                for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                    signal.signal(signum, signal.SIG_DFL)
+                serve_worker(self.config, self.sock, write_fd)
+            except BaseException:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        os.close(write_fd)
+        self.worker_pids.add(pid)
+        self.ready_fds[pid] = read_fd
+        self.spawn_times[pid] = started
+        return pid
+
+    def wait_ready(self, timeout=30):
+        """Wait for every worker to finish its startup; returns pid -> seconds from fork"""
+        ready = {}
+        deadline = time.time() + timeout
+        pending = {fd: pid for pid, fd in self.ready_fds.items()}
+        self.ready_fds.clear()
+        while pending and time.time() < deadline:
+            readable, _, _ = select.select(list(pending), [], [], deadline - time.time())
+            for fd in readable:
+                pid = pending.pop(fd)
+                if os.read(fd, 1):
+                    ready[pid] = time.time() - self.spawn_times[pid]
+                os.close(fd)
+        for fd in pending:
+            os.close(fd)
+        return ready
+
+    def start_backend(self):
+        """Preload the backend in this process and fork the workers"""
+        print("🚀 Starting pre-forked Backend API...")
+        try:
+            self.preload()
+        except Exception as e:
+            print(f"❌ Error preloading backend: {e}")
+            return False
+        print(f"📦 App imported and warmed in {self.preload_time:.2f}s")
+        signal.signal(signal.SIGHUP, self.request_reload)
+
+        for _ in range(self.workers):
+            self.spawn_worker()
+        return True
+
+    def wait_for_backend(self):
+        """Wait for every forked worker to report that its startup finished"""
+        ready = self.wait_ready(timeout=BACKEND_READY_TIMEOUT)
+        if len(ready) != self.workers:
+            print(f"❌ Only {len(ready)} of {self.workers} workers started")
+            return False
+
+        print(f"✅ Backend ready on http://localhost:{self.port}")
+        self.report(ready)
+        return True
+
+    def report(self, ready):
+        """Per-worker spawn time and memory, optionally against a standard uvicorn launch"""
+        print("\n📊 Pre-fork workers:")
+        total_pss = 0
+        for pid, seconds in sorted(ready.items()):
+            memory = read_memory(pid)
+            total_pss += memory.get("pss", 0)
+            print(f"  • pid {pid}: ready {seconds:.3f}s after fork, {format_memory(memory)}")
+        parent = read_memory(os.getpid())
+        total_pss += parent.get("pss", 0)
+        print(f"  • parent {os.getpid()}: {format_memory(parent)}")
+
+        if not self.compare_launch:
+            return
+        standard = measure_standard_launch()
+        if standard is None:
+            print("⚠️  Standard launch did not start, nothing to compare against")
+            return
+        print(f"  • standard launch: ready {standard['ready']:.3f}s after exec, {format_memory(standard['memory'])}")
+        standard_total = standard["memory"].get("pss", 0) * self.workers
+        print(f"📉 {self.workers} pre-forked workers use {total_pss / 1024:.1f} MB PSS in total "
+              f"vs ~{standard_total / 1024:.1f} MB for {self.workers} standard workers")
+
+    def request_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def rolling_reload(self):
+        """Replace workers one at a time, starting each replacement before draining its predecessor"""
+        print("🔄 Rolling reload: replacing workers one at a time")
+        self.fresh_workers = True
+        for old_pid in list(self.worker_pids):
+            new_pid = self.spawn_worker()
+            if not self.wait_ready(timeout=BACKEND_READY_TIMEOUT):
+                print(f"❌ Replacement worker {new_pid} did not start; keeping worker {old_pid}")
+                self.terminate_worker(new_pid)
+                return
+            self.terminate_worker(old_pid)
+            print(f"✅ Worker {old_pid} drained and replaced by {new_pid}")
+        print("🎉 Rolling reload finished")
+
+    def terminate_worker(self, pid, timeout=STOP_TIMEOUT):
+        """SIGTERM a worker so it drains, and SIGKILL it if it outlives the timeout"""
+        self.worker_pids.discard(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    break
+            except ChildProcessError:
+                break
+            time.sleep(0.05)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.fresh_processes.pop(pid, None)
+
+    def supervise(self):
+        """Apply a requested reload and replace workers that died"""
+        if self.reload_requested:
+            self.reload_requested = False
+            self.rolling_reload()
+        # Reap only our own workers so the frontend's Popen can still collect npm
+        for pid in list(self.worker_pids):
+            try:
+                exited = os.waitpid(pid, os.WNOHANG)[0] != 0
+            except ChildProcessError:
+                exited = True
+            if exited and self.running:
+                self.worker_pids.discard(pid)
+                self.fresh_processes.pop(pid, None)
+                print(f"⚠️  Worker {pid} exited, starting a replacement")
+                new_pid = self.spawn_worker()
+                if self.wait_ready():
+                    print(f"✅ Worker {new_pid} ready")
+
+    def stop_workers(self, timeout=STOP_TIMEOUT):
+        for pid in self.worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + timeout
+        for pid in list(self.worker_pids):
+            while time.time() < deadline:
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0]:
+                        break
+                except ChildProcessError:
+                    break
+                time.sleep(0.05)
+            else:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+        self.worker_pids.clear()
+        if self.sock:
+            self.sock.close()
+
+    def signal_handler(self, signum, frame):
+        self.running = False
+        self.stop_workers()
+        super().signal_handler(signum, frame)
+
 if __name__ == "__main__":
-    runner = SystemRunner()
+    parser = argparse.ArgumentParser(description="Run the NPC Dialogue Generator backend and frontend")
+    parser.add_argument("--workers", type=int, default=1, help="Number of backend worker processes")
+    parser.add_argument("--prefork", action="store_true",
+                        help="Import the backend once and fork workers that share its memory")
+    parser.add_argument("--compare-launch", action="store_true",
+                        help="With --prefork, also time and measure one standard uvicorn worker")
+    args = parser.parse_args()
+    if args.prefork:
+        runner = PreforkRunner(workers=args.workers, compare_launch=args.compare_launch)
+    else:
+        runner = SystemRunner(workers=args.workers)
     runner.run()
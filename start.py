@@ -10,6 +10,8 @@ import time
 import webbrowser
 from pathlib import Path
 
+from launch_utils import wait_until_ready
+
 def main():
     print("🎮 Starting NPC Dialogue Generator...")
     
@@ -42,9 +44,7 @@ def main():
             "--port", "8000"
         ])
         
-        time.sleep(3)
-        
-        if process.poll() is None:
+        if wait_until_ready("http://localhost:8000/readyz", process):
             print("✅ Backend started on http://localhost:8000")
             
             # Open frontend
@@ -67,6 +67,7 @@ def main():
                 process.terminate()
         else:
             print("❌ Backend failed to start")
+            process.terminate()
     except Exception as e:
         print(f"❌ Error: {e}")
 
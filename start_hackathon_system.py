@@ -11,6 +11,8 @@ import time
 import webbrowser
 from pathlib import Path
 
+from launch_utils import wait_until_ready
+
 def check_requirements():
     """Check if all required dependencies are installed"""
     try:
@@ -32,16 +34,13 @@ def start_backend():
     os.chdir(backend_path)
     
     # Start the enhanced API server
-    subprocess.Popen([
+    return subprocess.Popen([
         sys.executable, "-m", "uvicorn", 
         "enhanced_dialogue_api:app", 
         "--host", "0.0.0.0", 
         "--port", "8000", 
         "--reload"
     ])
-    
-    print("✅ Backend server started on http://localhost:8000")
-    print("📚 API Documentation available at http://localhost:8000/docs")
 
 def start_frontend():
     """Start the React frontend"""
@@ -60,10 +59,7 @@ def start_frontend():
         subprocess.run(["npm", "install"], check=True)
     
     # Start the React development server
-    subprocess.Popen(["npm", "start"])
-    
-    print("✅ Frontend started on http://localhost:3000")
-    return True
+    return subprocess.Popen(["npm", "start"])
 
 def main():
     """Main startup function"""
@@ -81,13 +77,17 @@ def main():
     
     print("\n🔧 Starting system components...")
     
-    # Start backend
-    start_backend()
-    time.sleep(3)  # Give backend time to start
+    # Start backend and frontend together, then wait until both answer
+    backend_process = start_backend()
+    frontend_process = start_frontend()
+    if not wait_until_ready("http://localhost:8000/readyz", backend_process):
+        print("❌ Backend did not become ready")
+        return
+    print("✅ Backend server started on http://localhost:8000")
+    print("📚 API Documentation available at http://localhost:8000/docs")
     
-    # Start frontend
-    if start_frontend():
-        time.sleep(5)  # Give frontend time to start
+    if frontend_process and wait_until_ready("http://localhost:3000", frontend_process, timeout=180):
+        print("✅ Frontend started on http://localhost:3000")
         
         print("\n🎉 System is ready!")
         print("=" * 50)
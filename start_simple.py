@@ -4,13 +4,15 @@ Simple startup script for NPC Dialogue Generator
 Uses the simple API and HTML frontend for guaranteed functionality
 """
 
-import subprocess
+import argparse
 import sys
 import os
 import time
 import webbrowser
 from pathlib import Path
 
+from launch_utils import get_log_path, start_logged_process, tail_log, wait_until_ready
+
 def check_requirements():
     """Check if required packages are installed"""
     try:
@@ -42,32 +44,35 @@ def check_api_key():
         print(f"❌ Error reading .env file: {e}")
         return False
 
-def start_backend():
+def start_backend(workers=1):
     """Start the simple backend API"""
     print("🚀 Starting Simple Backend API...")
     backend_path = Path(__file__).parent / "backend"
-    os.chdir(backend_path)
+    
+    env = dict(os.environ)
+    if workers > 1:
+        # Workers are separate processes, so they must share state through SQLite
+        env.setdefault("STATE_BACKEND", "sqlite")
+        print(f"👥 Running {workers} workers with {env['STATE_BACKEND']} shared state")
     
     try:
         # Start the simple API server
-        process = subprocess.Popen([
+        process = start_logged_process("backend", [
             sys.executable, "-m", "uvicorn", 
             "simple_api:app", 
             "--host", "0.0.0.0", 
-            "--port", "8000"
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        # Wait a moment for startup
-        time.sleep(3)
+            "--port", "8000",
+            "--workers", str(workers)
+        ], cwd=backend_path, env=env)
         
-        if process.poll() is None:
-            print("✅ Backend started on http://localhost:8000")
+        # Wait until the API reports ready
+        if wait_until_ready("http://localhost:8000/readyz", process):
+            print(f"✅ Backend started on http://localhost:8000 (logs: {get_log_path('backend')})")
             return process
         else:
-            stdout, stderr = process.communicate()
-            print(f"❌ Backend failed to start:")
-            print(f"STDOUT: {stdout.decode()}")
-            print(f"STDERR: {stderr.decode()}")
+            print(f"❌ Backend failed to start. Last log lines:")
+            print(tail_log("backend"))
+            process.terminate()
             return None
             
     except Exception as e:
@@ -88,6 +93,10 @@ def open_frontend():
 
 def main():
     """Main startup function"""
+    parser = argparse.ArgumentParser(description="Start the simple NPC Dialogue Generator")
+    parser.add_argument("--workers", type=int, default=1, help="Number of backend worker processes")
+    args = parser.parse_args()
+    
     print("🎮 NPC Dialogue Generator - Simple Version")
     print("=" * 50)
     
@@ -103,13 +112,10 @@ def main():
         return
     
     # Start backend
-    backend_process = start_backend()
+    backend_process = start_backend(args.workers)
     if not backend_process:
         return
     
-    # Wait a moment for backend to fully start
-    time.sleep(2)
-    
     # Open frontend
     if open_frontend():
         print("\n🎉 System is ready!")
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Gateway test with several local backend nodes
+Checks consistent-hash remapping, session affinity for HTTP and WebSocket
+traffic, that characters created or imported on the catalog node reach every
+node while session history stays on the session's own node, and failover when
+a node drains (its WebSocket clients get the 1012 reconnect code through the
+gateway). Each node runs its own memory store, and a restarted node gets the
+characters back before it takes sessions
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+from websockets.sync.client import connect
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+GATEWAY_PORT = 8200
+NODE_PORTS = [8201, 8202, 8203]
+NODE_URLS = [f"http://127.0.0.1:{port}" for port in NODE_PORTS]
+GATEWAY_URL = f"http://127.0.0.1:{GATEWAY_PORT}"
+PROFILE = {
+    "name": "Elder Rynn",
+    "role": "Forest Guardian",
+    "personality": "Wise, cryptic, protective",
+    "backstory": "He has guarded the Whispering Woods for centuries."
+}
+
+def check_ring_remapping():
+    """Leaving or joining moves only the keys that have to move"""
+    from gateway import HashRing
+
+    nodes = [f"http://node{i}" for i in range(3)]
+    ring = HashRing(nodes)
+    keys = [f"char_{i}_session_{i * 7}" for i in range(3000)]
+    before = {key: ring.get_node(key) for key in keys}
+
+    ring.remove_node(nodes[1])
+    after_leave = {key: ring.get_node(key) for key in keys}
+    moved = [key for key in keys if before[key] != after_leave[key]]
+    leave_ok = all(before[key] == nodes[1] for key in moved)
+
+    ring.add_node(nodes[1])
+    ring.add_node("http://node3")
+    after_join = {key: ring.get_node(key) for key in keys}
+    moved_on_join = [key for key in keys if before[key] != after_join[key]]
+    join_ok = all(after_join[key] == "http://node3" for key in moved_on_join)
+
+    share = len(moved_on_join) / len(keys)
+    if leave_ok and join_ok and 0.15 < share < 0.35:
+        print(f"✅ Ring remaps minimally (leave moved only the lost node's keys, join moved {share:.0%})")
+        return True
+    print(f"❌ Unexpected remapping: leave_ok={leave_ok} join_ok={join_ok} join share={share:.0%}")
+    return False
+
+def wait_until_up(url, deadline):
+    while True:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            if time.time() > deadline:
+                raise RuntimeError(f"{url} did not start")
+            time.sleep(0.2)
+
+def node_env(tmp, port):
+    env = dict(os.environ, STATE_BACKEND="memory", JOB_DB_PATH=os.path.join(tmp, f"jobs_{port}.db"))
+    env.setdefault("DIALOGUE_PROVIDER", "fake")
+    return env
+
+def start_node(tmp, port):
+    """One backend node with its own memory store"""
+    return subprocess.Popen(
+        [sys.executable, "lifecycle.py", "enhanced_dialogue_api:app", "--port", str(port),
+         "--log-level", "warning", "--drain-timeout", "2"],
+        cwd=BACKEND_DIR, env=node_env(tmp, port)
+    )
+
+def wait_until_healthy(deadline):
+    """Nodes that were still starting when the gateway probed them join on a later health check"""
+    while not all(node["healthy"] for node in requests.get(f"{GATEWAY_URL}/gateway/nodes", timeout=5).json()["nodes"]):
+        if time.time() > deadline:
+            raise RuntimeError("Gateway never saw every node healthy")
+        time.sleep(0.2)
+
+def start_cluster(tmp):
+    processes = {f"http://127.0.0.1:{port}": start_node(tmp, port) for port in NODE_PORTS}
+    env = node_env(tmp, GATEWAY_PORT)
+    gateway_args = [sys.executable, "gateway.py", "--port", str(GATEWAY_PORT), "--health-interval", "0.5"]
+    for port in NODE_PORTS:
+        gateway_args += ["--node", f"http://127.0.0.1:{port}"]
+    processes["gateway"] = subprocess.Popen(gateway_args, cwd=BACKEND_DIR, env=env,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    for port in NODE_PORTS + [GATEWAY_PORT]:
+        wait_until_up(f"http://127.0.0.1:{port}/readyz", deadline)
+    wait_until_healthy(deadline)
+    return processes
+
+def node_characters(node):
+    return requests.get(f"{node}/api/characters", timeout=10).json()["characters"]
+
+def check_session_affinity():
+    """Every request for a session goes to the same node"""
+    character_id = requests.post(f"{GATEWAY_URL}/api/character/create", json=PROFILE, timeout=10).json()["character_id"]
+    placements = {}
+    for attempt in range(2):
+        for i in range(20):
+            response = requests.get(f"{GATEWAY_URL}/api/conversation/{character_id}/session_{i}", timeout=10)
+            placements.setdefault(i, set()).add(response.headers["x-gateway-node"])
+    sticky = all(len(nodes) == 1 for nodes in placements.values())
+    used = {node for nodes in placements.values() for node in nodes}
+    if sticky and len(used) > 1:
+        print(f"✅ 20 sessions stayed on their node across requests and spread over {len(used)} nodes")
+        return character_id, True
+    print(f"❌ Session placement not sticky or not spread: {placements}")
+    return character_id, False
+
+def check_character_on_other_nodes():
+    """A session hashed to another node than the one that created its character still finds it"""
+    response = requests.post(f"{GATEWAY_URL}/api/character/create", json=PROFILE, timeout=10)
+    character_id, creator = response.json()["character_id"], response.headers["x-gateway-node"]
+    for i in range(50):
+        session_id = f"elsewhere_{i}"
+        node = requests.get(f"{GATEWAY_URL}/api/conversation/{character_id}/{session_id}",
+                            timeout=10).headers["x-gateway-node"]
+        if node != creator:
+            break
+    else:
+        print(f"❌ No session of {character_id} hashed away from {creator}")
+        return False
+    response = requests.post(f"{GATEWAY_URL}/api/dialogue/generate", timeout=10, json={
+        "character_id": character_id, "session_id": session_id, "message": "Hello there"})
+    if response.status_code != 200 or response.headers["x-gateway-node"] != node:
+        print(f"❌ Session on {response.headers.get('x-gateway-node')} got {response.status_code}: {response.text[:200]}")
+        return False
+    # The history is kept by the session's node alone
+    path = f"/api/conversation/{character_id}/{session_id}"
+    here = requests.get(f"{node}{path}", timeout=10).json()["conversation"]
+    there = requests.get(f"{creator}{path}", timeout=10).json()["conversation"]
+    if len(here) == 2 and not there:
+        print("✅ A session on another node than the catalog node found its character and kept its history locally")
+        return True
+    print(f"❌ History of {session_id}: {len(here)} turns on its node, {len(there)} on {creator}")
+    return False
+
+def check_catalog_replicated():
+    """Creates and bulk imports go to one catalog node, and every node holds the new characters"""
+    created = requests.post(f"{GATEWAY_URL}/api/character/create", json=PROFILE, timeout=10)
+    imported = requests.post(f"{GATEWAY_URL}/api/character/bulk", timeout=10,
+                             headers={"Content-Type": "application/x-ndjson"},
+                             data="\n".join(json.dumps(dict(PROFILE, name=f"Twin {i}")) for i in range(3)))
+    ids = {created.json()["character_id"]} | {result["character_id"] for result in imported.json()["results"]}
+    catalog_nodes = {created.headers["x-gateway-node"], imported.headers["x-gateway-node"]}
+    missing = {node: sorted(ids - set(node_characters(node))) for node in NODE_URLS}
+    listed = set(requests.get(f"{GATEWAY_URL}/api/characters", timeout=10).json()["characters"])
+    if len(ids) == 4 and len(catalog_nodes) == 1 and not any(missing.values()) and ids <= listed:
+        print(f"✅ Characters minted on {catalog_nodes.pop()} were on every node before the create returned")
+        return True
+    print(f"❌ Catalog not replicated: ids={sorted(ids)} catalog nodes={catalog_nodes} missing={missing}")
+    return False
+
+def check_websocket_proxy(character_id):
+    """WebSocket handshakes, including the msgpack subprotocol, pass through the gateway"""
+    try:
+        with connect(f"ws://127.0.0.1:{GATEWAY_PORT}/ws/{character_id}/session_ws",
+                     subprotocols=["msgpack"], open_timeout=5) as websocket:
+            if websocket.subprotocol == "msgpack":
+                print("✅ WebSocket proxied to the session's node with msgpack negotiated")
+                return True
+            print(f"❌ Unexpected subprotocol {websocket.subprotocol}")
+    except Exception as e:
+        print(f"❌ WebSocket proxy failed: {e}")
+    return False
+
+def check_multiplexed_proxy(character_id):
+    """The multiplexed socket is proxied to the player's node, and refused without a player_id"""
+    try:
+        with connect(f"ws://127.0.0.1:{GATEWAY_PORT}/ws?player_id=player_7", open_timeout=5) as websocket:
+            websocket.send(json.dumps({"request_id": "r1", "character_id": character_id,
+                                       "session_id": "mux_session", "message": "Any news?"}))
+            while True:
+                frame = json.loads(websocket.recv(timeout=10))
+                if frame["type"] in ("done", "error"):
+                    break
+    except Exception as e:
+        print(f"❌ Multiplexed WebSocket proxy failed: {e}")
+        return False
+    try:
+        with connect(f"ws://127.0.0.1:{GATEWAY_PORT}/ws", open_timeout=5) as websocket:
+            websocket.recv(timeout=5)
+        refused = False
+    except Exception:
+        refused = True
+    if frame["type"] == "done" and frame["request_id"] == "r1" and refused:
+        print("✅ Multiplexed WebSocket proxied by player_id, and refused without one")
+        return True
+    print(f"❌ Multiplexed proxy: last frame {frame}, refused without player_id: {refused}")
+    return False
+
+def check_failover(processes, character_id, tmp):
+    """Sessions of a dead node are served by the remaining nodes, and its sockets are told to reconnect"""
+    response = requests.get(f"{GATEWAY_URL}/api/conversation/{character_id}/session_failover", timeout=10)
+    owner = response.headers["x-gateway-node"]
+    close_code = None
+    with connect(f"ws://127.0.0.1:{GATEWAY_PORT}/ws/{character_id}/session_failover", open_timeout=5) as websocket:
+        processes[owner].terminate()
+        try:
+            while True:
+                websocket.recv(timeout=10)
+        except Exception:
+            close_code = websocket.close_code
+    processes[owner].wait(timeout=10)
+    time.sleep(2)
+    if close_code != 1012:
+        print(f"❌ Draining node's WebSocket closed with {close_code} through the gateway, expected 1012")
+        return False
+    print("✅ Draining node's 1012 close code reached the client through the gateway")
+
+    response = requests.get(f"{GATEWAY_URL}/api/conversation/{character_id}/session_failover", timeout=10)
+    nodes = requests.get(f"{GATEWAY_URL}/gateway/nodes", timeout=10).json()["nodes"]
+    unhealthy = [node["url"] for node in nodes if not node["healthy"]]
+    if response.status_code != 200 or response.headers["x-gateway-node"] == owner or unhealthy != [owner]:
+        print(f"❌ Failover failed: status {response.status_code}, unhealthy={unhealthy}")
+        return False
+    print("✅ Dead node was taken out of the ring and its session failed over")
+
+    # The restarted node comes back with an empty memory store
+    processes[owner] = start_node(tmp, int(owner.rsplit(":", 1)[1]))
+    wait_until_healthy(time.time() + 30)
+    if character_id in node_characters(owner):
+        print("✅ Restarted node got the characters back before rejoining the ring")
+        return True
+    print(f"❌ Restarted node {owner} is missing {character_id}")
+    return False
+
+def main():
+    print("🧪 Gateway test")
+    print("=" * 50)
+    results = [check_ring_remapping()]
+    with tempfile.TemporaryDirectory() as tmp:
+        processes = start_cluster(tmp)
+        try:
+            character_id, ok = check_session_affinity()
+            results.append(ok)
+            results.append(check_character_on_other_nodes())
+            results.append(check_catalog_replicated())
+            results.append(check_websocket_proxy(character_id))
+            results.append(check_multiplexed_proxy(character_id))
+            results.append(check_failover(processes, character_id, tmp))
+        finally:
+            for process in processes.values():
+                process.terminate()
+            for process in processes.values():
+                process.wait(timeout=10)
+
+    print("=" * 50)
+    if all(results):
+        print("🎉 All gateway checks passed")
+        return 0
+    print("❌ Some gateway checks failed")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
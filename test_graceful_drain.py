@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Graceful drain and rolling reload test
+Stops a worker in the middle of a slow generation and checks the reply still
+arrives, WebSocket clients are told to reconnect, and a rolling reload of a
+pre-forked backend serves every request without an error
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+from websockets.sync.client import connect
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+DRAIN_PORT = 8301
+PREFORK_PORT = 8302
+PROFILE = {
+    "name": "Elder Rynn",
+    "role": "Forest Guardian",
+    "personality": "Wise, cryptic, protective",
+    "backstory": "He has guarded the Whispering Woods for centuries."
+}
+
+# One worker whose fake provider takes a while to answer
+SLOW_WORKER = f"""
+import sys
+sys.argv = ["lifecycle.py", "enhanced_dialogue_api:app", "--port", "{DRAIN_PORT}", "--log-level", "warning"]
+import enhanced_dialogue_api
+from providers import FakeProvider
+enhanced_dialogue_api.provider = FakeProvider(latency=1.5)
+import lifecycle
+lifecycle.main()
+"""
+
+PREFORK_RUNNER = f"""
+import signal, sys, time
+sys.path.insert(0, {str(Path(__file__).parent)!r})
+from run_system import PreforkRunner
+runner = PreforkRunner(workers=2, port={PREFORK_PORT})
+signal.signal(signal.SIGTERM, runner.signal_handler)
+if not (runner.start_backend() and runner.wait_for_backend()):
+    sys.exit(1)
+while True:
+    runner.supervise()
+    time.sleep(0.2)
+"""
+
+def wait_until_ready(url, deadline):
+    while True:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        if time.time() > deadline:
+            raise RuntimeError(f"{url} did not become ready")
+        time.sleep(0.1)
+
+def child_pids(pid):
+    children = []
+    for entry in Path("/proc").iterdir():
+        if entry.name.isdigit():
+            try:
+                # ppid is the 4th field, after the parenthesised command name
+                if int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1]) == pid:
+                    children.append(int(entry.name))
+            except (OSError, IndexError, ValueError):
+                pass
+    return sorted(children)
+
+def check_drain(env):
+    """SIGTERM waits for an in-flight generation and sends WebSocket clients a reconnect notice"""
+    server = subprocess.Popen([sys.executable, "-c", SLOW_WORKER], cwd=BACKEND_DIR, env=env)
+    base = f"http://127.0.0.1:{DRAIN_PORT}"
+    try:
+        wait_until_ready(f"{base}/readyz", time.time() + 30)
+        character_id = requests.post(f"{base}/api/character/create", json=PROFILE, timeout=10).json()["character_id"]
+        websocket = connect(f"ws://127.0.0.1:{DRAIN_PORT}/ws/{character_id}/session_ws", open_timeout=5)
+
+        result = {}
+        def slow_request():
+            result["response"] = requests.post(f"{base}/api/dialogue/generate", json={
+                "message": "Tell me about the woods", "character_id": character_id, "session_id": "session_http"
+            }, timeout=30)
+        request_thread = threading.Thread(target=slow_request)
+        request_thread.start()
+        time.sleep(0.3)
+        server.send_signal(signal.SIGTERM)
+        request_thread.join()
+
+        notice = websocket.recv(timeout=10)
+        try:
+            websocket.recv(timeout=10)
+            close_code = None
+        except Exception:
+            close_code = websocket.close_code
+        server.wait(timeout=10)
+
+        ok = True
+        if result["response"].status_code == 200:
+            print("✅ In-flight generation finished after SIGTERM")
+        else:
+            print(f"❌ In-flight generation failed with {result['response'].status_code}")
+            ok = False
+        if '"reconnect"' in notice and close_code == 1012:
+            print("✅ WebSocket client got a reconnect notice and close code 1012")
+        else:
+            print(f"❌ Unexpected WebSocket shutdown: {notice!r}, close code {close_code}")
+            ok = False
+        return ok
+    finally:
+        if server.poll() is None:
+            server.kill()
+
+def check_rolling_reload(env):
+    """SIGHUP replaces every pre-forked worker while requests keep succeeding"""
+    runner = subprocess.Popen([sys.executable, "-c", PREFORK_RUNNER], cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{PREFORK_PORT}"
+    try:
+        wait_until_ready(f"{base}/readyz", time.time() + 30)
+        before = child_pids(runner.pid)
+
+        statuses = []
+        stop = threading.Event()
+        def hammer():
+            session = requests.Session()
+            while not stop.is_set():
+                try:
+                    statuses.append(session.get(f"{base}/api/characters?limit=1", timeout=10).status_code)
+                except requests.exceptions.RequestException as e:
+                    statuses.append(type(e).__name__)
+        clients = [threading.Thread(target=hammer) for _ in range(4)]
+        for client in clients:
+            client.start()
+
+        runner.send_signal(signal.SIGHUP)
+        deadline = time.time() + 60
+        after = before
+        while time.time() < deadline:
+            after = child_pids(runner.pid)
+            if after and not set(after) & set(before) and len(after) == len(before):
+                break
+            time.sleep(0.2)
+        time.sleep(0.5)
+        stop.set()
+        for client in clients:
+            client.join()
+
+        failures = [status for status in statuses if status != 200]
+        replaced = bool(after) and not set(after) & set(before)
+        if replaced and not failures:
+            print(f"✅ Rolling reload replaced workers {before} -> {after} with {len(statuses)} requests and no errors")
+            return True
+        print(f"❌ Rolling reload: replaced={replaced}, {len(failures)} failures of {len(statuses)}: {failures[:5]}")
+        return False
+    finally:
+        runner.send_signal(signal.SIGTERM)
+        try:
+            runner.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            runner.kill()
+
+def main():
+    print("🧪 Graceful drain test")
+    print("=" * 50)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DIALOGUE_PROVIDER="fake", DRAIN_TIMEOUT="10", STATE_BACKEND="sqlite",
+                   STATE_DB_PATH=os.path.join(tmp, "state.db"), JOB_DB_PATH=os.path.join(tmp, "jobs.db"))
+        results = [check_drain(env), check_rolling_reload(env)]
+
+    print("=" * 50)
+    if all(results):
+        print("🎉 All drain checks passed")
+        return 0
+    print("❌ Some drain checks failed")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
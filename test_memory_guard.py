@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+MemoryGuard test
+Simulates RSS that stays high after an eviction, as it does when Python keeps
+freed memory, and checks that the guard holds off instead of evicting on
+every check, then evicts again once RSS grows or after an effective round.
+Also checks that an evicted session's seq keeps counting up, so clients
+polling with since= never miss its new turns
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import memory
+from memory import REGROWTH, MemoryGuard
+from state_store import MemoryStateStore
+
+MB = 2**20
+LIMIT = 100 * MB
+
+def make_guard(rss, freed_per_round=0):
+    """A guard whose evictor lowers the simulated RSS by freed_per_round"""
+    memory.rss_bytes = lambda: rss[0]
+    guard = MemoryGuard(LIMIT)
+    rounds = []
+
+    @guard.on_pressure("sessions")
+    def evict_sessions():
+        rounds.append(rss[0])
+        rss[0] -= freed_per_round
+        return 10
+    return guard, rounds
+
+def check_holds_off_when_rss_stays_high():
+    rss = [150 * MB]
+    guard, rounds = make_guard(rss)
+    for _ in range(5):
+        guard.check()
+    if len(rounds) != 1:
+        print(f"❌ Evicted {len(rounds)} times while eviction freed nothing, expected once")
+        return False
+    rss[0] += int(LIMIT * REGROWTH) + MB
+    guard.check()
+    guard.check()
+    if len(rounds) != 2:
+        print(f"❌ Evicted {len(rounds)} times after RSS grew past the hold-off, expected 2")
+        return False
+    print("✅ Guard held off while RSS stayed high and evicted again once it grew")
+    return True
+
+def check_keeps_evicting_while_effective():
+    rss = [130 * MB]
+    guard, rounds = make_guard(rss, freed_per_round=10 * MB)
+    for _ in range(5):
+        guard.check()
+    if len(rounds) != 3 or rss[0] > LIMIT:
+        print(f"❌ {len(rounds)} rounds brought RSS to {rss[0] / MB:.0f} MB, expected 3 rounds to reach the limit")
+        return False
+    print("✅ Guard kept evicting while rounds lowered RSS, and stopped under the limit")
+    return True
+
+def check_resets_under_limit():
+    rss = [150 * MB]
+    guard, rounds = make_guard(rss)
+    guard.check()
+    rss[0] = 90 * MB
+    guard.check()
+    rss[0] = 110 * MB
+    guard.check()
+    if len(rounds) != 2:
+        print(f"❌ Evicted {len(rounds)} times, expected a new round after RSS dipped under the limit")
+        return False
+    print("✅ Hold-off was cleared once RSS went back under the limit")
+    return True
+
+def check_seq_survives_eviction():
+    store = MemoryStateStore()
+    session_key = "char_1_player"
+    store.append_turns(session_key, [{"speaker": "Player", "content": f"Turn {i}"} for i in range(3)])
+    store.evict_sessions(fraction=1.0)
+    store.append_turns(session_key, [{"speaker": "Player", "content": "After eviction"}])
+    turns, last_seq = store.get_conversation(session_key, since=3)
+    if [turn["seq"] for turn in turns] == [4] and last_seq == 4:
+        print("✅ An evicted session continued at seq 4 and since=3 returned the new turn")
+        return True
+    print(f"❌ After eviction since=3 returned {turns} with last_seq {last_seq}")
+    return False
+
+def main():
+    print("🧪 MemoryGuard test")
+    print("=" * 50)
+    results = []
+    for check in (check_holds_off_when_rss_stays_high, check_keeps_evicting_while_effective, check_resets_under_limit,
+                  check_seq_survives_eviction):
+        results.append(check())
+
+    print("=" * 50)
+    if all(results):
+        print("🎉 All memory guard checks passed")
+        return 0
+    print("❌ Some memory guard checks failed")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Multi-worker test for the shared state backend
+Runs several backend processes against one SQLite state file and verifies
+they agree on characters, conversation history and jobs
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+WORKER_PORTS = [8101, 8102, 8103]
+PROFILE = {
+    "name": "Elder Rynn",
+    "role": "Forest Guardian",
+    "personality": "Wise, cryptic, protective",
+    "backstory": "He has guarded the Whispering Woods for centuries."
+}
+
+def append_from_process(db_path, worker, turns):
+    from state_store import SQLiteStateStore
+    store = SQLiteStateStore(db_path)
+    for i in range(turns):
+        store.append_turns("char_1_shared", [{"speaker": f"worker{worker}", "content": str(i)}])
+
+def check_store_across_processes(db_path):
+    """Concurrent appends from several processes get unique, gap-free seqs"""
+    processes = [multiprocessing.Process(target=append_from_process, args=(db_path, w, 50)) for w in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    from state_store import SQLiteStateStore
+    turns, last_seq = SQLiteStateStore(db_path).get_conversation("char_1_shared")
+    seqs = [turn["seq"] for turn in turns]
+    if seqs == list(range(1, 201)) and last_seq == 200:
+        print("✅ 4 processes appended 200 turns with contiguous seqs")
+        return True
+    print(f"❌ Expected seqs 1..200, got {len(seqs)} turns (last_seq={last_seq})")
+    return False
+
+def start_workers(state_db, job_db):
+    env = dict(os.environ, STATE_BACKEND="sqlite", STATE_DB_PATH=state_db, JOB_DB_PATH=job_db)
+    env.setdefault("DIALOGUE_PROVIDER", "fake")
+    workers = []
+    for port in WORKER_PORTS:
+        workers.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "enhanced_dialogue_api:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env
+        ))
+
+    deadline = time.time() + 30
+    for port in WORKER_PORTS:
+        while True:
+            try:
+                requests.get(f"http://127.0.0.1:{port}/readyz", timeout=1).raise_for_status()
+                break
+            except requests.exceptions.RequestException:
+                if time.time() > deadline:
+                    raise RuntimeError(f"Worker on port {port} did not start")
+                time.sleep(0.2)
+    return workers
+
+def check_workers_share_state():
+    """Characters and jobs created on one worker are visible from every other worker"""
+    ok = True
+
+    # Create characters concurrently, spread round-robin over the workers
+    def create(i):
+        port = WORKER_PORTS[i % len(WORKER_PORTS)]
+        response = requests.post(f"http://127.0.0.1:{port}/api/character/create",
+                                 json={**PROFILE, "name": f"NPC {i}"}, timeout=10)
+        return response.json()["character_id"]
+
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        character_ids = list(pool.map(create, range(30)))
+    if len(set(character_ids)) == 30:
+        print("✅ 30 concurrent creates across 3 workers got unique ids")
+    else:
+        print(f"❌ Duplicate character ids: {sorted(character_ids)}")
+        ok = False
+
+    etags = set()
+    for port in WORKER_PORTS:
+        response = requests.get(f"http://127.0.0.1:{port}/api/characters", timeout=10)
+        etags.add(response.headers.get("etag"))
+        if set(response.json()["characters"]) != set(character_ids):
+            print(f"❌ Worker on port {port} sees {len(response.json()['characters'])} characters")
+            ok = False
+    if len(etags) == 1:
+        print("✅ Every worker lists the same characters with the same ETag")
+    else:
+        print(f"❌ Workers disagree on the ETag: {etags}")
+        ok = False
+
+    # Submit a job on one worker and follow it from another
+    job = requests.post(f"http://127.0.0.1:{WORKER_PORTS[0]}/api/jobs", json={
+        "kind": "bulk_create_characters",
+        "payload": {"characters": [PROFILE] * 5}
+    }, timeout=10).json()
+    status = {}
+    for _ in range(50):
+        status = requests.get(f"http://127.0.0.1:{WORKER_PORTS[1]}/api/jobs/{job['job_id']}", timeout=10).json()
+        if status["status"] == "completed":
+            break
+        time.sleep(0.1)
+    characters = requests.get(f"http://127.0.0.1:{WORKER_PORTS[2]}/api/characters", timeout=10).json()["characters"]
+    if status.get("status") == "completed" and len(characters) == 35:
+        print("✅ Job submitted on worker 1 was tracked on worker 2 and its results seen on worker 3")
+    else:
+        print(f"❌ Job status {status.get('status')}, worker 3 sees {len(characters)} characters")
+        ok = False
+    return ok
+
+def main():
+    print("🧪 Multi-worker shared state test")
+    print("=" * 50)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [check_store_across_processes(os.path.join(tmp, "store.db"))]
+
+        workers = start_workers(os.path.join(tmp, "state.db"), os.path.join(tmp, "jobs.db"))
+        try:
+            results.append(check_workers_share_state())
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.wait(timeout=10)
+
+    print("=" * 50)
+    if all(results):
+        print("🎉 All multi-worker checks passed")
+        return 0
+    print("❌ Some multi-worker checks failed")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Traffic capture anonymization test
+Drives HTTP and WebSocket traffic, including requests that match no route,
+through a backend with CAPTURE_PATH set and checks that no character or
+session id, message text or profile text reaches the capture file
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+from websockets.sync.client import connect
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+PORT = 8321
+BASE = f"http://127.0.0.1:{PORT}"
+SESSION_ID = "session_ravenholm_4711"
+MESSAGE = "My secret password is swordfish"
+PROFILE = {
+    "name": "Elder Rynn",
+    "role": "Forest Guardian",
+    "personality": "Wise, cryptic, protective",
+    "backstory": "He has guarded the Whispering Woods for centuries."
+}
+
+def wait_until_up(url, deadline):
+    while True:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            if time.time() > deadline:
+                raise RuntimeError(f"{url} did not start")
+            time.sleep(0.2)
+
+def drive_traffic():
+    """Send player traffic and return the character id the server minted"""
+    character_id = requests.post(f"{BASE}/api/character/create", json=PROFILE, timeout=10).json()["character_id"]
+    requests.post(f"{BASE}/api/dialogue/generate", timeout=10, json={
+        "character_id": character_id, "session_id": SESSION_ID, "message": MESSAGE})
+    requests.get(f"{BASE}/api/conversation/{character_id}/{SESSION_ID}", timeout=10)
+    # No route matches these, so only the raw path could describe them
+    requests.get(f"{BASE}/api/unknown/{character_id}/{SESSION_ID}", timeout=10)
+    try:
+        with connect(f"ws://127.0.0.1:{PORT}/ws/{character_id}/{SESSION_ID}/extra", open_timeout=5):
+            pass
+    except Exception:
+        pass
+    with connect(f"ws://127.0.0.1:{PORT}/ws/{character_id}/{SESSION_ID}", open_timeout=5) as websocket:
+        websocket.send(json.dumps({"message": MESSAGE}))
+        while json.loads(websocket.recv(timeout=10)).get("type") != "done":
+            pass
+    return character_id
+
+def main():
+    print("🧪 Traffic capture anonymization test")
+    print("=" * 50)
+    with tempfile.TemporaryDirectory() as tmp:
+        capture_path = os.path.join(tmp, "capture.jsonl")
+        env = dict(os.environ, CAPTURE_PATH=capture_path, STATE_BACKEND="memory",
+                   JOB_DB_PATH=os.path.join(tmp, "jobs.db"), DIALOGUE_PROVIDER="fake")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "enhanced_dialogue_api:app", "--port", str(PORT), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env
+        )
+        try:
+            wait_until_up(f"{BASE}/healthz", time.time() + 30)
+            character_id = drive_traffic()
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+        with open(capture_path) as f:
+            text = f.read()
+    records = [json.loads(line) for line in text.splitlines()]
+
+    secrets = [character_id, SESSION_ID] + MESSAGE.split() + PROFILE["backstory"].rstrip(".").split()
+    leaked = [secret for secret in secrets if len(secret) > 3 and secret in text]
+    kinds = {record["k"] for record in records}
+    routes = {record.get("r") for record in records if "r" in record}
+    results = []
+    if leaked:
+        print(f"❌ Capture file contains raw values: {leaked}")
+        results.append(False)
+    else:
+        print(f"✅ No id, message or profile text in {len(records)} captured records")
+        results.append(True)
+    if any("unknown" in route or "extra" in route for route in routes):
+        print(f"❌ Unmatched requests were recorded: {sorted(routes)}")
+        results.append(False)
+    else:
+        print(f"✅ Only route templates recorded: {sorted(routes)}")
+        results.append(True)
+    if {"http", "ws_open", "ws", "ws_close"} <= kinds:
+        print("✅ HTTP requests and WebSocket open, frame and close were all captured")
+        results.append(True)
+    else:
+        print(f"❌ Missing record kinds, got {sorted(kinds)}")
+        results.append(False)
+
+    print("=" * 50)
+    if all(results):
+        print("🎉 All traffic capture checks passed")
+        return 0
+    print("❌ Some traffic capture checks failed")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Multiplexed WebSocket test
+Talks to several NPCs over the single /ws socket and checks that replies
+stream back interleaved, each tagged with its request envelope, and that a
+newer message supersedes or coalesces with a session's pending turn.
+A client that reconnects resumes its reply without a new generation
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import msgpack
+import requests
+from websockets.sync.client import connect
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+PORT = 8311
+BASE = f"http://127.0.0.1:{PORT}"
+LATENCY = 1.0
+DEBOUNCE_MS = 200
+PROFILES = [
+    {"name": "Elder Rynn", "role": "Forest Guardian", "personality": "Wise, cryptic, protective",
+     "backstory": "He has guarded the Whispering Woods for centuries."},
+    {"name": "Mira", "role": "Blacksmith", "personality": "Gruff, honest, proud",
+     "backstory": "She forged the blades of the old royal guard."},
+]
+
+# One worker whose fake provider takes a while before the first chunk
+SLOW_WORKER = f"""
+import sys
+sys.argv = ["lifecycle.py", "enhanced_dialogue_api:app", "--port", "{PORT}", "--log-level", "warning"]
+import enhanced_dialogue_api
+from providers import FakeProvider
+enhanced_dialogue_api.provider = FakeProvider(latency={LATENCY})
+import lifecycle
+lifecycle.main()
+"""
+
+def wait_until_ready(server, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline and server.poll() is None:
+        try:
+            if requests.get(f"{BASE}/readyz", timeout=1).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    return False
+
+def collect(websocket, request_ids, timeout=15):
+    """Read frames until every request id has a done, error or cancelled frame"""
+    frames = []
+    pending = set(request_ids)
+    while pending:
+        frame = json.loads(websocket.recv(timeout=timeout))
+        frames.append(frame)
+        if frame["type"] in ("done", "error", "cancelled"):
+            pending.discard(frame.get("request_id"))
+    return frames
+
+def check_interleaved(character_ids):
+    """Two NPCs on one socket answer concurrently, with chunks for both"""
+    with connect(f"ws://127.0.0.1:{PORT}/ws", open_timeout=5) as websocket:
+        started = time.time()
+        for i, character_id in enumerate(character_ids):
+            websocket.send(json.dumps({"request_id": f"r{i}", "character_id": character_id,
+                                       "session_id": "player_1", "message": "Any news?"}))
+        frames = collect(websocket, [f"r{i}" for i in range(len(character_ids))])
+        elapsed = time.time() - started
+
+    done = {frame["request_id"]: frame for frame in frames if frame["type"] == "done"}
+    chunks = {}
+    for frame in frames:
+        if frame["type"] == "chunk":
+            chunks[frame["request_id"]] = chunks.get(frame["request_id"], "") + frame["text"]
+    ok = len(done) == len(character_ids) and all(chunks.get(rid, "").strip() == reply["response"]
+                                                 for rid, reply in done.items())
+    if ok and elapsed < LATENCY * len(character_ids):
+        print(f"✅ {len(character_ids)} NPC replies streamed over one socket in {elapsed:.2f}s")
+        return True
+    print(f"❌ Multiplexed replies: {len(done)} done, {elapsed:.2f}s, frames {frames[:4]}")
+    return False
+
+def check_errors(character_id):
+    """Bad frames, envelopes and unknown characters get error frames; the socket stays open"""
+    with connect(f"ws://127.0.0.1:{PORT}/ws", open_timeout=5) as websocket:
+        websocket.send(json.dumps({"request_id": "bad", "message": "Hello"}))
+        websocket.send(json.dumps({"request_id": "missing", "character_id": "char_404",
+                                   "session_id": "player_1", "message": "Hello"}))
+        websocket.send(json.dumps(["not", "an", "object"]))
+        websocket.send("not json")
+        errors = []
+        while len(errors) < 4:
+            frame = json.loads(websocket.recv(timeout=10))
+            if frame["type"] == "error":
+                errors.append(frame)
+    frames = {frame["request_id"]: frame for frame in errors}
+    undecodable = [frame.get("status") for frame in errors if frame["request_id"] is None]
+    # The per-session socket answers bad frames with errors instead of dropping the connection
+    with connect(f"ws://127.0.0.1:{PORT}/ws/{character_id}/player_errors", open_timeout=5) as websocket:
+        websocket.send(json.dumps("Hello"))
+        websocket.send("not json")
+        websocket.send(json.dumps({"request_id": "nomessage"}))
+        session_frames = [json.loads(websocket.recv(timeout=5)) for _ in range(3)]
+    with connect(f"ws://127.0.0.1:{PORT}/ws/{character_id}/player_errors", subprotocols=["msgpack"],
+                 open_timeout=5) as websocket:
+        # 0xc1 is never used in msgpack
+        websocket.send(b"\xc1")
+        binary_frame = msgpack.unpackb(websocket.recv(timeout=5), raw=False)
+    if (frames["bad"].get("status") == 400 and frames["missing"].get("status") == 404
+            and undecodable == [400, 400]
+            and [frame.get("status") for frame in session_frames] == [400, 400, 400]
+            and session_frames[2].get("request_id") == "nomessage"
+            and binary_frame.get("status") == 400):
+        print("✅ Undecodable frames, invalid envelopes and unknown characters return error frames")
+        return True
+    print(f"❌ Unexpected error frames: {errors}, {session_frames}, {binary_frame}")
+    return False
+
+def check_history(character_id):
+    """Multiplexed turns are saved to the session history like HTTP ones"""
+    turns = requests.get(f"{BASE}/api/conversation/{character_id}/player_1", timeout=5).json()["conversation"]
+    if len(turns) == 2 and turns[0]["content"] == "Any news?":
+        print("✅ Multiplexed turns are stored in the conversation history")
+        return True
+    print(f"❌ Unexpected history: {turns}")
+    return False
+
+def check_supersede(character_id):
+    """A newer message cancels the session's running generation; opted-out ones run alongside"""
+    with connect(f"ws://127.0.0.1:{PORT}/ws", open_timeout=5) as websocket:
+        envelope = {"character_id": character_id, "session_id": "player_2"}
+        websocket.send(json.dumps({**envelope, "request_id": "old", "message": "Where is the inn?"}))
+        time.sleep(DEBOUNCE_MS / 1000 + 0.3)
+        websocket.send(json.dumps({**envelope, "request_id": "new", "message": "Where is the tavern?"}))
+        websocket.send(json.dumps({**envelope, "request_id": "side", "message": "Nice hat.", "supersede": False}))
+        frames = collect(websocket, ["old", "new", "side"])
+    final = {frame["request_id"]: frame for frame in frames if frame["type"] in ("done", "cancelled")}
+    if (final["old"]["type"] == "cancelled" and final["old"]["reason"] == "superseded"
+            and final["new"]["type"] == "done" and final["side"]["type"] == "done"):
+        print("✅ A newer message supersedes the running turn; supersede=false runs alongside")
+        return True
+    print(f"❌ Unexpected supersede frames: {final}")
+    return False
+
+def check_coalesce(character_id):
+    """Messages inside the debounce window become one turn answered once"""
+    with connect(f"ws://127.0.0.1:{PORT}/ws/{character_id}/player_3", open_timeout=5) as websocket:
+        websocket.send(json.dumps({"request_id": "a", "message": "Hello."}))
+        websocket.send(json.dumps({"request_id": "b", "message": "Any work for me?"}))
+        first = json.loads(websocket.recv(timeout=10))
+        second = json.loads(websocket.recv(timeout=10))
+    turns = requests.get(f"{BASE}/api/conversation/{character_id}/player_3", timeout=5).json()["conversation"]
+    if (first.get("type") == "cancelled" and first["reason"] == "coalesced" and first["replaced_by"] == "b"
+            and second.get("request_id") == "b" and "response" in second and len(turns) == 2
+            and turns[0]["content"] == "Hello.\nAny work for me?"):
+        print("✅ Rapid messages are coalesced into one provider call")
+        return True
+    print(f"❌ Unexpected coalescing: {first}, {second}, history {turns}")
+    return False
+
+def check_resume(character_id):
+    """Reconnecting clients resume an in-progress or finished reply from their last seq"""
+    url = f"ws://127.0.0.1:{PORT}/ws/{character_id}/player_4"
+    # Dropped before the first chunk: the reply keeps generating into the buffer
+    with connect(url, open_timeout=5) as websocket:
+        websocket.send(json.dumps({"request_id": "live", "message": "Tell me a story.", "stream": True}))
+    with connect(url, open_timeout=5) as websocket:
+        websocket.send(json.dumps({"type": "resume", "request_id": "live", "last_seq": 0}))
+        live = collect(websocket, ["live"])
+    # Dropped after the first chunk: the rest is replayed from the finished buffer
+    with connect(url, open_timeout=5) as websocket:
+        websocket.send(json.dumps({"request_id": "done", "message": "And then?", "stream": True}))
+        first = json.loads(websocket.recv(timeout=10))
+    with connect(url, open_timeout=5) as websocket:
+        websocket.send(json.dumps({"type": "resume", "request_id": "done", "last_seq": first["seq"]}))
+        rest = collect(websocket, ["done"])
+        websocket.send(json.dumps({"type": "resume", "request_id": "unknown"}))
+        missing = json.loads(websocket.recv(timeout=10))
+    turns = requests.get(f"{BASE}/api/conversation/{character_id}/player_4", timeout=5).json()["conversation"]
+
+    text = first["text"] + "".join(frame["text"] for frame in rest if frame["type"] == "chunk")
+    ok = (live[-1]["type"] == "done" and [frame["seq"] for frame in live] == list(range(1, len(live) + 1))
+          and rest[0]["seq"] == first["seq"] + 1 and rest[-1]["type"] == "done"
+          and text.strip() == rest[-1]["response"] and missing.get("status") == 404 and len(turns) == 4)
+    if ok:
+        print("✅ Reconnected clients resume in-progress and finished replies without regenerating")
+        return True
+    print(f"❌ Unexpected resume: live {live[-1:]}, rest {rest[:1]}, missing {missing}, {len(turns)} turns")
+    return False
+
+def main():
+    print("🧪 Multiplexed WebSocket test")
+    print("=" * 50)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DIALOGUE_PROVIDER="fake", STATE_DB_PATH=os.path.join(tmp, "state.db"),
+                   JOB_DB_PATH=os.path.join(tmp, "jobs.db"), WS_DEBOUNCE_MS=str(DEBOUNCE_MS))
+        server = subprocess.Popen([sys.executable, "-c", SLOW_WORKER], cwd=BACKEND_DIR, env=env)
+        try:
+            if not wait_until_ready(server):
+                print("❌ Backend did not start")
+                return 1
+            character_ids = [requests.post(f"{BASE}/api/character/create", json=profile, timeout=10).json()["character_id"]
+                             for profile in PROFILES]
+            results = [check_interleaved(character_ids), check_errors(character_ids[0]), check_history(character_ids[0]),
+                       check_supersede(character_ids[1]), check_coalesce(character_ids[1]), check_resume(character_ids[1])]
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    print("=" * 50)
+    if all(results):
+        print("🎉 All WebSocket turn checks passed")
+        return 0
+    print("❌ Some WebSocket turn checks failed")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())